@@ -44,6 +44,11 @@ class JobPluginInterface(PluginBaseInterface):
         errormsg = "Not implemented plugin method called: service_list()"
         self.log_error_and_raise(SAGAError.NotImplemented, errormsg) 
 
+    def service_list_filtered(self, service_obj, user=None, state=None,
+                              name_prefix=None, snapshot=False):
+        errormsg = "Not implemented plugin method called: service_list_filtered()"
+        self.log_error_and_raise(SAGAError.NotImplemented, errormsg) 
+
     def service_get_job(self, service_obj, job_id):
         errormsg = "Not implemented plugin method called: service_get_job()"
         self.log_error_and_raise(SAGAError.NotImplemented, errormsg)
@@ -110,6 +115,10 @@ class JobPluginInterface(PluginBaseInterface):
         errormsg = "Not implemented plugin method called: job_run()"
         self.log_error_and_raise(SAGAError.NotImplemented, errormsg) 
 
+    def job_run_async(self, job_obj):
+        # plugins that can't submit in the background simply block
+        return self.job_run(job_obj)
+
     def job_wait(self, job_obj, timeout):
         errormsg = "Not implemented plugin method called: job_wait()"
         self.log_error_and_raise(SAGAError.NotImplemented, errormsg)
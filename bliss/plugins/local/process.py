@@ -13,6 +13,7 @@ import subprocess
 import bliss.saga
 
 from bliss.utils import which
+from bliss.utils.dependencies import DependencyGate
 
 class LocalJobProcess(object):
     '''A wrapper around a subprocess'''
@@ -36,6 +37,10 @@ class LocalJobProcess(object):
         self.number_of_processes = 1
         self.use_mpirun = False
 
+        self._job_output = None
+        self._job_error = None
+        self._gate = None
+
     def __del__(self):
         if self._job_output is not None:
             self._job_output.close()
@@ -44,6 +49,30 @@ class LocalJobProcess(object):
 
 
     def run(self, jd):
+        if jd.dependencies is not None:
+            # there's no scheduler that could hold the job, so it's
+            # started from here once its dependencies have finished
+            self.state = bliss.saga.job.Job.Pending
+            self._gate = DependencyGate(jd, lambda: self._start(jd), self._skip,
+                                        name="LocalJobGate(%s)" % self.executable)
+            self._gate.open()
+        else:
+            self._run(jd)
+
+    def _start(self, jd):
+        '''Called by the dependency gate'''
+        try:
+            self._run(jd)
+        except Exception, ex:
+            self.pi.log_warning("Couldn't start job: %s" % ex)
+            self.state = bliss.saga.job.Job.Failed
+
+    def _skip(self, reason):
+        '''Called by the dependency gate'''
+        self.pi.log_info("Not starting job: %s" % reason)
+        self.state = bliss.saga.job.Job.Canceled
+
+    def _run(self, jd):
         if jd.output is not None:
             if os.path.isabs(jd.output):
                 self._job_output = open(jd.output,"w")  
@@ -126,11 +155,25 @@ class LocalJobProcess(object):
         return self.state
 
     def terminate(self):
+        if self._gate is not None and self._gate.cancel():
+            self.state = bliss.saga.job.Job.Canceled
+            return
         self.prochandle.terminate()
         self.state = bliss.saga.job.Job.Canceled
 
 
     def wait(self, timeout):
+        if self._gate is not None:
+            # the job may not have been started yet
+            t_beginning = time.time()
+            if timeout == -1 or not timeout:
+                self._gate.wait()
+            elif not self._gate.wait(timeout):
+                return
+            else:
+                timeout = max(timeout - (time.time() - t_beginning), 0.1)
+            if self.prochandle is None:
+                return # (canceled or skipped)
         if timeout == -1:
             self.returncode = self.prochandle.wait()
         else:
@@ -74,7 +74,7 @@ class BookKeeper:
     def remove_container_object(self, container_obj, service_obj):
         service_key = service_obj._id()
         container_key = container_obj._id()
-        self.objects[service_key]['containers'].remove(container_key)
+        del self.objects[service_key]['containers'][container_key]
 
     ######################################################################
     ## 
@@ -130,14 +130,24 @@ class BookKeeper:
     ######################################################################
     ## 
     def get_jobid_for_job(self, job_obj):
-        '''Return the local process object for a given job'''
-
+        '''Return the local process object for a given job. If the job
+           was run with block=False, waits until it has been submitted.
+        '''
         try:
             service_key = self.get_service_for_job(job_obj)._id()
             job_key = job_obj._id()  
-            return self.objects[service_key]['jobs'][job_key]['jobid']
+            entry = self.objects[service_key]
+            entry['jobs'][job_key]
         except Exception, ex:
             self.parent.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "INTERNAL ERROR: Job object %s is not associated with a process." \
               % (job_obj))
+
+        try:
+            entry['pbs_instance'].settle_job(job_obj)
+        except Exception, ex:
+            self.parent.log_error_and_raise(bliss.saga.Error.NoSuccess, 
+              "Job submission failed: %s" % (str(ex)))
+        # (re-read, the job id is only known once the job is submitted)
+        return entry['jobs'][job_key]['jobid']
  
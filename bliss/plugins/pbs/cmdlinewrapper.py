@@ -5,15 +5,30 @@ __author__    = "Ole Christian Weidner"
 __copyright__ = "Copyright 2011-2012, Ole Christian Weidner"
 __license__   = "MIT"
 
+import re
 import copy
 import socket
 import time
 import string
 import getpass
+import threading
+import urlparse
 import subprocess
+import xml.parsers.expat
 import bliss.saga
 
-from bliss.utils.command_wrapper import CommandWrapper, CommandWrapperException
+from bliss.utils.command_wrapper import CommandWrapper, CommandWrapperException, get_ssh_backend
+from bliss.utils.connectionpool import PooledCommandWrapper
+from bliss.utils.querycache import QueryCache, QueryCacheException, get_query_ttl
+from bliss.utils.statepoller import JobStatePoller
+from bliss.utils.jobcache import JobCache, JobCacheException, get_job_cache_size
+from bliss.utils.refresher import Refresher, RefresherException, get_service_info_ttl
+from bliss.utils.nodeinventory import NodeInventoryBuilder, memory_to_kb
+from bliss.utils.submitpipeline import SubmissionPipeline
+from bliss.utils import bulksubmit
+from bliss.utils import jobstatus
+from bliss.utils import dependencies
+from bliss.utils.accounting import AccountingTail
 from bliss.utils.jobid import JobID
 
 ################################################################################
@@ -39,12 +54,120 @@ def pbs_to_saga_jobstate(pbsjs):
         return bliss.saga.job.Job.Pending
     elif pbsjs == 'X':
         return bliss.saga.job.Job.Canceled
+    elif pbsjs == 'A':
+        return bliss.saga.job.Job.Failed
     else:
         return bliss.saga.job.Job.Unknown
 
 ################################################################################
 ################################################################################
 
+# 'key = value' lines of a pbsnodes record
+_PBSNODES_ATTR = re.compile(r'^[ \t]+([^ \t=]+) = (.*)$', re.M)
+# processor slots of a job, i.e., '0/123.host' or '1-3/123.host' (TORQUE)
+# and '123.host/0' (PBS Pro)
+_PBSNODES_SLOTS = re.compile(r'(?:^|,)\s*(\d+)(?:-(\d+))?/')
+_PBSNODES_SLOTS_PRO = re.compile(r'/(\d+)(?:-(\d+))?\s*(?:,|$)')
+
+def _pbsnodes_used_slots(jobs):
+    '''Counts the processors in a pbsnodes 'jobs' attribute'''
+    slots = _PBSNODES_SLOTS.findall(jobs) or _PBSNODES_SLOTS_PRO.findall(jobs)
+    used = len(slots)
+    for (first, last) in slots:
+        if last:
+            used += int(last) - int(first)
+    return used
+
+def _pbsnodes_status(status, key, default):
+    '''Returns the value of 'key' in a pbsnodes 'status' attribute'''
+    start = status.find(key + "=")
+    while start > 0 and status[start-1] != ',':
+        start = status.find(key + "=", start+1)
+    if start < 0:
+        return default
+    start += len(key) + 1
+    end = status.find(',', start)
+    if end < 0:
+        return status[start:]
+    return status[start:end]
+
+def parse_pbsnodes(pbsnodes_output):
+    '''Parses the output of 'pbsnodes -a' into a NodeInventory'''
+    builder = NodeInventoryBuilder()
+    for node_raw in pbsnodes_output.split('\n\n'):
+        node_raw = node_raw.strip('\n')
+        name = node_raw.split('\n', 1)[0].strip()
+        if not name:
+            continue
+        node_data = dict(_PBSNODES_ATTR.findall(node_raw))
+
+        # TORQUE reports 'np' and a 'status', PBS Pro 'resources_available'
+        status = node_data.get('status', '')
+        np = node_data.get('np', node_data.get('resources_available.ncpus',
+                                               node_data.get('pcpus', '0')))
+        physmem = _pbsnodes_status(status, 'physmem',
+                                   node_data.get('resources_available.mem', '0'))
+        try:
+            np = int(np)
+        except ValueError:
+            np = 0
+        try:
+            load = float(_pbsnodes_status(status, 'loadave', '0'))
+        except ValueError:
+            load = 0.0
+        properties = [prop.strip() for prop \
+                      in node_data.get('properties', '').split(',') if prop.strip()]
+
+        builder.append(name, np=np,
+                       used=_pbsnodes_used_slots(node_data.get('jobs', '')),
+                       state=node_data.get('state', 'unknown'),
+                       physmem=memory_to_kb(physmem), load=load,
+                       properties=properties)
+    return builder.build()
+
+def _pbs_seconds(value):
+    '''converts a PBS duration ('01:02:03') into seconds'''
+    seconds = 0.0
+    for part in value.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_pbs_accounting(lines):
+    '''parses lines of the PBS accounting logs ('date;type;jobid;...')
+       into a dictionary {native id: accounting record}. only the end
+       (E), delete (D) and abort (A) records are used. the first line of
+       a tail may be incomplete -- lines that don't parse are skipped.
+    '''
+    records = dict()
+    for line in lines:
+        parts = line.split(';', 3)
+        if len(parts) < 4 or parts[1] not in ['E', 'D', 'A']:
+            continue
+        record = records.setdefault(parts[2], {'deleted': False,
+          'aborted': False, 'exit_status': None, 'ru_wallclock': None,
+          'maxvmem': None})
+        if parts[1] == 'D':
+            record['deleted'] = True
+        elif parts[1] == 'A':
+            record['aborted'] = True
+        else:
+            attributes = dict([item.split('=', 1) for item \
+                               in parts[3].split() if item.find('=') != -1])
+            try:
+                record['exit_status'] = int(attributes['Exit_status'])
+                if 'resources_used.walltime' in attributes:
+                    record['ru_wallclock'] = \
+                      _pbs_seconds(attributes['resources_used.walltime'])
+                if 'resources_used.vmem' in attributes:
+                    record['maxvmem'] = 1024 * \
+                      memory_to_kb(attributes['resources_used.vmem'])
+            except (KeyError, ValueError):
+                continue
+    return records
+
+################################################################################
+################################################################################
+
 class PBSServiceInfo(object):
     '''Encapsulates infos about a PBS cluster as returned by qstat & pbsnodes.
     '''
@@ -88,42 +211,23 @@ class PBSServiceInfo(object):
         self.GlueCEStateWaitingJobs = str(jobs_waiting)
         self.GlueCEStateTotalJobs = str(jobs_running+jobs_waiting)
 
+        # per-node details, column by column
+        self.nodes = None
+
         if pbsnodes_output is not None:
             # get all sorts of useful info about the 
             # PBS cluster and translate it into GLUE
             # schema attributes
-            cpus_total   = 0
-            cpus_free    = 0
-            cpus_pernode = 0
-
-            self._nodeinfo=list()
-            for node_raw in pbsnodes_output.split('\n\n'):
-                lines = node_raw.split('\n')
-                node_data = dict()
-                for line in lines[1:]:
-                    if line: 
-                        (key, value) = line.split(" = ")
-                        key = key.strip()
-                        node_data[key] = value
-                self._nodeinfo.append(node_data)
-                
-                try: 
-                    cpus_total += int(node_data['np'])
-                    if node_data['state'] == 'free':
-                        try:
-                            cpus_free += int(node_data['np'])
-                            for item in node_data['status'].split(','):
-                                (key, val) = item.split("=")
-                                if key == 'physmem':
-                                    self.GlueHostMainMemoryRAMSize = val.replace('kb','')
-                        except Exception, ex:
-                            plugin.log_wrning("Can't determine GlueHostMainMemoryRAMSize.")
-                except Exception, ex:
-                    pass # this is messy, but it seems to work
-
-            self.GlueSubClusterPhysicalCPUs = str(cpus_total)
-            self.GlueCEStateFreeCPUs = str(cpus_free)
-            self.GlueHostArchitectureSMPSize = self._nodeinfo[0]['np']
+            self.nodes = parse_pbsnodes(pbsnodes_output)
+
+            free = self.nodes.select(state='free')
+            self.GlueSubClusterPhysicalCPUs = str(self.nodes.cores())
+            self.GlueCEStateFreeCPUs = str(self.nodes.cores(free))
+            physmem = self.nodes.values(self.nodes.physmem, free)
+            if len(physmem) > 0 and physmem[-1] > 0:
+                self.GlueHostMainMemoryRAMSize = str(int(physmem[-1]))
+            if len(self.nodes) > 0:
+                self.GlueHostArchitectureSMPSize = str(self.nodes.np[0])
 
 
     def has_attribute(self, key):
@@ -139,31 +243,48 @@ class PBSServiceInfo(object):
 ################################################################################
 
 class PBSJobInfo(object):
-    '''Encapsulates infos about a PBS job as returned by qstat -f1.
+    '''Encapsulates infos about a PBS job as returned by qstat -f1 or
+       qstat -x. Only the fields that we need are kept.
     '''
 
+    __slots__ = ('_jobid', '_job_state', '_exit_status', '_queue',
+                 '_Output_Path', '_Error_Path', '_walltime', '_Job_Name',
+                 '_ru_wallclock', '_maxvmem')
+
     def __init__(self, qstat_f_output, plugin):
         '''Constructor: initialize from qstat -f <jobid> string.
         '''
-        
-        #plugin.log_debug("Got raw qstat output: %s" % qstat_f_output)
-        if len(qstat_f_output) > 0:
-            try:
-                lines = qstat_f_output.split("\n")
-                self._jobid = lines[0].split(":")[1].strip()
-            except Exception, ex:
-                raise Exception("Couldn't parse %s: %s" \
-                  % (qstat_f_output, ex))
-
-            for line in lines[1:]:
-                try: 
-                    (key, value) = line.split(" = ")
-                    key = "_%s" % key.strip()
-                    self.__dict__[key] = value
-                except Exception, ex:
-                    pass
-            #plugin.log_debug("Parsed qstat output: %s" % str(self.__dict__))
+        self._jobid       = None
+        self._job_state   = None
+        self._exit_status = None
+        self._queue       = None
+        self._Output_Path = None
+        self._Error_Path  = None
+        self._walltime    = None
+        self._Job_Name    = None
+        self._ru_wallclock = None
+        self._maxvmem     = None
 
+        if len(qstat_f_output) > 0:
+            parser = PBSQstatParser()
+            parser.feed(qstat_f_output)
+            records = parser.close()
+            if len(records) == 0:
+                raise Exception("Couldn't parse %s" % qstat_f_output)
+            for slot in PBSJobInfo.__slots__:
+                setattr(self, slot, getattr(records[0], slot))
+
+    def tombstone(self):
+        '''Returns a copy that only keeps the job id, state, exit code
+           and resource usage (for jobs that have finished).
+        '''
+        tombstone = PBSJobInfo("", None)
+        tombstone._jobid = self._jobid
+        tombstone._job_state = self._job_state
+        tombstone._exit_status = self._exit_status
+        tombstone._ru_wallclock = self._ru_wallclock
+        tombstone._maxvmem = self._maxvmem
+        return tombstone
 
     @property 
     def state(self):
@@ -173,9 +294,13 @@ class PBSJobInfo(object):
     def jobid(self):
         return self._jobid
 
+    @property 
+    def name(self):
+        return self._Job_Name
+
     @property 
     def walltime_limit(self):
-        return self._Resource_List.walltime
+        return self._walltime
 
     @property 
     def output_path(self):
@@ -191,11 +316,143 @@ class PBSJobInfo(object):
 
     @property 
     def exitcode(self):
-        if '_exit_status' in self.__dict__:
-            return self._exit_status
-        else:
-            return None
+        return self._exit_status
 
+    @property 
+    def ru_wallclock(self):
+        '''wall clock time in seconds (from the accounting)'''
+        return self._ru_wallclock
+
+    @property 
+    def maxvmem(self):
+        '''max. virtual memory in bytes (from the accounting)'''
+        return self._maxvmem
+
+################################################################################
+################################################################################
+
+class PBSQstatParser(object):
+    '''Streaming parser for 'qstat -f1' output. Output chunks are fed in
+       as they arrive and turned into PBSJobInfos job by job. A single
+       regular expression picks out the few lines that we need, so all
+       other lines are skipped without being split up.
+    '''
+
+    # qstat attribute -> PBSJobInfo slot
+    fields = {'job_state'             : '_job_state',
+              'exit_status'           : '_exit_status',
+              'queue'                 : '_queue',
+              'Output_Path'           : '_Output_Path',
+              'Error_Path'            : '_Error_Path',
+              'Job_Name'              : '_Job_Name',
+              'Resource_List.walltime': '_walltime'}
+
+    # matches start with the newline in front of a line, which is a lot
+    # faster to scan for than a '^' anchor
+    _pattern = re.compile(r'\nJob Id:([^\n]*)|\n[ \t]+(%s) = ([^\n]*)' \
+      % "|".join([re.escape(key) for key in fields.keys()]))
+
+    def __init__(self):
+        '''Constructor'''
+        self.records = list()
+        self._record = None
+        self._rest = "\n"
+
+    def feed(self, chunk):
+        '''Parses the next chunk of output'''
+        data = self._rest + chunk
+        # the last (incomplete) line is parsed with the next chunk
+        end = data.rfind("\n")
+        self._rest = data[end:]
+        self._parse(data, end)
+
+    def close(self):
+        '''Finishes parsing and returns the records'''
+        self._parse(self._rest, len(self._rest))
+        self._rest = "\n"
+        return self.records
+
+    def _parse(self, data, end):
+        fields = self.fields
+        record = self._record
+        for match in self._pattern.finditer(data, 0, end):
+            (jobid, key, value) = match.groups()
+            if jobid is not None:
+                record = PBSJobInfo("", None)
+                record._jobid = jobid.strip()
+                self.records.append(record)
+            elif record is not None:
+                setattr(record, fields[key], value.strip())
+        self._record = record
+
+################################################################################
+################################################################################
+
+class PBSQstatXMLParser(object):
+    '''Incremental (expat) parser for TORQUE's 'qstat -x' output, with
+       the same interface as PBSQstatParser. The handlers do as little as
+       possible, since expat calls them for every single element.
+    '''
+
+    # XML element -> PBSJobInfo slot
+    fields = {'Job_Id'     : '_jobid',
+              'job_state'  : '_job_state',
+              'exit_status': '_exit_status',
+              'queue'      : '_queue',
+              'Output_Path': '_Output_Path',
+              'Error_Path' : '_Error_Path',
+              'Job_Name'   : '_Job_Name',
+              'walltime'   : '_walltime'}
+
+    def __init__(self):
+        '''Constructor'''
+        self.records = list()
+        self._record = None
+        self._slot = None
+        self._limits = False  # inside <Resource_List>
+        self._empty = True
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.returns_unicode = False
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._data
+
+    def feed(self, chunk):
+        '''Parses the next chunk of output'''
+        if len(chunk.strip()) > 0:
+            self._empty = False
+        self._parser.Parse(chunk, False)
+
+    def close(self):
+        '''Finishes parsing and returns the records'''
+        # qstat prints nothing at all if there are no jobs
+        if not self._empty:
+            self._parser.Parse("", True)
+        return self.records
+
+    def _start(self, name, attrs):
+        slot = self.fields.get(name)
+        if slot is not None:
+            # the walltime limit, not <resources_used><walltime>
+            if self._record is not None and (name != 'walltime' or self._limits):
+                self._slot = slot
+                setattr(self._record, slot, "")
+        elif name == 'Job':
+            self._record = PBSJobInfo("", None)
+            self.records.append(self._record)
+        elif name == 'Resource_List':
+            self._limits = True
+        elif name == 'resources_used':
+            self._limits = False
+
+    def _end(self, name):
+        self._slot = None
+
+    def _data(self, data):
+        if self._slot is not None:
+            setattr(self._record, self._slot,
+                    getattr(self._record, self._slot) + data)
 
 ################################################################################
 ################################################################################
@@ -204,6 +461,74 @@ class PBSService:
     '''Encapsulates PBS command line tools.
     '''
 
+    # seconds for which the results of read-only queries are reused.
+    # can be overridden per service with a '?query_ttl=...' URL parameter.
+    query_cache_ttl = 2.0
+
+    # seconds for which service infos (qstat -a, pbsnodes -a) are
+    # considered fresh. older ones are still served while a background
+    # thread fetches new ones. can be overridden per service with a
+    # '?service_info_ttl=...' URL parameter.
+    service_info_ttl = 15.0
+
+    # max. number of jobs whose infos are kept (least recently used ones
+    # are dropped first). can be overridden per service with a
+    # '?job_cache_size=...' URL parameter.
+    job_cache_size = 10000
+
+    # max. number of job ids per bulk 'qstat -f1' command line
+    bulk_query_size = 100
+
+    # 'text' (qstat -f1) or 'xml' (qstat -x, TORQUE only). can be
+    # overridden per service with a '?qstat_format=...' URL parameter.
+    qstat_format = "text"
+
+    # 'torque' or 'pbspro'. they differ in how job arrays are submitted
+    # ('qsub -t' vs. 'qsub -J'). can be overridden per service with a
+    # '?pbs_flavor=...' URL parameter.
+    pbs_flavor = "torque"
+
+    # max. number of job scripts per bulk submission command
+    bulk_submit_size = 100
+
+    # where job scripts are uploaded to before they are submitted
+    # (relative to the remote home directory)
+    spool_dir = ".bliss/spool"
+
+    # where jobs leave their start and end times and exit codes
+    # (relative to the remote home directory). each service uses a
+    # subdirectory named after its host.
+    status_dir = ".bliss/status"
+
+    # markers that haven't been collected after that many days are
+    # removed (once per service)
+    status_max_age = 7
+
+    # the accounting log that the exit codes and resource usage of
+    # finished jobs are read from (a remote shell expression). it is
+    # read incrementally -- if it's readable at all, which usually
+    # requires to run on the PBS server host.
+    accounting_file = "${PBS_HOME:-/var/spool/torque}/server_priv/accounting/$(date +%Y%m%d)"
+
+    # max. number of jobs that Job.run(block=False) queues up before it
+    # blocks until some of them have been submitted
+    max_in_flight = 500
+
+    # max. number of elements per 'qsub -t' job array
+    array_max_size = 1000
+
+    # where the command lines of job array elements are staged (relative
+    # to the remote home directory)
+    array_param_dir = ".bliss/arrays"
+
+    # staged command lines of arrays that haven't changed for that many
+    # days (e.g., because they were canceled) are removed
+    array_param_max_age = 30
+
+    # max. length of a staging command line. interactive shells choke
+    # on lines that are longer than 4096 bytes.
+    array_stage_size = 3000
+
     def __init__(self, plugin, service_obj):
         '''Constructor'''
         self._pi    = plugin
@@ -219,19 +544,92 @@ class PBSService:
                 "Can't use %s as a (non-local) hostname in conjunction with pbs://. Try pbs+ssh:// instead" \
                   % (self._url.host))
 
-        # Indicates when the service information was last updated
-        # Service information is updated only every 10 seconds or 
-        # so to avoid crazy network traffic 
-        self._service_info_last_update = 0.0
-        self._service_info = None
+        # service information is fetched on first use only, and then
+        # refreshed in the background to avoid crazy network traffic
+        try:
+            self._service_info = Refresher(self._fetch_service_info,
+              ttl=get_service_info_ttl(self._url, self.service_info_ttl),
+              on_error=lambda ex: self._pi.log_warning(
+                "Couldn't update service info: %s" % ex),
+              name="PBSServiceInfo(%s)" % self._url)
+            self._ppn_known = False
+        except RefresherException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
+
+        # concurrent identical read-only queries (qstat, pbsnodes) share one
+        # execution, and their results are reused for a few seconds
+        try:
+            self._query_cache = QueryCache(ttl=get_query_ttl(self._url,
+                                                             self.query_cache_ttl))
+        except QueryCacheException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
         
-        self._known_jobs = dict()
+        self._qstat_format = self.qstat_format
+        if self._url.query is not None:
+            values = urlparse.parse_qs(self._url.query).get('qstat_format')
+            if values:
+                self._qstat_format = values[-1]
+        if self._qstat_format not in ["text", "xml"]:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter,
+              "Invalid qstat_format '%s'. Valid formats are: text, xml" \
+              % self._qstat_format)
+
+        self._pbs_flavor = self.pbs_flavor
+        if self._url.query is not None:
+            values = urlparse.parse_qs(self._url.query).get('pbs_flavor')
+            if values:
+                self._pbs_flavor = values[-1]
+        if self._pbs_flavor not in ["torque", "pbspro"]:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter,
+              "Invalid pbs_flavor '%s'. Valid flavors are: torque, pbspro" \
+              % self._pbs_flavor)
+
+        # a background thread keeps the states of all active jobs up
+        # to date with one bulk qstat per sweep
+        self._poller = JobStatePoller(self._poll_job_states,
+          final_states=[bliss.saga.job.Job.Done, bliss.saga.job.Job.Failed,
+                        bliss.saga.job.Job.Canceled],
+          queued_states=[bliss.saga.job.Job.Pending],
+          name="PBSStatePoller(%s)" % self._url)
+
+        # non-blocking submissions are queued up and submitted in bulk
+        # by a background thread
+        self._pipeline = SubmissionPipeline(self.submit_jobs,
+          max_in_flight=self.max_in_flight, batch_size=self.bulk_submit_size,
+          name="PBSSubmissionPipeline(%s)" % self._url)
+
+        # the markers of jobs whose exit codes have been collected are
+        # removed with the next sweep
+        self._status_dir = "%s/%s" % (self.status_dir, self._url.host)
+        self._collected = list()
+        self._status_pruned = False
+
+        # accounting records are read when jobs leave the queue. records
+        # of jobs that haven't left it yet (as far as we know) are kept
+        # until they have.
+        self._accounting = AccountingTail(';', '$2 ~ /^[EDA]$/ && '
+          '($2 == "A" || index($4, "user=" u " ") || index($4, "requestor=" u "@"))')
+        self._accounting_lock = threading.RLock()
+        self._accounting_pending = dict()
+
+        # jobs that finished are only remembered by id, state and exit
+        # code, and only up to 'job_cache_size' jobs are remembered at all
+        try:
+            self._known_jobs = JobCache(
+              get_job_cache_size(self._url, self.job_cache_size),
+              is_final=lambda jobinfo: jobinfo.state in [bliss.saga.job.Job.Done,
+                bliss.saga.job.Job.Failed, bliss.saga.job.Job.Canceled],
+              compact=PBSJobInfo.tombstone, on_evict=self._poller.forget)
+        except JobCacheException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
+
 
     def _known_jobs_update(self, native_jobid, job_info):
-        self._known_jobs[native_jobid] = job_info
+        return self._known_jobs.put(native_jobid, job_info)
 
     def _known_jobs_remove(self, native_jobid):
-        self._known_jobs.remove(native_jobid)
+        self._known_jobs.pop(native_jobid)
+        self._poller.forget(native_jobid)
 
     def _known_jobs_exists(self, native_jobid):
         if native_jobid in self._known_jobs:
@@ -240,20 +638,40 @@ class PBSService:
             return False
 
     def _known_jobs_is_final(self, native_jobid):
-        if self._known_jobs[native_jobid].state == bliss.saga.job.Job.Done:
+        # the job may have been evicted in the meantime
+        jobinfo = self._known_jobs.get(native_jobid)
+        if jobinfo is None:
+            return False
+        elif jobinfo.state == bliss.saga.job.Job.Done:
             return True
-        elif self._known_jobs[native_jobid].state == bliss.saga.job.Job.Failed:
+        elif jobinfo.state == bliss.saga.job.Job.Failed:
             return True
-        elif self._known_jobs[native_jobid].state == bliss.saga.job.Job.Canceled:
+        elif jobinfo.state == bliss.saga.job.Job.Canceled:
             return True
         else:
             return False
  
     ######################################################################
     ##
-    def _check_context(self): 
-        '''sets self._cw to a usable access configuration or throws'''
-        
+    def _run_query(self, command):
+        '''Runs a read-only command via the query cache'''
+        return self._query_cache.get(command, lambda: self._cw.run(command))
+
+    def _run_queries(self, commands):
+        '''Runs a list of read-only commands via the query cache'''
+        return self._query_cache.get(tuple(commands),
+                                     lambda: self._cw.run_many(commands))
+
+    def get_query_stats(self):
+        '''Returns the query cache's hit, miss and coalesced counters'''
+        return self._query_cache.stats()
+
+    def get_job_cache_stats(self):
+        '''Returns the number of remembered (and finished) jobs and the
+           job cache's hit, miss, eviction and compaction counters
+        '''
+        return self._known_jobs.stats()
+
     ######################################################################
     ##
     def _check_context(self): 
@@ -265,7 +683,10 @@ class PBSService:
             self._use_ssh = False
             try:
                 ## EXECUTE SHELL COMMAND
-                cw = CommandWrapper.initAsLocalWrapper(logger=self._pi)
+                cw = CommandWrapper.initAsLocalWrapper(logger=self._pi, 
+                                                       persistent=True)
+                # a pool of long-lived shells instead of a fork per command
+                cw = PooledCommandWrapper(cw)
                 cw.connect()
                 self._cw = cw
             except CommandWrapperException, ex:
@@ -282,21 +703,25 @@ class PBSService:
                 if ctx.type is bliss.saga.Context.SSH:
                     credentials.append({'username':ctx.userid,
                                         'userkey' :ctx.userkey,
+                                        'backend' :ctx.sshbackend,
                                         'mode' : 'context'})
                     # if a username is defined in the url, we also 
                     # want to try that
                     if self._url.username is not None:
                         credentials.append({'username':self._url.username,
                                             'userkey' :ctx.userkey,
+                                            'backend' :ctx.sshbackend,
                                             'mode' : 'context+url.username'}) 
             # next, we construct credentials with just usernames
             if self._url.username is not None:
                 credentials.append({'username': self._url.username,
                                     'userkey' : None,
+                                    'backend' : None,
                                     'mode' : 'url.username'}) 
 
             credentials.append({'username': getpass.getuser(),
                                 'userkey' : None,
+                                'backend' : None,
                                 'mode' : 'local.username'}) 
 
             # now, we simply iterate over the credentials and try to
@@ -307,15 +732,18 @@ class PBSService:
                     cw = CommandWrapper.initAsSSHWrapper(logger=self._pi,
                                                          username=cred['username'], 
                                                          hostname=self._url.host, 
-                                                         userkey=cred['userkey'])
+                                                         userkey=cred['userkey'],
+                                                         backend=get_ssh_backend(self._url, cred['backend']))
+                    # share sessions with other services on the same host
+                    cw = PooledCommandWrapper(cw)
                     cw.connect()
                     self._cw = cw
                     self._pi.log_info("SSH: Using credential %s to access %s." \
                         % (cred, self._url.host))                            
                     break
                 except CommandWrapperException, ex:
-                    self._pi.log_error("SSH: Can't use credential %s to access %s." \
-                        % (cred, self._url.host))       
+                    self._pi.log_error("SSH: Can't use credential %s to access %s: %s" \
+                        % (cred, self._url.host, ex))       
           
         ################################################################# 
         ## ...+GSISSH:// URL
@@ -327,21 +755,25 @@ class PBSService:
                 if ctx.type is bliss.saga.Context.X509:
                     credentials.append({'username':ctx.userid,
                                         'x509_userproxy' :ctx.userproxy,
+                                        'backend' :ctx.sshbackend,
                                         'mode' : 'context'})
                     # if a username is defined in the url, we also 
                     # want to try that
                     if self._url.username is not None:
                         credentials.append({'username':self._url.username,
                                             'x509_userproxy' :ctx.userproxy,
+                                            'backend' :ctx.sshbackend,
                                             'mode' : 'context+url.username'}) 
             # next, we construct credentials with just usernames
             if self._url.username is not None:
                 credentials.append({'username': self._url.username,
                                     'x509_userproxy' : None,
+                                    'backend' : None,
                                     'mode' : 'url.username'})
 
             credentials.append({'username': getpass.getuser(),
                                 'x509_userproxy' : None,
+                                'backend' : None,
                                 'mode' : 'local.username'}) 
 
             # now, we simply iterate over the credentials and try to
@@ -352,15 +784,18 @@ class PBSService:
                     cw = CommandWrapper.initAsGSISSHWrapper(logger=self._pi,
                                                             username=cred['username'], 
                                                             hostname=self._url.host, 
-                                                            x509_userproxy=cred['x509_userproxy'])
+                                                            x509_userproxy=cred['x509_userproxy'],
+                                                            backend=get_ssh_backend(self._url, cred['backend']))
+                    # share sessions with other services on the same host
+                    cw = PooledCommandWrapper(cw)
                     cw.connect()
                     self._cw = cw
                     self._pi.log_info("GSISSH: Using credential %s to access %s." \
                         % (cred, self._url.host))                            
                     break
                 except CommandWrapperException, ex:
-                    self._pi.log_error("GSISSH: Can't use credential %s to access %s." \
-                        % (cred, self._url.host))       
+                    self._pi.log_error("GSISSH: Can't use credential %s to access %s: %s" \
+                        % (cred, self._url.host, ex))       
            
         # at this point, either self._cw contains a usable 
         # configuration, or the whole thing should go to shit
@@ -376,85 +811,213 @@ class PBSService:
             else:
                 self._pi.log_debug("Found PBS command line tools: %s" \
                                    % (result.stdout.replace('/pbsnodes', '')))
-                   
-            si = self.get_service_info()
-            if si.GlueHostArchitectureSMPSize != None:
-                self._ppn = si.GlueHostArchitectureSMPSize
-          
+
 
     ######################################################################
     ##
+    def _fetch_service_info(self):
+        '''Runs qstat and pbsnodes and returns a new PBSServiceInfo'''
+        self._pi.log_info("Updating service info for %s." % self._url)
+        ## EXECUTE SHELL COMMANDS (in one round trip)
+        (qstat_result, pbsnodes_result) = self._run_queries(["qstat -a", 
+                                                             "pbsnodes -a"])
+        if qstat_result.returncode != 0:
+            raise Exception("Error running 'qstat': %s" % qstat_result.stderr)
+        if pbsnodes_result.returncode != 0:
+            raise Exception("Error running 'pbsnodes': %s" % pbsnodes_result.stderr)
+
+        return PBSServiceInfo(qstat_result.stdout, pbsnodes_result.stdout,
+                              self._pi)
+
     def get_service_info(self):
         '''Returns a single saga.job service description'''
         ## EXECUTE SHELL COMMAND
         if self._cw == None:
             self._check_context()
-        
-        if self._service_info == None:
-            # initial creation
-            self._pi.log_info("Service info cache empty. Updating local service info.")
-            
-            qstat_result = self._cw.run("qstat -a")
-            if qstat_result.returncode != 0:
-                raise Exception("Error running 'qstat': %s" % qstat_result.stdout)
-            
-            pbsnodes_result = self._cw.run("pbsnodes -a")
-            if pbsnodes_result.returncode != 0:
-                raise Exception("Error running 'pbsnodes': %s" % pbsnodes_result.stdout)
-
-            self._service_info = PBSServiceInfo(qstat_result.stdout,
-                                                pbsnodes_result.stdout, self._pi)
-            self._service_info_last_update = time.time()
+        # blocks only the very first time. afterwards, outdated infos
+        # are returned while new ones are fetched in the background.
+        return self._service_info.get()
 
-        else: 
-            if self._service_info_last_update+15.0 < time.time():
-                # older than 15 seconds. update.
-                self._pi.log_info("15s service info cache expired. Updating local service info.")
-                ## EXECUTE SHELL COMMAND
-                qstat_result = self._cw.run("qstat_result -a")
-                if qstat_result.returncode != 0:
-                    raise Exception("Error running 'qstat': %s" % qstat_result.stderr)
-                ## EXECUTE SHELL COMMAND
-                pbsnodes_result = self._cw.run("pbsnodes")
-                if pbsnodes_result.returncode != 0:
-                    raise Exception("Error running 'pbsnodes': %s" % pbsnodes_result.stderr)
+    def get_service_info_stats(self):
+        '''Returns the service info's fresh and stale read counters and
+           its age in seconds
+        '''
+        return self._service_info.stats()
 
-                self._service_info = PBSServiceInfo(qstat_result.stdout,
-                                                    pbsnodes_result.stdout, self._pi)
-                self._service_info_last_update = time.time()
-            else:
-                self._pi.log_info("15s cache not expired yet. Using local service info.")
-        
-        return self._service_info
+    def get_node_inventory(self):
+        '''Returns the NodeInventory of the cluster (from the service
+           info, i.e., possibly a few seconds old)
+        '''
+        return self.get_service_info().nodes
+
+    def _get_ppn(self):
+        '''Returns the number of processors per node. Only jobs that ask
+           for a total_cpu_count need it, so it's determined on demand.
+        '''
+        if not self._ppn_known:
+            si = self.get_service_info()
+            if si.GlueHostArchitectureSMPSize != None:
+                self._ppn = si.GlueHostArchitectureSMPSize
+            self._ppn_known = True
+        return self._ppn
 
     ######################################################################
     ##
-    def list_jobs(self):
-        '''Return the jobs known to qstat'''
-        jobids = []
+    def list_jobs(self, user=None, state=None, name_prefix=None,
+                  snapshot=False):
+        '''Returns an iterator over the jobs known to qstat, as JobIDs or,
+           if 'snapshot' is set, as (JobID, state, queue, exitcode) tuples.
+           The jobs can be filtered by owner, (a list of) SAGA state(s)
+           and job name prefix. The owner and (running / pending) state
+           filters are applied by qstat itself.
+        '''
         if self._cw == None:
             self._check_context()
-       
+
+        if state is None or type(state) == list:
+            states = state
+        else:
+            states = [state]
+
+        if user is None and states is None and name_prefix is None:
+            jobinfos = self._qstat_all()
+        else:
+            jobinfos = self._qstat_filtered(user, states, name_prefix)
+        return self._list_results(jobinfos, states, name_prefix, snapshot)
+
+    def _list_results(self, jobinfos, states, name_prefix, snapshot):
+        '''Filters jobinfos and turns them into list() results'''
+        for jobinfo in jobinfos:
+            if states is not None and jobinfo.state not in states:
+                continue
+            if name_prefix is not None and \
+              not (jobinfo.name or "").startswith(name_prefix):
+                continue
+            jobid = bliss.utils.jobid.JobID(self._url, jobinfo.jobid)
+            if snapshot:
+                exitcode = jobinfo.exitcode
+                if exitcode is not None:
+                    try:
+                        exitcode = int(exitcode)
+                    except ValueError:
+                        pass
+                yield (jobid, jobinfo.state, jobinfo.queue, exitcode)
+            else:
+                yield jobid
+            # jobs of other users etc. aren't remembered -- only the
+            # states of the jobs that we already track are updated.
+            if self._known_jobs_exists(jobinfo.jobid):
+                self._known_jobs_update(jobinfo.jobid, jobinfo)
+
+    def _qstat_all(self):
+        '''Yields the jobinfos of all jobs, parsed as qstat's output
+           comes in
+        '''
         ## EXECUTE SHELL COMMAND 
-        result = self._cw.run("qstat -f1")
+        # the output can be huge -- parse it job by job as it comes in
+        (flags, parser) = self._qstat_flags()
+        result = self._cw.run_stream("qstat %s" % flags)
+        parser = parser()
+        try:
+            for chunk in result.chunks():
+                parser.feed(chunk)
+                # the last record may not be complete yet
+                records = parser.records[:-1]
+                del parser.records[:-1]
+                for jobinfo in records:
+                    yield jobinfo
+        except xml.parsers.expat.ExpatError, ex:
+            result.close()
+            raise Exception("Couldn't parse output of 'qstat': %s" % ex)
+        except GeneratorExit:
+            result.close()
+            raise
+        for jobinfo in self._close_parser(parser):
+            yield jobinfo
         if result.returncode != 0:
             raise Exception("Error running 'qstat': %s" % result.stderr)
 
-        lines = result.stdout.split("\n\n")
-        for line in lines:
-            jobinfo = PBSJobInfo(line, self._pi)
-            self._known_jobs_update(jobinfo.jobid, jobinfo)
-            jobids.append(bliss.utils.jobid.JobID(self._url, jobinfo.jobid))
-        return jobids
+    def _qstat_filtered(self, user, states, name_prefix):
+        '''Yields the jobinfos of the jobs that match the filters. The
+           candidates come from qstat's compact (and truncated) one line
+           per job output, which qstat filters by owner and state itself.
+           Only the candidates' full status is queried, in batches.
+        '''
+        command = "qstat -a"
+        if states == [bliss.saga.job.Job.Running]:
+            command = "qstat -r"
+        elif states == [bliss.saga.job.Job.Pending]:
+            command = "qstat -i"
+        if user is not None:
+            command += " -u %s" % self.shellquote(user)
+
+        ## EXECUTE SHELL COMMAND
+        result = self._run_query(command)
+        if result.returncode != 0:
+            raise Exception("Error running '%s': %s" % (command, result.stderr))
+
+        candidates = list()
+        for line in result.stdout.split("\n"):
+            # Job ID, Username, Queue, Jobname, SessID, NDS, TSK,
+            # Req'd Memory, Req'd Time, S, Elap Time
+            fields = line.split()
+            if len(fields) < 11 or not fields[0][0].isdigit():
+                continue
+            if states is not None and pbs_to_saga_jobstate(fields[-2]) not in states:
+                continue
+            # the job name may be truncated
+            if name_prefix is not None and not fields[3].startswith(name_prefix) \
+              and not name_prefix.startswith(fields[3].rstrip('*')):
+                continue
+            # the job id may be truncated, too -- '123' is enough
+            candidates.append(self.shellquote(fields[0].split('.')[0]))
+
+        flags = self._qstat_flags()[0]
+        for i in range(0, len(candidates), self.bulk_query_size):
+            command = "qstat %s %s" \
+              % (flags, " ".join(candidates[i:i+self.bulk_query_size]))
+            result = self._cw.run(command)
+            records = self._parse_qstat(result.stdout)
+            # jobs may have left qstat in the meantime
+            if result.returncode != 0 and len(records) == 0 \
+              and result.stderr.find("Unknown Job") == -1:
+                raise Exception("Error running %s: %s" % (command, result.stderr))
+            for jobinfo in records:
+                yield jobinfo
 
 
     ######################################################################
     ##
-    def get_jobinfo(self, saga_jobid):
-        '''Returns a running PBS job as saga object'''
-        if self._cw == None:
-            self._check_context()
+    def _qstat_flags(self):
+        '''Returns the qstat flag for full job status output and the
+           matching parser class. Only TORQUE can print XML (qstat -x),
+           and parsing it is slower, so 'qstat -f1' is the default.
+        '''
+        if self._qstat_format == "xml":
+            return ("-x", PBSQstatXMLParser)
+        else:
+            return ("-f1", PBSQstatParser)
+
+    def _close_parser(self, parser):
+        '''Finishes a qstat parser and returns its records'''
+        try:
+            return parser.close()
+        except xml.parsers.expat.ExpatError, ex:
+            raise Exception("Couldn't parse output of 'qstat': %s" % ex)
+
+    def _parse_qstat(self, output):
+        '''Parses the complete output of a full job status qstat'''
+        parser = self._qstat_flags()[1]()
+        try:
+            parser.feed(output)
+        except xml.parsers.expat.ExpatError, ex:
+            raise Exception("Couldn't parse output of 'qstat': %s" % ex)
+        return self._close_parser(parser)
 
+    ######################################################################
+    ##
+    def _get_native_id(self, saga_jobid):
+        '''Returns the PBS job id for a JobID or a '[url]-[id]' string'''
         if type(saga_jobid) == str:
             try:
                 (p1, native_id) = saga_jobid.split(']-[')
@@ -468,26 +1031,45 @@ class PBSService:
             native_id = saga_jobid.native_id
         else:
             raise Exception("Unsupported job ID format: %s. Expected format: [service_url]-[native_id]." % saga_jobid)
+        return native_id
+
+    ######################################################################
+    ##
+    def get_jobinfo(self, saga_jobid):
+        '''Returns a running PBS job as saga object'''
+        if self._cw == None:
+            self._check_context()
+
+        native_id = self._get_native_id(saga_jobid)
 
         if self._known_jobs_exists(native_id):
             if self._known_jobs_is_final(native_id):
                 return self._known_jobs[native_id]
 
-        result = self._cw.run("qstat -f1 %s" % (native_id))
+        flags = self._qstat_flags()[0]
+        result = self._run_query("qstat %s %s" % (flags, self.shellquote(native_id)))
         if result.returncode != 0:
             if self._known_jobs_exists(native_id):
                 ## if the job is on record but can't be reached anymore,
                 ## this probablty means that it has finished and already
                 ## kicked out qstat. in that case we just set it's state 
-                ## to done.
+                ## to done, with the exit code from its status marker.
+                collected = dict()
+                for result in self._read_accounting(self._status_commands([native_id])):
+                    collected.update(jobstatus.parse_collected(result.stdout))
                 jobinfo = self._known_jobs[native_id]
-                jobinfo._job_state = 'C' # PBS 'Complete'
-                return jobinfo
+                self._set_complete(native_id, jobinfo, collected)
+                self._known_jobs_update(native_id, jobinfo)
+                self._apply_accounting(dict())
+                return self._known_jobs[native_id]
             else:
                 ## something went wrong.
                 raise Exception("Error running 'qstat': %s" % result.stderr)
 
-        jobinfo = PBSJobInfo(result.stdout, self._pi)
+        records = self._parse_qstat(result.stdout)
+        if len(records) == 0:
+            raise Exception("Couldn't parse output of 'qstat': %s" % result.stdout)
+        jobinfo = records[0]
         self._known_jobs_update(jobinfo.jobid, jobinfo)
 
         return jobinfo
@@ -496,87 +1078,320 @@ class PBSService:
     ######################################################################
     ##
     def get_jobinfo_bulk(self, saga_jobids):
-
-        '''Returns a running PBS job as saga object'''
+        '''Returns a list of PBS jobinfos for the given jobids. All jobs
+           that aren't final yet are queried in a single round trip.
+        '''
         if self._cw == None:
             self._check_context()
 
+        native_ids = [self._get_native_id(jobid) for jobid in saga_jobids]
+
+        # pre-filter finished jobs. the elements of a job array are
+        # queried all at once via the array's id.
+        query = list()
+        arrays = list()
+        markers = list()
+        for native_id in native_ids:
+            if self._known_jobs_exists(native_id):
+                if self._known_jobs_is_final(native_id):
+                    continue
+                markers.append(native_id)
+            array_id = self._get_array_id(native_id)
+            if array_id is None:
+                query.append(self.shellquote(native_id))
+            elif array_id not in arrays:
+                arrays.append(array_id)
+
+        # run bulk qstat. the job ids are split up over several
+        # commands, since a command line can't be arbitrarily long.
+        flags = self._qstat_flags()[0]
+        commands = list()
+        for i in range(0, len(query), self.bulk_query_size):
+            commands.append("qstat %s %s" \
+              % (flags, " ".join(query[i:i+self.bulk_query_size])))
+        for array_id in arrays:
+            commands.append("qstat -t %s %s" % (flags, self.shellquote(array_id)))
+        # the exit codes of jobs that are about to leave the queue are
+        # read from their status markers in the same round trip
+        status_commands = list()
+        if len(commands) > 0:
+            status_commands = self._status_commands(markers)
+        results = list()
+        if len(commands) > 0:
+            results = self._cw.run_many(commands + status_commands)
+
+        collected = dict()
+        for result in results[len(commands):]:
+            collected.update(jobstatus.parse_collected(result.stdout))
+
+        found = dict()
+        for result in results[:len(commands)]:
+            records = self._parse_qstat(result.stdout)
+            # qstat fails if any of the jobs is unknown, but still
+            # prints the others.
+            if result.returncode != 0 and len(records) == 0 \
+              and result.stderr.find("Unknown Job") == -1:
+                raise Exception("Error running %s: %s" \
+                  % (result.command, result.stderr))
+            for jobinfo in records:
+                found[jobinfo.jobid] = jobinfo
+                # '123' is the same job as '123.server'
+                found.setdefault(jobinfo.jobid.split('.')[0], jobinfo)
+
         jobinfos = list()
-        nativeids = str()
-        # pre-filter finished jobs
-        for jobid in saga_jobids:
-            if self._known_jobs_exists(jobid.native_id):
-                if self._known_jobs_is_final(jobid.native_id):
-                    jobinfos.append(self._known_jobs[jobid.native_id])
-                else:
-                    nativeids += ("%s " % (jobid.native_id))
-        # run bulk qstat
-        result = self._cw.run("qstat -f1 %s" % nativeids)
-        if result.returncode != 0:
-            if self._known_jobs_exists(saga_jobid.native_id):
+        gone = False
+        for native_id in native_ids:
+            if native_id in found:
+                jobinfo = found[native_id]
+                self._set_exit_status(native_id, jobinfo, collected)
+                self._known_jobs_update(native_id, jobinfo)
+            elif self._known_jobs_exists(native_id):
                 ## if the job is on record but can't be reached anymore,
                 ## this probablty means that it has finished and already
                 ## kicked out qstat. in that case we just set it's state 
                 ## to done.
-                jobinfo = self._known_jobs[saga_jobid.native_id]
-                jobinfo._job_state = 'C' # PBS 'Complete'
-                return jobinfo
-            else:
-                ## something went wrong.
-                raise Exception("Error running %s: %s" \
-                  % (result.executable, result.stderr))
-        # create JobInfo objects
-        for result in result.stdout.split('\n\n'):
-            if result.find("Unable to copy") != -1:
-                # error that pops up sometimes. Ignore
-                pass
+                jobinfo = self._known_jobs[native_id]
+                if not self._known_jobs_is_final(native_id):
+                    self._set_complete(native_id, jobinfo, collected)
+                    jobinfo = self._known_jobs_update(native_id, jobinfo)
+                    gone = True
             else:
-                jobinfo = PBSJobInfo(result, self._pi)
-                self._known_jobs_update(jobinfo.jobid, jobinfo)
-                jobinfos.append(jobinfo)
+                ## never seen this job. 
+                jobinfo = PBSJobInfo("", self._pi)
+                jobinfo._jobid = native_id
+                jobinfo._job_state = 'U' # pseudo-PBS 'Unknown'
+            jobinfos.append(jobinfo)
+
+        if gone:
+            # the accounting records of the jobs that just left the
+            # queue (one round trip for all of them)
+            self._read_accounting()
+            jobinfos = [self._known_jobs.get(native_id, jobinfo) \
+                        for (native_id, jobinfo) in zip(native_ids, jobinfos)]
 
         return jobinfos
 
+    ######################################################################
+    ##
+    def get_accounting(self, saga_jobids):
+        '''Returns the jobinfos of the given jobs. Those of finished jobs
+           come with the exit code, wall clock time and max. virtual
+           memory from the accounting. New accounting records are read
+           (once for all jobs) if a finished job has got none yet.
+        '''
+        jobinfos = self.get_jobinfo_bulk(saga_jobids)
+        for jobinfo in jobinfos:
+            if jobinfo.ru_wallclock is None and jobinfo.state in \
+              [bliss.saga.job.Job.Done, bliss.saga.job.Job.Failed, 
+               bliss.saga.job.Job.Canceled]:
+                self._read_accounting()
+                return self.get_jobinfo_bulk(saga_jobids)
+        return jobinfos
+
+    def _read_accounting(self, commands=[]):
+        '''Runs 'commands' and reads the new accounting records, in the
+           same round trip. Returns the results of 'commands'.
+        '''
+        self._accounting_lock.acquire()
+        try:
+            if self._accounting is None:
+                if len(commands) == 0:
+                    return list()
+                return self._cw.run_many(commands)
+            results = self._cw.run_many(commands + \
+              [self._accounting.command(self.accounting_file)])
+
+            accounting = self._accounting.feed(results[-1].stdout)
+            if accounting is None:
+                self._pi.log_info("No accounting available for %s" % self._url)
+                self._accounting = None
+            else:
+                self._apply_accounting(parse_pbs_accounting(accounting[0]))
+            return results[:-1]
+        finally:
+            self._accounting_lock.release()
+
+    def _apply_accounting(self, records):
+        '''Stores accounting records in the infos of the jobs they belong
+           to, once the jobs have left the queue.
+        '''
+        self._accounting_lock.acquire()
+        try:
+            for (native_id, record) in records.iteritems():
+                if self._known_jobs_exists(native_id):
+                    if native_id in self._accounting_pending:
+                        # (e.g., a 'D' record, followed by an 'E' record)
+                        for (key, value) in record.iteritems():
+                            if value is not None and value is not False:
+                                self._accounting_pending[native_id][key] = value
+                    else:
+                        self._accounting_pending[native_id] = record
+            for native_id in self._accounting_pending.keys():
+                if not self._known_jobs_exists(native_id):
+                    del self._accounting_pending[native_id]
+                elif self._known_jobs_is_final(native_id):
+                    record = self._accounting_pending.pop(native_id)
+                    jobinfo = self._known_jobs[native_id]
+                    if record['deleted']:
+                        jobinfo._job_state = 'X' # pseudo-PBS 'Canceled'
+                    elif record['aborted'] or (record['exit_status'] or 0) < 0:
+                        jobinfo._job_state = 'A' # pseudo-PBS 'Aborted'
+                    if jobinfo._exit_status is None \
+                      and record['exit_status'] is not None:
+                        jobinfo._exit_status = str(record['exit_status'])
+                    jobinfo._ru_wallclock = record['ru_wallclock']
+                    jobinfo._maxvmem = record['maxvmem']
+                    self._known_jobs_update(native_id, jobinfo)
+        finally:
+            self._accounting_lock.release()
+
+    ######################################################################
+    ##
+    def _status_commands(self, native_ids):
+        '''Returns the commands that read the status markers of the given
+           jobs, and remove the markers that have been collected before.
+        '''
+        remove = list()
+        while len(self._collected) > 0:
+            remove.append(self._collected.pop())
+        commands = list()
+        for i in range(0, max(len(native_ids), len(remove)), self.bulk_query_size):
+            max_age = None
+            if not self._status_pruned:
+                max_age = self.status_max_age
+                self._status_pruned = True
+            commands.append(jobstatus.collect_command(self._status_dir,
+              native_ids[i:i+self.bulk_query_size],
+              remove[i:i+self.bulk_query_size], quote=self.shellquote,
+              max_age=max_age))
+        return commands
+
+    def _set_complete(self, native_id, jobinfo, collected):
+        '''Sets the state of a job that has left the queue to complete,
+           with the exit code from its status marker (if 'collected' has
+           got one).
+        '''
+        jobinfo._job_state = 'C' # PBS 'Complete'
+        self._set_exit_status(native_id, jobinfo, collected)
+
+    def _set_exit_status(self, native_id, jobinfo, collected):
+        if native_id in collected:
+            if jobinfo._exit_status is None:
+                jobinfo._exit_status = str(collected[native_id][1])
+            # as long as qstat lists the job, its marker is still needed
+            if jobinfo.state in [bliss.saga.job.Job.Done,
+              bliss.saga.job.Job.Failed, bliss.saga.job.Job.Canceled]:
+                self._collected.append(native_id)
+
+    ######################################################################
+    ##
+    def _poll_job_states(self, native_ids):
+        '''Bulk state query for the background poller'''
+        jobids = [bliss.utils.jobid.JobID(self._url, native_id) \
+                  for native_id in native_ids]
+        states = dict()
+        for (native_id, jobinfo) in zip(native_ids, self.get_jobinfo_bulk(jobids)):
+            states[native_id] = jobinfo.state
+        return states
 
     ######################################################################
     ##
     def get_job_state(self, saga_jobid):
-        '''Returns the state of the job with the given jobid.
+        '''Returns the state of the job with the given jobid. The state
+           is kept up to date by the background poller and is at most
+           JobStatePoller.max_staleness seconds old.
         '''
-        return self.get_jobinfo(saga_jobid).state
+        if self._cw == None:
+            self._check_context()
+
+        native_id = self._get_native_id(saga_jobid)
+        if self._known_jobs_exists(native_id):
+            if self._known_jobs_is_final(native_id):
+                return self._known_jobs[native_id].state
+        return self._poller.get_state(native_id)
 
     ######################################################################
     ##
     def get_bulk_job_states(self, saga_jobids):
         '''Returns a list of states for the job with the given jobids.
+           Stale states are refreshed with a single bulk query.
         '''
-        #jobids_str = list()
-        ##for jobid in saga_jobids:
-        #    jobids_str.append(str(jobid))
-        #self._pi.log_info("Trying to get bulk states for: %s " \
-        #  % (jobids_str))
+        if self._cw == None:
+            self._check_context()
 
-        states = list()
-        for jobinfo in self.get_jobinfo_bulk(saga_jobids):
-            states.append(jobinfo.state)
-        return states
+        native_ids = [self._get_native_id(jobid) for jobid in saga_jobids]
+        return self._poller.get_states(native_ids)
 
     def shellquote(self, s):
         return "'" + s.replace("'", "'\\''") + "'"
 
+    def _get_array_id(self, native_id):
+        '''Returns the id of the job array ('123[].server') that a job
+           array element ('123[4].server') belongs to, or None.
+        '''
+        match = re.match(r'^(\d+)\[\d+\](.*)$', native_id)
+        if match is None:
+            return None
+        return "%s[]%s" % match.groups()
+
     ######################################################################
     ##
-    def _pbscript_generator(self, jd):
+    def wait_jobs(self, saga_jobids, any=False, timeout=None):
+        '''Blocks until all (or, if 'any' is True, at least one) of the
+           given jobs are in a final state, or for up to 'timeout' seconds
+           (forever if None). Returns the jobids of the final jobs.
+        '''
+        if self._cw == None:
+            self._check_context()
+
+        native_ids = list()
+        for jobid in saga_jobids:
+            native_id = self._get_native_id(jobid)
+            if self._known_jobs_exists(native_id):
+                if self._known_jobs_is_final(native_id):
+                    self._poller.update(native_id, self._known_jobs[native_id].state)
+            native_ids.append(native_id)
+
+        final = self._poller.wait(native_ids, any=any, timeout=timeout)
+        return [jobid for (jobid, native_id) in zip(saga_jobids, native_ids) \
+                if native_id in final]
+
+    ######################################################################
+    ##
+    def _pbscript_generator(self, jd, submitted={}):
         '''Generates a PBS script from a SAGA job description.
         '''
-        pbs_params = str()
-        exec_n_args = str()
+        pbscript = "\n#!/bin/bash \n%s \n%s" % (self._pbs_params(jd,
+          self._resolve_dependencies(jd, submitted)),
+          jobstatus.wrap_command(self._exec_n_args(jd), self._status_dir,
+                                 "$PBS_JOBID"))
+        self._pi.log_debug("Generated PBS script: %s" % (pbscript))
+        return pbscript
 
+    def _exec_n_args(self, jd):
+        '''Returns the command line of a SAGA job description.
+        '''
+        exec_n_args = str()
         if jd.executable is not None:
             exec_n_args += "%s " % (jd.executable) 
         if jd.arguments is not None:
             for arg in jd.arguments:
                 exec_n_args += "%s " % (arg)
+        return exec_n_args
+
+    def _resolve_dependencies(self, jd, submitted={}):
+        '''Returns the (type, native id) dependencies of a SAGA job
+           description. 'submitted' maps the jobs that are submitted in
+           the same go to their jobinfos.
+        '''
+        return dependencies.resolve(jd, self._url, submitted,
+                                    self._known_jobs.get)
+
+    def _pbs_params(self, jd, depends=[]):
+        '''Returns the #PBS directives for a SAGA job description.
+           'depends' are its resolved dependencies.
+        '''
+        pbs_params = str()
 
         if jd.name is not None:
             pbs_params += "#PBS -N %s \n" % jd.name
@@ -607,6 +1422,14 @@ class PBSService:
             pbs_params += "#PBS -A %s \n" % str(jd.project)
         if jd.contact is not None:
             pbs_params += "#PBS -m abe \n"
+        if len(depends) > 0:
+            # afterok:1.server:2.server,afterany:3.server
+            depend = list()
+            for dep_type in dependencies.TYPES:
+                native_ids = [native_id for (t, native_id) in depends if t == dep_type]
+                if len(native_ids) > 0:
+                    depend.append(":".join([dep_type] + native_ids))
+            pbs_params += "#PBS -W depend=%s \n" % ",".join(depend)
        
         if self._url.scheme in ["xt5torque", "xt5torque+ssh", 'xt5torque+gsissh']:
             # Special case for TORQUE on Cray XT5s
@@ -617,15 +1440,14 @@ class PBSService:
             # Default case (non-XT5)
             if jd.total_cpu_count is not None:
                 tcc = int(jd.total_cpu_count)
-                tbd = float(tcc)/float(self._ppn)
+                ppn = self._get_ppn()
+                tbd = float(tcc)/float(ppn)
                 if float(tbd) > int(tbd):
-                    pbs_params += "#PBS -l nodes=%s:ppn=%s" % (str(int(tbd)+1), self._ppn)
+                    pbs_params += "#PBS -l nodes=%s:ppn=%s" % (str(int(tbd)+1), ppn)
                 else:
-                    pbs_params += "#PBS -l nodes=%s:ppn=%s" % (str(int(tbd)), self._ppn)
+                    pbs_params += "#PBS -l nodes=%s:ppn=%s" % (str(int(tbd)), ppn)
 
-        pbscript = "\n#!/bin/bash \n%s \n%s" % (pbs_params, exec_n_args)
-        self._pi.log_debug("Generated PBS script: %s" % (pbscript))
-        return pbscript
+        return pbs_params
 
 
     ######################################################################
@@ -633,31 +1455,210 @@ class PBSService:
     def submit_job(self, job):
         '''Submits a job to PBS and returns a jobinfo structure.
         '''
+        jobinfo = self.submit_jobs([job])[0]
+        if isinstance(jobinfo, Exception):
+            raise jobinfo
+        return jobinfo
+
+    def submit_jobs(self, jobs):
+        '''Submits a list of jobs to PBS and returns a list with a jobinfo
+           (or, if its submission failed, an exception) per job. The job
+           scripts are uploaded to the spool directory and submitted with
+           one command per 'bulk_submit_size' jobs, all in a single round
+           trip -- or, if some of the jobs depend on others in the list,
+           in one round trip per level of dependencies.
+        '''
+        if len(jobs) == 0:
+            return list()
         if self._cw == None:
             self._check_context()
 
-        script = self._pbscript_generator(job.get_description())
+        submitted = dict()
+        for job in jobs:
+            submitted[job._id()] = dependencies.DependencyException(
+              "Circular dependency")
+        for wave in dependencies.waves(jobs):
+            # (the jobs of earlier waves are queued already, so their
+            # jobinfos must not get lost if this wave fails as a whole)
+            try:
+                jobinfos = self._submit_wave(wave, submitted)
+            except Exception, ex:
+                jobinfos = [Exception("Couldn't submit job: %s" % ex)] * len(wave)
+            for (job, jobinfo) in zip(wave, jobinfos):
+                submitted[job._id()] = jobinfo
+        return [submitted[job._id()] for job in jobs]
+
+    def _submit_wave(self, jobs, submitted):
+        '''Submits a list of jobs that don't depend on each other'''
+        scripts = list()
+        failed = dict()
+        for (i, job) in enumerate(jobs):
+            try:
+                scripts.append(self._pbscript_generator(job.get_description(),
+                                                        submitted))
+            except Exception, ex:
+                failed[i] = Exception("Couldn't submit job: %s" % ex)
+
+        tags = list()
+        commands = list()
+        for i in range(0, len(scripts), self.bulk_submit_size):
+            tags.append(bulksubmit.new_tag())
+            commands.append(bulksubmit.submit_command("qsub",
+              scripts[i:i+self.bulk_submit_size], tags[-1], self.spool_dir))
+        results = list()
+        if len(commands) > 0:
+            results = self._cw.run_many(commands)
+            # cached query results don't know about the new jobs yet
+            self._query_cache.invalidate()
 
-        # filter the script - esapce problematic characters
-        #scprpt = script.replace("'", "\'")
-        #script = script.replace("\"", "\\\"")
-        result = self._cw.run("echo \'%s\' | qsub" % (script))
+        jobinfos = list()
+        for (i, result) in enumerate(results):
+            count = len(scripts[i*self.bulk_submit_size:(i+1)*self.bulk_submit_size])
+            try:
+                if result.returncode != 0:
+                    raise Exception(result.stderr)
+                outputs = bulksubmit.parse_results(result.stdout, tags[i], count)
+            except Exception, ex:
+                jobinfos.extend([Exception("Error running 'qsub': %s" % ex)] * count)
+                continue
+            for (returncode, output) in outputs:
+                if returncode != 0 or len(output) == 0:
+                    jobinfos.append(Exception("Error running 'qsub': %s. Script was: %s" \
+                      % (output, scripts[len(jobinfos)])))
+                    continue
+                #depending on the PBS configuration, the job can already 
+                #have disappeared from the queue at this point, and a
+                #qstat per job would be expensive. that's why we create
+                #a dummy job info here and leave the rest to the poller.
+                ji = PBSJobInfo("", self._pi)
+                ji._jobid = output.split()[-1]
+                ji._job_state = "Q"
+                self._known_jobs_update(ji.jobid, ji)
+                self._poller.track(ji.jobid, ji.state)
+                jobinfos.append(ji)
+
+        # (in the order of 'jobs', with the ones that failed early)
+        for i in sorted(failed.keys()):
+            jobinfos.insert(i, failed[i])
+        return jobinfos
 
-        if result.returncode != 0:
-            raise Exception("Error running 'qsub': %s. Script was: %s" % (result.stdout, script))
+    def submit_job_async(self, job, on_submitted):
+        '''Queues a job for submission by a background thread, which
+           calls 'on_submitted(jobinfo)' once it's done. Blocks if there
+           are 'max_in_flight' jobs in the queue already. The jobs it
+           depends on have to be queued or submitted already.
+        '''
+        for (dep_type, parent) in dependencies.parents(job.get_description()):
+            if not self._pipeline.is_pending(parent._id()):
+                jobid = parent.get_job_id()
+                if jobid is None or jobid.native_id is None:
+                    raise dependencies.DependencyException(
+                      "Dependency %s hasn't been run yet" % parent._id())
+        self._pipeline.enqueue(job._id(), job, on_submitted)
+
+    def settle_job(self, job):
+        '''Waits until a job queued by submit_job_async() has been
+           submitted, and raises the exception if that failed.
+        '''
+        self._pipeline.settle(job._id())
+
+    def submission_failed(self, job):
+        '''Returns True if the (non-blocking) submission of a job failed'''
+        try:
+            self._pipeline.settle(job._id())
+            return False
+        except Exception, ex:
+            return True
+
+    def get_submission_stats(self):
+        '''Returns the submission pipeline's counters'''
+        return self._pipeline.stats()
+
+    ######################################################################
+    ##
+    def array_signature(self, jd):
+        '''Returns a key under which jobs can be submitted as elements of
+           the same job array, or None if the job can't be part of one.
+           Jobs with the same #PBS directives can, regardless of their
+           executables and arguments.
+        '''
+        exec_n_args = self._exec_n_args(jd)
+        if exec_n_args.find("\n") != -1 or \
+          len(exec_n_args) > self.array_stage_size / 2:
+            return None
+        try:
+            return self._pbs_params(jd, self._resolve_dependencies(jd))
+        except dependencies.DependencyException, ex:
+            return None # (fails in submit_jobs())
+
+    ######################################################################
+    ##
+    def submit_job_array(self, jobs):
+        '''Submits a list of jobs with the same array_signature() as one
+           job array ('qsub -t' with TORQUE, 'qsub -J' with PBS Pro) and
+           returns a list of jobinfos, one per element. The elements'
+           command lines are staged in a parameter file which every
+           element reads its own line from.
+        '''
+        if self._cw == None:
+            self._check_context()
+
+        if len(jobs) > self.array_max_size:
+            raise Exception("Job arrays can't have more than %s elements" \
+              % self.array_max_size)
+
+        descriptions = [job.get_description() for job in jobs]
+        (array_dir, commands) = bulksubmit.stage_array(
+          [self._exec_n_args(jd) for jd in descriptions], self.array_param_dir,
+          self.array_stage_size, self.shellquote, self.array_param_max_age)
+        for result in self._cw.run_many(commands):
+            if result.returncode != 0:
+                raise Exception("Error staging job array parameters: %s" \
+                  % result.stderr)
+
+        # the array index is $PBS_ARRAYID in TORQUE and
+        # $PBS_ARRAY_INDEX in PBS Pro
+        if self._pbs_flavor == "pbspro":
+            array_flag = "-J"
         else:
-            #depending on the PBS configuration, the job can already 
-            #have disappeared from the queue at this point. that's why
-            #we create a dummy job info here
-            ji = PBSJobInfo("", self._pi)
-            ji._jobid = result.stdout.split("\n")[-1]
+            array_flag = "-t"
+        script = "\n#!/bin/bash \n#PBS %s 0-%s \n%s \n" \
+          % (array_flag, len(jobs)-1, self._pbs_params(descriptions[0],
+                           self._resolve_dependencies(descriptions[0])))
+        script += jobstatus.wrap_command(bulksubmit.array_command(array_dir,
+          "${PBS_ARRAYID:-$PBS_ARRAY_INDEX}+1", len(jobs)),
+          self._status_dir, "$PBS_JOBID")
+        self._pi.log_debug("Generated PBS array script: %s" % (script))
+
+        tag = bulksubmit.new_tag()
+        result = self._cw.run(bulksubmit.submit_command("qsub", [script],
+                                                        tag, self.spool_dir))
+        self._query_cache.invalidate()
 
-            ji._job_state = "R"
-            self._known_jobs_update(ji.jobid, ji)
+        if result.returncode != 0:
+            raise Exception("Error running 'qsub': %s. Script was: %s" % (result.stderr, script))
+        (returncode, output) = bulksubmit.parse_results(result.stdout, tag, 1)[0]
+        if returncode != 0 or len(output) == 0:
+            raise Exception("Error running 'qsub': %s. Script was: %s" % (output, script))
+
+        # qsub returns '123[].server'. the elements are '123[0].server',
+        # '123[1].server', ... as with submit_job(), we don't query the
+        # new elements but create dummy job infos.
+        array_id = output.split()[-1]
+        match = re.match(r'^(\d+)\[\](.*)$', array_id)
+        if match is None:
+            raise Exception("Unexpected job array id returned by 'qsub': %s" \
+              % array_id)
 
-            jobinfo = self.get_jobinfo(bliss.utils.jobid.JobID(self._url, 
-              result.stdout.split("\n")[-1]))
-            return jobinfo
+        jobinfos = list()
+        for i in range(0, len(jobs)):
+            ji = PBSJobInfo("", self._pi)
+            ji._jobid = "%s[%s]%s" % (match.group(1), i, match.group(2))
+            ji._job_state = "Q"
+            self._known_jobs_update(ji.jobid, ji)
+            self._poller.track(ji.jobid, ji.state)
+            jobinfos.append(ji)
+        return jobinfos
 
     ######################################################################
     ##
@@ -667,7 +1668,8 @@ class PBSService:
         if self._cw == None:
             self._check_context()
 
-        result = self._cw.run("qdel %s" % (saga_jobid.native_id))
+        result = self._cw.run("qdel %s" % self.shellquote(saga_jobid.native_id))
+        self._query_cache.invalidate()
  
         if result.returncode != 0:
             raise Exception("Error running 'qdel': %s" % result.stderr)
@@ -675,4 +1677,5 @@ class PBSService:
             jobinfo = self.get_jobinfo(saga_jobid)
             if jobinfo.state == bliss.saga.job.Job.Done:
                 self.get_jobinfo(saga_jobid)._job_state = 'X' # pseudo-PBS 'Canceled'
+            self._poller.update(saga_jobid.native_id, jobinfo.state)
             #return jobinfo
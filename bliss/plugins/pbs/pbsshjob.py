@@ -10,6 +10,7 @@ from bliss.interface import JobPluginInterface, SDPluginInterface
 from bliss.plugins.pbs.cmdlinewrapper import PBSService
 from bliss.plugins.pbs.bookkeeper import BookKeeper
 from bliss.utils.jobid import JobID
+from bliss.utils import dependencies
 
 
 import time
@@ -152,9 +153,30 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
     ##  
     def service_list(self, service_obj):
         '''Implements interface from _JobPluginBase'''
+        return self.service_list_filtered(service_obj)
+
+    ######################################################################
+    ##  
+    def service_list_filtered(self, service_obj, user=None, state=None,
+                              name_prefix=None, snapshot=False):
+        '''Implements interface from _JobPluginBase'''
         try:
             pbs = self.bookkeeper.get_pbswrapper_for_service(service_obj)
-            return pbs.list_jobs()
+            return self._list_iterator(pbs.list_jobs(user=user, state=state,
+              name_prefix=name_prefix, snapshot=snapshot))
+        except Exception, ex:
+            self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
+              "Couldn't retreive job list because: %s " % (str(ex)))
+
+    def _list_iterator(self, jobs):
+        '''Reports errors that happen while the job list is iterated
+           over the same way as the other errors
+        '''
+        try:
+            for job in jobs:
+                yield job
+        except bliss.saga.Exception:
+            raise
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't retreive job list because: %s " % (str(ex)))
@@ -210,13 +232,17 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
         '''Implements interface from _JobPluginBase.
            This method is called for the saga.Job.state property.'''
         try:
-            if self.bookkeeper.get_jobid_for_job(job).native_id == None:
+            service = self.bookkeeper.get_service_for_job(job)
+            pbs = self.bookkeeper.get_pbswrapper_for_service(service)
+            if pbs.submission_failed(job):
+                ## The job was run with block=False, and its submission
+                ## failed.
+                return bliss.saga.job.Job.Failed
+            elif self.bookkeeper.get_jobid_for_job(job).native_id == None:
                 ## The job hasn't been submitted yet - don't process
                 ## it using the PBSwrapper. 
                 return bliss.saga.job.Job.New
             else:
-                service = self.bookkeeper.get_service_for_job(job)
-                pbs = self.bookkeeper.get_pbswrapper_for_service(service)
                 return pbs.get_job_state(job.get_job_id())  
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
@@ -264,6 +290,30 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
               "Couldn't run job because: %s " % (str(ex)))
 
 
+    ######################################################################
+    ##
+    def job_run_async(self, job):
+        '''Implements interface from _JobPluginBase.
+           The job is queued up and submitted (together with other
+           queued jobs) by a background thread.
+        '''
+        if self.bookkeeper.get_jobid_for_job(job).native_id != None:
+            self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
+              "Couldn't run the job because: job is not in 'New' state.")
+
+        try:
+            service = self.bookkeeper.get_service_for_job(job)
+            pbs = self.bookkeeper.get_pbswrapper_for_service(service)
+
+            def on_submitted(jobinfo):
+                sagajobid = bliss.utils.jobid.JobID(service._url, jobinfo.jobid)
+                self.bookkeeper.add_job_object(job, service, sagajobid)
+            pbs.submit_job_async(job, on_submitted)
+        except Exception, ex:
+            self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
+              "Couldn't run job because: %s " % (str(ex)))
+
+
     ######################################################################
     ##
     def job_cancel(self, job_obj):
@@ -285,13 +335,14 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
         '''Implements interface from _JobPluginBase.
            This method is called for saga.Job.wait().'''
         try:
-            while True:
-                state = self.job_get_state(job_obj)
-                if state == bliss.saga.job.Job.Running \
-                or state == bliss.saga.job.Job.Pending:
-                    time.sleep(1)
-                else:
-                    break
+            if self.bookkeeper.get_jobid_for_job(job_obj).native_id == None:
+                ## The job hasn't been submitted yet - nothing to wait for.
+                return
+            if timeout is not None and timeout < 0:
+                timeout = None # block
+            service = self.bookkeeper.get_service_for_job(job_obj)
+            pbs = self.bookkeeper.get_pbswrapper_for_service(service)
+            pbs.wait_jobs([job_obj.get_job_id()], timeout=timeout)
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't wait for job because: %s (already finished?)" % (str(ex)))
@@ -324,9 +375,10 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
     ## 
     def container_object_unregister(self, container_obj):
         '''Implements interface from JobPluginInterface.'''
-        self.bookkeeper.remove_container_object(service_obj)
+        self.bookkeeper.remove_container_object(container_obj,
+          container_obj._service)
         self.log_info("Unegistered container object %s" \
-          % (repr(service_obj)))
+          % (repr(container_obj)))
 
     ######################################################################
     ## 
@@ -362,7 +414,7 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
                don't seem to be managed to the same service object.")
         try:
             service = self.bookkeeper.add_job_to_container(job_obj, container_obj)
-            self.log_info("Added job %s to container %s" % (str(job_obj), str(container_obj)))
+            self.log_info("Added job %s to container %s" % (repr(job_obj), repr(container_obj)))
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't add job to container because: %s " % (str(ex)))
@@ -374,7 +426,7 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
         '''Implements interface from JobPluginInterface.'''
         try:
             service = self.bookkeeper.remove_job_from_container(job_obj, container_obj)
-            self.log_info("Removed job %s from container %s" % (str(job_obj), str(container_obj)))
+            self.log_info("Removed job %s from container %s" % (repr(job_obj), repr(container_obj)))
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't remove job from container because: %s " % (str(ex)))
@@ -383,13 +435,75 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
     ######################################################################
     ## 
     def container_run(self, container_obj):
+        '''Implements interface from _JobPluginBase.
+           New jobs that only differ in their executables and arguments
+           are submitted together as a job array. Jobs that depend on
+           other jobs in the container are submitted after those.
+        '''
         try: 
-            for job in self.container_list(container_obj):
-                self.job_run(job)
+            service = container_obj._service
+            pbs = self.bookkeeper.get_pbswrapper_for_service(service)
+
+            jobs = self.container_list(container_obj)
+            new_jobs = [job for job in jobs \
+              if self.bookkeeper.get_jobid_for_job(job).native_id == None]
+            errors = list()
+            for wave in dependencies.waves(new_jobs):
+                errors.extend(self._container_run_wave(service, pbs, wave))
+
+            # the others will fail in job_run()
+            for job in jobs:
+                if job not in new_jobs:
+                    self.job_run(job)
+            if len(errors) > 0:
+                raise Exception("%s of %s jobs failed: %s" \
+                  % (len(errors), len(new_jobs), "; ".join(errors)))
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't start all jobs in the container because: %s " % (str(ex)))
 
+    def _container_run_wave(self, service, pbs, jobs):
+        '''Submits a list of new jobs that don't depend on each other.
+           Returns the errors of the jobs that couldn't be submitted.
+        '''
+        # group the jobs by their array signature, in container order
+        groups = dict()
+        signatures = list()
+        singles = list()
+        for job in jobs:
+            signature = pbs.array_signature(job.get_description())
+            if signature is None:
+                singles.append(job)
+            elif signature in groups:
+                groups[signature].append(job)
+            else:
+                groups[signature] = [job]
+                signatures.append(signature)
+
+        for signature in signatures:
+            group = groups[signature]
+            if len(group) < 2:
+                singles.extend(group)
+                continue
+            for i in range(0, len(group), pbs.array_max_size):
+                chunk = group[i:i+pbs.array_max_size]
+                jobinfos = pbs.submit_job_array(chunk)
+                for (job, jobinfo) in zip(chunk, jobinfos):
+                    sagajobid = bliss.utils.jobid.JobID(service._url, jobinfo.jobid)
+                    self.bookkeeper.add_job_object(job, service, sagajobid)
+                self.log_info("Started job array %s with %s elements" \
+                  % (pbs._get_array_id(jobinfos[0].jobid), len(chunk)))
+
+        # the other jobs are submitted in bulk
+        errors = list()
+        for (job, jobinfo) in zip(singles, pbs.submit_jobs(singles)):
+            if isinstance(jobinfo, Exception):
+                errors.append(str(jobinfo))
+                continue
+            sagajobid = bliss.utils.jobid.JobID(service._url, jobinfo.jobid)
+            self.bookkeeper.add_job_object(job, service, sagajobid)
+        return errors
+
 
     ######################################################################
     ## 
@@ -410,17 +524,22 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
     def job_get_bulk_states(self, container):
         '''Optimized bulk-state query for container jobs'''
         try:
-            states = list()
+            jobs = self.container_list(container)
             notnew = list()
-            for job in self.container_list(container):
-                if self.bookkeeper.get_jobid_for_job(job).native_id == None:
-                    states.append(bliss.saga.job.Job.New)
-                else:
+            for job in jobs:
+                if self.bookkeeper.get_jobid_for_job(job).native_id != None:
                     notnew.append(job.get_job_id())
                 
             pbs = self.bookkeeper.get_pbswrapper_for_service(container._service)
-            for state in pbs.get_bulk_job_states(notnew):
-                states.append(state)
+            bulk_states = iter(pbs.get_bulk_job_states(notnew))
+
+            # keep the states in container order
+            states = list()
+            for job in jobs:
+                if self.bookkeeper.get_jobid_for_job(job).native_id == None:
+                    states.append(bliss.saga.job.Job.New)
+                else:
+                    states.append(bulk_states.next())
             return states
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
@@ -429,25 +548,27 @@ class PBSJobPlugin(JobPluginInterface, SDPluginInterface):
     ######################################################################
     ## 
     def container_wait(self, container_obj, wait_mode, timeout):
+        '''Implements interface from JobPluginInterface. In 'Any' mode,
+           one of the jobs that are in a final state is returned.'''
         try: 
+            jobs = dict()
             for job in self.container_list(container_obj):
-                self.job_wait(job, timeout)
-
-        #    all_done = False
-        #    while not all_done:
-        #        for state in self.job_get_bulk_states(container_obj):
-        #            jobs_not_done = 0
-        #            if state == bliss.saga.job.Job.Running \
-        #            or state == bliss.saga.job.Job.Pending:
-        #                jobs_not_done += 1
-        #            
-        #            if jobs_not_done > 0:
-        #                all_done = False
-        #                time.sleep(2)
-        #            else:
-        #                all_done = True
-        #
+                jobid = self.bookkeeper.get_jobid_for_job(job)
+                if jobid.native_id != None:
+                    jobs[jobid.native_id] = job
+            if len(jobs) == 0:
+                return None
+            if timeout is not None and timeout < 0:
+                timeout = None # block
+
+            # one query per sweep for all jobs in the container
+            pbs = self.bookkeeper.get_pbswrapper_for_service(container_obj._service)
+            jobids = [job.get_job_id() for job in jobs.values()]
+            final = pbs.wait_jobs(jobids, any=(wait_mode == bliss.saga.job.Container.Any),
+                                  timeout=timeout)
+            if wait_mode == bliss.saga.job.Container.Any and len(final) > 0:
+                return jobs[final[0].native_id]
+            return None
         except Exception, ex:
             self.log_error_and_raise(bliss.saga.Error.NoSuccess, 
               "Couldn't wait for jobs in the container because: %s " % (str(ex)))
-
@@ -5,45 +5,163 @@ __author__    = "Ole Christian Weidner"
 __copyright__ = "Copyright 2012, Ole Christian Weidner"
 __license__   = "MIT"
 
+import re
 import copy
 import socket
 import time
 import string
 import getpass
+import threading
 import subprocess
+import xml.parsers.expat
 import bliss.saga
 
-from bliss.utils.command_wrapper import CommandWrapper, CommandWrapperException
+from bliss.utils.command_wrapper import CommandWrapper, CommandWrapperException, get_ssh_backend
+from bliss.utils.connectionpool import PooledCommandWrapper
+from bliss.utils.querycache import QueryCache, QueryCacheException, get_query_ttl
+from bliss.utils.statepoller import JobStatePoller
+from bliss.utils.jobcache import JobCache, JobCacheException, get_job_cache_size
+from bliss.utils.refresher import Refresher, RefresherException, get_service_info_ttl
+from bliss.utils.submitpipeline import SubmissionPipeline
+from bliss.utils import bulksubmit
+from bliss.utils import jobstatus
+from bliss.utils import dependencies
+from bliss.utils.accounting import AccountingTail
 
 ################################################################################
 ################################################################################
 
+# 'Your job 123 ("bliss_job") has been submitted', as printed by qsub
+_QSUB_JOBID = re.compile(r'Your job(?:-array)? (\d+)')
+
 def sge_to_saga_jobstate(sgejs):
-    '''translates a pbs one-letter state to saga'''
+    '''translates a sge state to saga. sge states combine several
+       letters ('hqw' is a held, queued and waiting job, 'Rr' a re-run
+       running one), so they are tested letter by letter. 'c', 'H',
+       'X' and 'F' are pseudo-states of jobs that have left the queue.
+    '''
     if sgejs == 'c':
         return bliss.saga.job.Job.Done
-    elif sgejs == 'E':
-        return bliss.saga.job.Job.Running
     elif sgejs == 'H':
         return bliss.saga.job.Job.Pending
-    elif sgejs == 'qw':
-        return bliss.saga.job.Job.Pending
-    elif sgejs == 'r':
-        return bliss.saga.job.Job.Running 
-    elif sgejs == 't': 
-        return bliss.saga.job.Job.Running 
-    elif sgejs == 'w':
-        return bliss.saga.job.Job.Pending
-    elif sgejs == 's':
-        return bliss.saga.job.Job.Pending 
     elif sgejs == 'X':
         return bliss.saga.job.Job.Canceled
-    elif sgejs == 'Eqw':
+    elif sgejs == 'F':
         return bliss.saga.job.Job.Failed
-
+    elif sgejs is None:
+        return bliss.saga.job.Job.Unknown
+    elif 'E' in sgejs:
+        # error state, e.g. 'Eqw'
+        return bliss.saga.job.Job.Failed
+    elif 'r' in sgejs or 't' in sgejs:
+        # running or transferring, maybe held, re-run, suspended or
+        # being deleted
+        return bliss.saga.job.Job.Running
+    elif 'q' in sgejs or 'w' in sgejs:
+        # queued or waiting, maybe held, re-run or being deleted
+        return bliss.saga.job.Job.Pending
+    elif 's' in sgejs or 'S' in sgejs or 'T' in sgejs:
+        return bliss.saga.job.Job.Pending
     else:
         return bliss.saga.job.Job.Unknown
 
+def sge_task_ids(task_spec):
+    '''expands a qstat ja-task-ID column ('1-9:2,12') into a list of ints'''
+    task_ids = list()
+    for part in task_spec.split(','):
+        match = re.match(r'^(\d+)(?:-(\d+)(?::(\d+))?)?$', part)
+        if match is None:
+            continue
+        (first, last, step) = match.groups()
+        if last is None:
+            task_ids.append(int(first))
+        else:
+            task_ids.extend(range(int(first), int(last)+1, int(step or 1)))
+    return task_ids
+
+def sge_task_ranges(task_ids):
+    '''compresses a list of task ids into qdel task ranges ('1-3', '7')'''
+    ranges = list()
+    task_ids = sorted(task_ids)
+    i = 0
+    while i < len(task_ids):
+        j = i
+        while j+1 < len(task_ids) and task_ids[j+1] == task_ids[j]+1:
+            j += 1
+        if i == j:
+            ranges.append("%s" % task_ids[i])
+        else:
+            ranges.append("%s-%s" % (task_ids[i], task_ids[j]))
+        i = j+1
+    return ranges
+
+def _sge_size(value):
+    '''converts a qacct size ('1.5G', '12.000M', '0.000') into bytes'''
+    value = value.strip()
+    factor = 1.0
+    if value and value[-1] in 'KMGT':
+        factor = 1024.0 ** ('KMGT'.index(value[-1]) + 1)
+        value = value[:-1]
+    return float(value) * factor
+
+def _sge_record(job_number, task_id, failed, exit_status, ru_wallclock,
+                maxvmem):
+    '''returns (native id, accounting record)'''
+    native_id = job_number
+    if task_id not in ['0', 'undefined', '']:
+        native_id = "%s.%s" % (job_number, task_id)
+    return (native_id, {'failed'      : int(failed.split()[0]),
+                        'exit_status' : int(exit_status),
+                        'ru_wallclock': float(ru_wallclock.rstrip('s')),
+                        'maxvmem'     : maxvmem})
+
+def parse_sge_accounting(lines):
+    '''parses lines of the SGE accounting file into a dictionary
+       {native id: accounting record}. the first line of a tail may be
+       incomplete -- lines that don't parse are skipped.
+    '''
+    records = dict()
+    for line in lines:
+        fields = line.split(':')
+        if line.startswith('#') or len(fields) < 36:
+            continue
+        # (the fields of a line whose start is missing are shifted)
+        if not (fields[5].isdigit() and fields[35].isdigit()):
+            continue
+        try:
+            maxvmem = None
+            if len(fields) > 42:
+                maxvmem = float(fields[42])
+            (native_id, record) = _sge_record(fields[5], fields[35],
+              fields[11], fields[12], fields[13], maxvmem)
+        except ValueError:
+            continue
+        records[native_id] = record
+    return records
+
+def parse_qacct(output):
+    '''parses the output of 'qacct -j' into a dictionary {native id:
+       accounting record}
+    '''
+    records = dict()
+    for block in re.split(r'\n=+\n', "\n" + output):
+        values = dict()
+        for line in block.split('\n'):
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                values[parts[0]] = parts[1].strip()
+        try:
+            maxvmem = None
+            if 'maxvmem' in values:
+                maxvmem = _sge_size(values['maxvmem'])
+            (native_id, record) = _sge_record(values['jobnumber'],
+              values.get('taskid', 'undefined'), values['failed'],
+              values['exit_status'], values['ru_wallclock'], maxvmem)
+        except (KeyError, ValueError, IndexError):
+            continue
+        records[native_id] = record
+    return records
+
 ################################################################################
 ################################################################################
 
@@ -110,38 +228,140 @@ class SGEServiceInfo(object):
 ################################################################################
 ################################################################################
 
+class SGEJobRecord(object):
+    '''The few fields of a job (or of a group of array tasks) that we
+       need from 'qstat -xml' or 'qstat -xml -j'.
+    '''
+
+    __slots__ = ('jobid', 'name', 'owner', 'state', 'queue', 'tasks',
+                 'output', 'error')
+
+    def __init__(self):
+        self.jobid  = None
+        self.name   = None
+        self.owner  = None
+        self.state  = None
+        self.queue  = None
+        self.tasks  = None  # ja-task-ID spec, e.g. '4-9:1', for arrays
+        self.output = None
+        self.error  = None
+
+################################################################################
+################################################################################
+
+class SGEQstatParser(object):
+    '''Incremental (expat) parser for 'qstat -xml' and 'qstat -xml -j'
+       output. Output chunks are fed in as they arrive and turned into
+       SGEJobRecords right away, so the whole document is never held in
+       memory. All elements that we don't need are skipped.
+    '''
+
+    def __init__(self):
+        '''Constructor'''
+        self.records = list()
+        self._record = None
+        self._stack = list()
+        self._text = list()
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.returns_unicode = False
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._text.append
+
+    def feed(self, chunk):
+        '''Parses the next chunk of output'''
+        self._parser.Parse(chunk, False)
+
+    def close(self):
+        '''Finishes parsing and returns the records'''
+        self._parser.Parse("", True)
+        return self.records
+
+    def _is_record(self, name):
+        # 'qstat -xml' lists jobs as <job_list>, 'qstat -xml -j'
+        # as <djob_info><element>
+        return name == 'job_list' or \
+          (name == 'element' and self._stack[-1:] == ['djob_info'])
+
+    def _start(self, name, attrs):
+        if self._is_record(name):
+            self._record = SGEJobRecord()
+        self._stack.append(name)
+        del self._text[:]
+
+    def _end(self, name):
+        self._stack.pop()
+        record = self._record
+        if record is None:
+            return
+        if self._is_record(name):
+            self.records.append(record)
+            self._record = None
+            return
+
+        text = "".join(self._text).strip()
+        del self._text[:]
+        if name == 'JB_job_number':
+            record.jobid = text
+        elif name in ['JB_name', 'JB_job_name']:
+            record.name = text
+        elif name == 'JB_owner':
+            record.owner = text
+        elif name == 'state':
+            record.state = text
+        elif name == 'queue_name' and len(text) > 0:
+            # 'all.q@node1' -> 'all.q'
+            record.queue = text.split('@')[0]
+        elif name == 'QR_name' and record.queue is None:
+            record.queue = text
+        elif name == 'tasks':
+            record.tasks = text
+        elif name == 'PN_path':
+            if 'JB_stdout_path_list' in self._stack:
+                record.output = text
+            elif 'JB_stderr_path_list' in self._stack:
+                record.error = text
+
+################################################################################
+################################################################################
+
 class SGEJobInfo(object):
-    '''Encapsulates infos about a SGE job as returned by qstat -f1.
+    '''Encapsulates infos about a SGE job as returned by qstat -xml.
     '''
 
-    def __init__(self, qstat_output, plugin):
-        '''Constructor: initialize from qstat -f <jobid> string.
+    __slots__ = ('_jobid', '_job_state', '_exit_status', '_queue',
+                 '_Output_Path', '_Error_Path', '_ru_wallclock', '_maxvmem')
+
+    def __init__(self, record, plugin):
+        '''Constructor: initialize from an SGEJobRecord (or None).
         '''
-        
-        self._job_state = None
         self._jobid = None
-
-        #plugin.log_debug("Got raw qstat output: %s" % qstat_output)
-        #if len(qstat_f_output) > 0:
-        #    try:
-        #        lines = qstat_f_output.split("\n")
-        #self._jobid = jobid #lines[0].split(":")[1].strip()
-        #    except Exception, ex:
-        #        raise Exception("Couldn't parse %s: %s" \
-        #          % (qstat_f_output, ex))
-
-        #    for line in lines[1:]:
-        #        try: 
-        #            (key, value) = line.split(" = ")
-        #            key = "_%s" % key.strip()
-        #            self.__dict__[key] = value
-        #        except Exception, ex:
-        #            pass
-        #    plugin.log_debug("Parsed qstat output: %s" % str(self.__dict__))
-        self._qstat_output = qstat_output
-        for line in self._qstat_output.split('\n'):
-            if line.find("bliss_job") != -1:
-                self._job_state = line.split()[4]  
+        self._job_state = None
+        self._exit_status = None
+        self._queue = None
+        self._Output_Path = None
+        self._Error_Path = None
+        self._ru_wallclock = None
+        self._maxvmem = None
+
+        if record is not None:
+            self._jobid = record.jobid
+            self._job_state = record.state
+            self._queue = record.queue
+            self._Output_Path = record.output
+            self._Error_Path = record.error
+
+    def tombstone(self):
+        '''Returns a copy that only keeps the job id, state, exit code
+           and resource usage (for jobs that have finished).
+        '''
+        tombstone = SGEJobInfo(None, None)
+        tombstone._jobid = self._jobid
+        tombstone._job_state = self._job_state
+        tombstone._exit_status = self._exit_status
+        tombstone._ru_wallclock = self._ru_wallclock
+        tombstone._maxvmem = self._maxvmem
+        return tombstone
 
     @property 
     def state(self):
@@ -153,7 +373,7 @@ class SGEJobInfo(object):
 
     @property 
     def walltime_limit(self):
-        return self._Resource_List.walltime
+        return None
 
     @property 
     def output_path(self):
@@ -169,10 +389,17 @@ class SGEJobInfo(object):
 
     @property 
     def exitcode(self):
-        if '_exit_status' in self.__dict__:
-            return self._exit_status
-        else:
-            return None
+        return self._exit_status
+
+    @property 
+    def ru_wallclock(self):
+        '''wall clock time in seconds (from the accounting)'''
+        return self._ru_wallclock
+
+    @property 
+    def maxvmem(self):
+        '''max. virtual memory in bytes (from the accounting)'''
+        return self._maxvmem
 
 
 ################################################################################
@@ -182,34 +409,154 @@ class SGEService:
     '''Encapsulates SGE command line tools.
     '''
 
+    # seconds for which the results of read-only queries are reused.
+    # can be overridden per service with a '?query_ttl=...' URL parameter.
+    query_cache_ttl = 2.0
+
+    # seconds for which service infos (qstat -g c) are considered fresh.
+    # older ones are still served while a background thread fetches new
+    # ones. can be overridden per service with a '?service_info_ttl=...'
+    # URL parameter.
+    service_info_ttl = 15.0
+
+    # max. number of jobs whose infos are kept (least recently used ones
+    # are dropped first). can be overridden per service with a
+    # '?job_cache_size=...' URL parameter.
+    job_cache_size = 10000
+
+    # max. number of job scripts per bulk submission command
+    bulk_submit_size = 100
+
+    # where job scripts are uploaded to before they are submitted
+    # (relative to the remote home directory)
+    spool_dir = ".bliss/spool"
+
+    # where jobs leave their start and end times and exit codes
+    # (relative to the remote home directory). each service uses a
+    # subdirectory named after its host.
+    status_dir = ".bliss/status"
+
+    # markers that haven't been collected after that many days are
+    # removed (once per service)
+    status_max_age = 7
+
+    # max. number of job ids per marker collection command
+    bulk_query_size = 100
+
+    # the accounting file that the exit codes and resource usage of
+    # finished jobs are read from (a remote shell expression). it is
+    # read incrementally. if it isn't readable, the last
+    # 'accounting_days' days of 'qacct -j' are read instead.
+    accounting_file = "${SGE_ROOT:-/opt/sge}/${SGE_CELL:-default}/common/accounting"
+    accounting_days = 1
+
+    # max. number of jobs that Job.run(block=False) queues up before it
+    # blocks until some of them have been submitted
+    max_in_flight = 500
+
+    # max. number of tasks per 'qsub -t' job array
+    array_max_size = 1000
+
+    # where the command lines of job array tasks are staged (relative
+    # to the remote home directory)
+    array_param_dir = ".bliss/arrays"
+
+    # staged command lines of arrays that haven't changed for that many
+    # days (e.g., because they were canceled) are removed
+    array_param_max_age = 30
+
+    # max. length of a staging command line. interactive shells choke
+    # on lines that are longer than 4096 bytes.
+    array_stage_size = 3000
+
     def __init__(self, plugin, service_obj):
         '''Constructor'''
         self._pi    = plugin
         self._so    = service_obj
         self._url   = service_obj._url
         self._cw    = None
-        self._ppn   = 1 # number of processors per node. defaults to 1
         self._nodes = 1 # total number of nodes. defaults to 1
 
+        # the "wayness" (number of slots per node) of the queues that
+        # jobs have been submitted to. it's looked up once per queue.
+        self._wayness = dict()
+        self._wayness_lock = threading.Lock()
+
         if self._url.scheme == "sge":
             if (self._url.host != "localhost") and (self._url.host != socket.gethostname()):
                 self._pi.log_error_and_raise(bliss.saga.Error.NoSuccess, 
                 "Can't use %s as (non-local) hostname in conjunction with the sge:// schema. Try sge+ssh:// instead" \
                   % (self._url.host))
 
-        # Indicates when the service information was last updated
-        # Service information is updated only every 10 seconds or 
-        # so to avoid crazy network traffic 
-        self._service_info_last_update = 0.0
-        self._service_info = None
+        # service information is fetched on first use only, and then
+        # refreshed in the background to avoid crazy network traffic
+        try:
+            self._service_info = Refresher(self._fetch_service_info,
+              ttl=get_service_info_ttl(self._url, self.service_info_ttl),
+              on_error=lambda ex: self._pi.log_warning(
+                "Couldn't update service info: %s" % ex),
+              name="SGEServiceInfo(%s)" % self._url)
+        except RefresherException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
+
+        # concurrent identical read-only queries (qstat) share one
+        # execution, and their results are reused for a few seconds
+        try:
+            self._query_cache = QueryCache(ttl=get_query_ttl(self._url,
+                                                             self.query_cache_ttl))
+        except QueryCacheException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
         
-        self._known_jobs = dict()
+        # a background thread keeps the states of all active jobs up
+        # to date with one qstat per sweep
+        self._poller = JobStatePoller(self._poll_job_states,
+          final_states=[bliss.saga.job.Job.Done, bliss.saga.job.Job.Failed,
+                        bliss.saga.job.Job.Canceled],
+          queued_states=[bliss.saga.job.Job.Pending],
+          name="SGEStatePoller(%s)" % self._url)
+
+        # non-blocking submissions are queued up and submitted in bulk
+        # by a background thread
+        self._pipeline = SubmissionPipeline(self.submit_jobs,
+          max_in_flight=self.max_in_flight, batch_size=self.bulk_submit_size,
+          name="SGESubmissionPipeline(%s)" % self._url)
+
+        # the markers of jobs whose exit codes have been collected are
+        # removed with the next collection
+        self._status_dir = "%s/%s" % (self.status_dir, self._url.host)
+        self._collected = list()
+        self._status_pruned = False
+
+        # jobs that other jobs depend on with 'afterok' keep their
+        # markers until they are pruned (the others check them)
+        self._keep_markers = set()
+
+        # accounting records are read when jobs leave the queue. records
+        # of jobs that haven't left it yet (as far as we know) are kept
+        # until they have.
+        self._accounting = AccountingTail(':', '$4 == u',
+          fallback="qacct -o \"$u\" -d %d -j" % self.accounting_days)
+        self._accounting_lock = threading.RLock()
+        self._accounting_pending = dict()
+
+        # jobs that finished are only remembered by id, state and exit
+        # code, and only up to 'job_cache_size' jobs are remembered at all
+        try:
+            self._known_jobs = JobCache(
+              get_job_cache_size(self._url, self.job_cache_size),
+              is_final=lambda jobinfo: jobinfo.state in [bliss.saga.job.Job.Done,
+                bliss.saga.job.Job.Failed, bliss.saga.job.Job.Canceled],
+              compact=SGEJobInfo.tombstone, on_evict=self._poller.forget)
+        except JobCacheException, ex:
+            self._pi.log_error_and_raise(bliss.saga.Error.BadParameter, str(ex))
+
 
     def _known_jobs_update(self, native_jobid, job_info):
-        self._known_jobs[native_jobid] = job_info
+        return self._known_jobs.put(native_jobid, job_info)
 
     def _known_jobs_remove(self, native_jobid):
-        self._known_jobs.remove(native_jobid)
+        self._known_jobs.pop(native_jobid)
+        self._poller.forget(native_jobid)
 
     def _known_jobs_exists(self, native_jobid):
         if native_jobid in self._known_jobs:
@@ -218,15 +565,40 @@ class SGEService:
             return False
 
     def _known_jobs_is_final(self, native_jobid):
-        if self._known_jobs[native_jobid].state == bliss.saga.job.Job.Done:
+        # the job may have been evicted in the meantime
+        jobinfo = self._known_jobs.get(native_jobid)
+        if jobinfo is None:
+            return False
+        elif jobinfo.state == bliss.saga.job.Job.Done:
             return True
-        elif self._known_jobs[native_jobid].state == bliss.saga.job.Job.Failed:
+        elif jobinfo.state == bliss.saga.job.Job.Failed:
             return True
-        elif self._known_jobs[native_jobid].state == bliss.saga.job.Job.Canceled:
+        elif jobinfo.state == bliss.saga.job.Job.Canceled:
             return True
         else:
             return False
  
+    ######################################################################
+    ##
+    def _run_query(self, command):
+        '''Runs a read-only command via the query cache'''
+        return self._query_cache.get(command, lambda: self._cw.run(command))
+
+    def _run_queries(self, commands):
+        '''Runs a list of read-only commands via the query cache'''
+        return self._query_cache.get(tuple(commands),
+                                     lambda: self._cw.run_many(commands))
+
+    def get_query_stats(self):
+        '''Returns the query cache's hit, miss and coalesced counters'''
+        return self._query_cache.stats()
+
+    def get_job_cache_stats(self):
+        '''Returns the number of remembered (and finished) jobs and the
+           job cache's hit, miss, eviction and compaction counters
+        '''
+        return self._known_jobs.stats()
+
     ######################################################################
     ##
     def _check_context(self): 
@@ -238,7 +610,10 @@ class SGEService:
             self._use_ssh = False
             try:
                 ## EXECUTE SHELL COMMAND
-                cw = CommandWrapper.initAsLocalWrapper(logger=self._pi)
+                cw = CommandWrapper.initAsLocalWrapper(logger=self._pi, 
+                                                       persistent=True)
+                # a pool of long-lived shells instead of a fork per command
+                cw = PooledCommandWrapper(cw)
                 cw.connect()
                 self._cw = cw
             except CommandWrapperException, ex:
@@ -255,21 +630,25 @@ class SGEService:
                 if ctx.type is bliss.saga.Context.SSH:
                     credentials.append({'username':ctx.userid,
                                         'userkey' :ctx.userkey,
+                                        'backend' :ctx.sshbackend,
                                         'mode' : 'context'})
                     # if a username is defined in the url, we also 
                     # want to try that
                     if self._url.username is not None:
                         credentials.append({'username':self._url.username,
                                             'userkey' :ctx.userkey,
+                                            'backend' :ctx.sshbackend,
                                             'mode' : 'context+url.username'}) 
             # next, we construct credentials with just usernames
             if self._url.username is not None:
                 credentials.append({'username': self._url.username,
                                     'userkey' : None,
+                                    'backend' : None,
                                     'mode' : 'url.username'}) 
                 
             credentials.append({'username': getpass.getuser(),
                                 'userkey' : None,
+                                'backend' : None,
                                 'mode' : 'local.username'}) 
 
             # now, we simply iterate over the credentials and try to
@@ -280,15 +659,18 @@ class SGEService:
                     cw = CommandWrapper.initAsSSHWrapper(logger=self._pi,
                                                          username=cred['username'], 
                                                          hostname=self._url.host, 
-                                                         userkey=cred['userkey'])
+                                                         userkey=cred['userkey'],
+                                                         backend=get_ssh_backend(self._url, cred['backend']))
+                    # share sessions with other services on the same host
+                    cw = PooledCommandWrapper(cw)
                     cw.connect()
                     self._cw = cw
                     self._pi.log_info("SSH: Using credential %s to access %s." \
                         % (cred, self._url.host))                            
                     break
                 except CommandWrapperException, ex:
-                    self._pi.log_error("SSH: Can't use credential %s to access %s." \
-                        % (cred, self._url.host))       
+                    self._pi.log_error("SSH: Can't use credential %s to access %s: %s" \
+                        % (cred, self._url.host, ex))       
           
         ################################################################# 
         ## SGE+GSISSH:// URL
@@ -300,21 +682,25 @@ class SGEService:
                 if ctx.type is bliss.saga.Context.X509:
                     credentials.append({'username':ctx.userid,
                                         'x509_userproxy' :ctx.userproxy,
+                                        'backend' :ctx.sshbackend,
                                         'mode' : 'context'})
                     # if a username is defined in the url, we also 
                     # want to try that
                     if self._url.username is not None:
                         credentials.append({'username':self._url.username,
                                             'x509_userproxy' :ctx.userproxy,
+                                            'backend' :ctx.sshbackend,
                                             'mode' : 'context+url.username'}) 
             # next, we construct credentials with just usernames
             if self._url.username is not None:
                 credentials.append({'username': self._url.username,
                                     'x509_userproxy' : None,
+                                    'backend' : None,
                                     'mode' : 'url.username'}) 
 
             credentials.append({'username': getpass.getuser(),
                                 'x509_userproxy' : None,
+                                'backend' : None,
                                 'mode' : 'local.username'}) 
 
             # now, we simply iterate over the credentials and try to
@@ -325,15 +711,18 @@ class SGEService:
                     cw = CommandWrapper.initAsGSISSHWrapper(logger=self._pi,
                                                             username=cred['username'], 
                                                             hostname=self._url.host, 
-                                                            x509_userproxy=cred['x509_userproxy'])
+                                                            x509_userproxy=cred['x509_userproxy'],
+                                                            backend=get_ssh_backend(self._url, cred['backend']))
+                    # share sessions with other services on the same host
+                    cw = PooledCommandWrapper(cw)
                     cw.connect()
                     self._cw = cw
                     self._pi.log_info("GSISSH: Using credential %s to access %s." \
                         % (cred, self._url.host))                            
                     break
                 except CommandWrapperException, ex:
-                    self._pi.log_error("GSISSH: Can't use credential %s to access %s." \
-                        % (cred, self._url.host))       
+                    self._pi.log_error("GSISSH: Can't use credential %s to access %s: %s" \
+                        % (cred, self._url.host, ex))       
            
         # at this point, either self._cw contains a usable 
         # configuration, or the whole thing should go to shit
@@ -352,180 +741,494 @@ class SGEService:
 
     ######################################################################
     ##
+    def _fetch_service_info(self):
+        '''Runs qstat and returns a new SGEServiceInfo'''
+        self._pi.log_info("Updating service info for %s." % self._url)
+        qstat_result = self._run_query("qstat -g c")
+        if qstat_result.returncode != 0:
+            raise Exception("Error running 'qstat -g c': %s" % qstat_result.stderr)
+
+        return SGEServiceInfo(qstat_result.stdout, qstat_result.stdout,
+                              self._pi)
+
     def get_service_info(self):
         '''Returns a single saga.job service description'''
         if self._cw == None:
             self._check_context()
-        
-        if self._service_info == None:
-            # initial creation
-            self._pi.log_info("Service info cache empty. Updating local service info.")
-            qstat_result = self._cw.run("qstat -g c")
-            if qstat_result.returncode != 0:
-                raise Exception("Error running 'qstat': %s" % qstat_result.stderr)
-            sgeqstat_result = self._cw.run("qstat -g c")
-            if sgeqstat_result.returncode != 0:
-                raise Exception("Error running 'qstat': %s" % sgeqstat_result.stderr)
-
-            self._service_info = SGEServiceInfo(qstat_result.stdout,
-                                                sgeqstat_result.stdout, self._pi)
-            self._service_info_last_update = time.time()
+        # blocks only the very first time. afterwards, outdated infos
+        # are returned while new ones are fetched in the background.
+        return self._service_info.get()
 
-        else: 
-            if self._service_info_last_update+15.0 < time.time():
-                # older than 15 seconds. update.
-                self._pi.log_info("15s service info cache expired. Updating local service info.")
-                qstat_result = self._cw.run("qstat_result -g c")
-                if qstat_result.returncode != 0:
-                    raise Exception("Error running 'qstat': %s" % qstat_result.stderr)
-                sgeqstat_result = self._cw.run("qstat -g c")
-                if sgeqstat_result.returncode != 0:
-                    raise Exception("Error running 'qstat -g c': %s" % sgeqstat_result.stderr)
-
-                self._service_info = SGEServiceInfo(qstat_result.stdout,
-                                                    sgeqstat_result.stdout, self._pi)
-                self._service_info_last_update = time.time()
-            else:
-                self._pi.log_info("15s cache not expired yet. Using local service info.")
-        
-        return self._service_info
+    def get_service_info_stats(self):
+        '''Returns the service info's fresh and stale read counters and
+           its age in seconds
+        '''
+        return self._service_info.stats()
 
     ######################################################################
     ##
-    def list_jobs(self):
-        '''Return the jobs known to qstat'''
-        jobids = []
+    def list_jobs(self, user=None, state=None, name_prefix=None,
+                  snapshot=False):
+        '''Returns an iterator over the jobs known to qstat, as JobIDs or,
+           if 'snapshot' is set, as (JobID, state, queue, exitcode) tuples.
+           The jobs can be filtered by owner (default: the current user,
+           '*' for all users), (a list of) SAGA state(s) and job name
+           prefix. The owner and (running / pending) state filters are
+           applied by qstat itself.
+        '''
         if self._cw == None:
             self._check_context()
-        
-        result = self._cw.run("qstat ")
-        if result.returncode != 0:
-            raise Exception("Error running 'qstat': %s" % result.stderr)
 
-        lines = result.stdout.split("\n\n")
-        for line in lines:
-            jobinfo = SGEJobInfo(line, self._pi)
-            self._known_jobs_update(jobinfo.jobid, jobinfo)
-            jobids.append(bliss.utils.jobid.JobID(self._url, jobinfo.jobid))
-        return jobids
+        if state is None or type(state) == list:
+            states = state
+        else:
+            states = [state]
+
+        # without filters, this is the same (cached) qstat that the
+        # state queries use
+        command = "qstat -xml -u %s" % (user is None and "$(whoami)" \
+                                        or self.shellquote(user))
+        codes = {bliss.saga.job.Job.Pending: 'p',
+                 bliss.saga.job.Job.Running: 'r'}
+        if states is not None and len(states) > 0 \
+          and len([s for s in states if s not in codes]) == 0:
+            command += " -s %s" % "".join(sorted(set([codes[s] for s in states])))
+        records = self._query_cache.get(command, lambda: self._qstat_xml(command))
+        jobinfos = self._expand_records(records)
+        return self._list_results(jobinfos, states, name_prefix, snapshot)
+
+    def _list_results(self, jobinfos, states, name_prefix, snapshot):
+        '''Filters jobinfos and turns them into list() results'''
+        for (native_id, jobinfo, name) in jobinfos:
+            if states is not None and jobinfo.state not in states:
+                continue
+            if name_prefix is not None and not (name or "").startswith(name_prefix):
+                continue
+            jobid = bliss.utils.jobid.JobID(self._url, native_id)
+            if snapshot:
+                yield (jobid, jobinfo.state, jobinfo.queue, jobinfo.exitcode)
+            else:
+                yield jobid
+            # jobs of other users etc. aren't remembered -- only the
+            # states of the jobs that we already track are updated.
+            if self._known_jobs_exists(native_id):
+                self._known_jobs_update(native_id, jobinfo)
 
+    ######################################################################
+    ##
+    def _qstat_xml(self, command):
+        '''Runs 'qstat -xml ...' and returns the parsed SGEJobRecords.
+           The output is parsed as it comes in.
+        '''
+        parser = SGEQstatParser()
+        result = self._cw.run_stream(command)
+        try:
+            for chunk in result.chunks():
+                parser.feed(chunk)
+        except xml.parsers.expat.ExpatError, ex:
+            result.close()
+            raise Exception("Couldn't parse output of '%s': %s" % (command, ex))
+        if result.returncode != 0:
+            raise Exception("Error running '%s': %s" % (command, result.stderr))
+        try:
+            return parser.close()
+        except xml.parsers.expat.ExpatError, ex:
+            raise Exception("Couldn't parse output of '%s': %s" % (command, ex))
+
+    def _qstat_jobinfos(self):
+        '''Returns a list of (native id, jobinfo) for all of the user's
+           jobs, from one (cached) 'qstat -xml -u'. Array tasks are listed
+           individually as '<jobid>.<taskid>'.
+        '''
+        command = "qstat -xml -u $(whoami)"
+        records = self._query_cache.get(command, lambda: self._qstat_xml(command))
+        return [(native_id, jobinfo) for (native_id, jobinfo, name) \
+                in self._expand_records(records)]
+
+    def _expand_records(self, records):
+        '''Yields (native id, jobinfo, job name) for SGEJobRecords'''
+        for record in records:
+            if record.tasks is None:
+                yield (record.jobid, SGEJobInfo(record, self._pi), record.name)
+                continue
+            for task_id in sge_task_ids(record.tasks):
+                jobinfo = SGEJobInfo(record, self._pi)
+                jobinfo._jobid = "%s.%s" % (record.jobid, task_id)
+                yield (jobinfo._jobid, jobinfo, record.name)
 
     ######################################################################
     ##
-    def get_jobinfo(self, saga_jobid):
+    def get_job_details(self, saga_jobid):
+        '''Returns a jobinfo with the details that only 'qstat -j' knows
+           (e.g., the queue and output paths of a job that is still
+           waiting). This costs an extra round trip, so the state queries
+           don't use it.
+        '''
+        jobinfo = self.get_jobinfo(saga_jobid)
+        native_id = saga_jobid.native_id
+        task = self._split_task_id(native_id)
+        if task is not None:
+            native_id = task[0]
+
+        command = "qstat -xml -j %s" % native_id
+        records = self._query_cache.get(command, lambda: self._qstat_xml(command))
+        for record in records:
+            if record.jobid == native_id:
+                if jobinfo._queue is None:
+                    jobinfo._queue = record.queue
+                jobinfo._Output_Path = record.output
+                jobinfo._Error_Path = record.error
+        return jobinfo
 
-        '''Returns a running PBS job as saga object'''
+    ######################################################################
+    ##
+    def get_jobinfo(self, saga_jobid):
+        '''Returns a running SGE job as saga object'''
         if self._cw == None:
             self._check_context()
 
-        if self._known_jobs_exists(saga_jobid.native_id):
-            if self._known_jobs_is_final(saga_jobid.native_id):
-                return self._known_jobs[saga_jobid.native_id]
-
-
-        result = self._cw.run("qstat | grep %s" % saga_jobid.native_id )
-
-        if (result.returncode != 0) or (len(result.stdout) == 0):
-            if self._known_jobs_exists(saga_jobid.native_id):
-                ## if the job is on record but can't be reached anymore,
-                ## this probablty means that it has finished and already
-                ## kicked out qstat. in that case we just set it's state 
-                ## to done.
-                jobinfo = self._known_jobs[saga_jobid.native_id]
-                jobinfo._job_state = 'c' # SGE 'Complete'
-                return jobinfo
-            else:
-                ## something went wrong.
-                raise Exception("Error running 'qstat': %s" % result.stderr)
-
-        jobinfo = SGEJobInfo(result.stdout, self._pi)
-        jobinfo._jobid = saga_jobid.native_id
-        self._known_jobs_update(jobinfo.jobid, jobinfo)
+        native_id = saga_jobid.native_id
+        if self._known_jobs_exists(native_id):
+            if self._known_jobs_is_final(native_id):
+                return self._known_jobs[native_id]
 
+        jobinfo = self.get_jobinfo_bulk([saga_jobid])[0]
+        if not self._known_jobs_exists(native_id):
+            raise Exception("Job %s is not known to qstat" % native_id)
         return jobinfo
 
 
     ######################################################################
     ##
-    def get_jobinfo_bulk(self, saga_jobids):
-
-        '''Returns a running PBS job as saga object'''
+    def get_jobinfo_bulk(self, saga_jobids, snapshot=None):
+        '''Returns a list of SGE jobinfos for the given jobids. A single
+           'qstat -xml' serves all jobs that aren't final yet, unless the
+           output of _qstat_jobinfos() is passed in as 'snapshot'.
+        '''
         if self._cw == None:
             self._check_context()
 
+        query = [jobid.native_id for jobid in saga_jobids \
+                 if not (self._known_jobs_exists(jobid.native_id) \
+                         and self._known_jobs_is_final(jobid.native_id))]
+
+        found = dict()
+        if snapshot is not None:
+            found = dict(snapshot)
+        elif len(query) > 0:
+            found = dict(self._qstat_jobinfos())
+
+        # the exit codes of jobs that have left the queue are read from
+        # their status markers and the accounting, all in one round trip
+        gone = [native_id for native_id in query if native_id not in found \
+                and self._known_jobs_exists(native_id)]
+        collected = dict()
+        if len(gone) > 0:
+            for result in self._read_accounting(self._status_commands(gone)):
+                collected.update(jobstatus.parse_collected(result.stdout))
+
         jobinfos = list()
-        nativeids = str()
-        # pre-filter finished jobs
         for jobid in saga_jobids:
-            if self._known_jobs_exists(jobid.native_id):
-                if self._known_jobs_is_final(jobid.native_id):
-                    jobinfos.append(self._known_jobs[jobid.native_id])
-                else:
-                    nativeids += ("%s " % (jobid.native_id))
-        # run bulk qstat
-        result = self._cw.run("qstat -f -j %s" % nativeids)
-        if result.returncode != 0:
-            if self._known_jobs_exists(saga_jobid.native_id):
+            native_id = jobid.native_id
+            if native_id in found:
+                jobinfo = found[native_id]
+                self._known_jobs_update(native_id, jobinfo)
+            elif self._known_jobs_exists(native_id):
                 ## if the job is on record but can't be reached anymore,
                 ## this probablty means that it has finished and already
                 ## kicked out qstat. in that case we just set it's state 
-                ## to done.
-                jobinfo = self._known_jobs[saga_jobid.native_id]
-                jobinfo._job_state = 'C' # PBS 'Complete'
-                return jobinfo
-            else:
-                ## something went wrong.
-                raise Exception("Error running %s: %s" \
-                  % (result.executable, result.stderr))
-        # create JobInfo objects
-        for result in result.stdout.split('\n\n'):
-            if result.find("Unable to copy") != -1:
-                # error that pops up sometimes. Ignore
-                pass
+                ## to done, with the exit code from its status marker.
+                jobinfo = self._known_jobs[native_id]
+                if not self._known_jobs_is_final(native_id):
+                    jobinfo._job_state = 'c' # SGE 'Complete'
+                    if native_id in collected:
+                        jobinfo._exit_status = collected[native_id][1]
+                        if native_id in self._keep_markers:
+                            self._keep_markers.discard(native_id)
+                        else:
+                            self._collected.append(native_id)
+                    jobinfo = self._known_jobs_update(native_id, jobinfo)
             else:
-                jobinfo = SGEJobInfo(result, self._pi)
-                self._known_jobs_update(jobinfo.jobid, jobinfo)
-                jobinfos.append(jobinfo)
+                ## never seen this job.
+                jobinfo = SGEJobInfo(None, self._pi)
+                jobinfo._jobid = native_id
+            jobinfos.append(jobinfo)
+
+        if len(gone) > 0:
+            # (the accounting records of the jobs that just left)
+            self._apply_accounting(dict())
+            jobinfos = [self._known_jobs.get(jobid.native_id, jobinfo) \
+                        for (jobid, jobinfo) in zip(saga_jobids, jobinfos)]
 
         return jobinfos
 
+    ######################################################################
+    ##
+    def get_accounting(self, saga_jobids):
+        '''Returns the jobinfos of the given jobs. Those of finished jobs
+           come with the exit code, wall clock time and max. virtual
+           memory from the accounting. New accounting records are read
+           (once for all jobs) if a finished job has got none yet.
+        '''
+        jobinfos = self.get_jobinfo_bulk(saga_jobids)
+        for jobinfo in jobinfos:
+            if jobinfo.ru_wallclock is None and jobinfo.state in \
+              [bliss.saga.job.Job.Done, bliss.saga.job.Job.Failed, 
+               bliss.saga.job.Job.Canceled]:
+                self._read_accounting()
+                return self.get_jobinfo_bulk(saga_jobids)
+        return jobinfos
+
+    def _read_accounting(self, commands=[]):
+        '''Runs 'commands' and reads the new accounting records, in the
+           same round trip. Returns the results of 'commands'.
+        '''
+        self._accounting_lock.acquire()
+        try:
+            if self._accounting is None:
+                if len(commands) == 0:
+                    return list()
+                return self._cw.run_many(commands)
+            results = self._cw.run_many(commands + \
+              [self._accounting.command(self.accounting_file)])
+
+            accounting = self._accounting.feed(results[-1].stdout)
+            if accounting is None:
+                self._pi.log_info("No accounting available for %s" % self._url)
+                self._accounting = None
+            else:
+                (lines, fallback) = accounting
+                records = parse_sge_accounting(lines)
+                if fallback is not None:
+                    records.update(parse_qacct(fallback))
+                self._apply_accounting(records)
+            return results[:-1]
+        finally:
+            self._accounting_lock.release()
+
+    def _apply_accounting(self, records):
+        '''Stores accounting records in the infos of the jobs they belong
+           to, once the jobs have left the queue.
+        '''
+        self._accounting_lock.acquire()
+        try:
+            for (native_id, record) in records.iteritems():
+                if self._known_jobs_exists(native_id):
+                    self._accounting_pending[native_id] = record
+            for native_id in self._accounting_pending.keys():
+                if not self._known_jobs_exists(native_id):
+                    del self._accounting_pending[native_id]
+                elif self._known_jobs_is_final(native_id):
+                    record = self._accounting_pending.pop(native_id)
+                    jobinfo = self._known_jobs[native_id]
+                    if record['failed'] != 0 and jobinfo._job_state != 'X':
+                        jobinfo._job_state = 'F' # pseudo-SGE 'Failed'
+                    if jobinfo._exit_status is None:
+                        jobinfo._exit_status = record['exit_status']
+                    jobinfo._ru_wallclock = record['ru_wallclock']
+                    jobinfo._maxvmem = record['maxvmem']
+                    self._known_jobs_update(native_id, jobinfo)
+        finally:
+            self._accounting_lock.release()
+
+    ######################################################################
+    ##
+    def _status_commands(self, native_ids):
+        '''Returns the commands that read the status markers of the given
+           jobs, and remove the markers that have been collected before.
+        '''
+        remove = list()
+        while len(self._collected) > 0:
+            remove.append(self._collected.pop())
+        commands = list()
+        for i in range(0, max(len(native_ids), len(remove)), self.bulk_query_size):
+            max_age = None
+            if not self._status_pruned:
+                max_age = self.status_max_age
+                self._status_pruned = True
+            commands.append(jobstatus.collect_command(self._status_dir,
+              native_ids[i:i+self.bulk_query_size],
+              remove[i:i+self.bulk_query_size], quote=self.shellquote,
+              max_age=max_age))
+        return commands
+
+    ######################################################################
+    ##
+    def _poll_job_states(self, native_ids):
+        '''Bulk state query for the background poller. Since the same
+           qstat lists all of the user's jobs, the states of the other
+           tracked jobs are returned as well.
+        '''
+        jobids = [bliss.utils.jobid.JobID(self._url, native_id) \
+                  for native_id in native_ids]
+        snapshot = self._qstat_jobinfos()
+        states = dict()
+        for (native_id, jobinfo) in zip(native_ids, self.get_jobinfo_bulk(jobids, snapshot)):
+            states[native_id] = jobinfo.state
+        for (native_id, jobinfo) in snapshot:
+            if native_id not in states and self._known_jobs_exists(native_id):
+                states[native_id] = jobinfo.state
+        return states
 
     ######################################################################
     ##
     def get_job_state(self, saga_jobid):
-        '''Returns the state of the job with the given jobid.
+        '''Returns the state of the job with the given jobid. The state
+           is kept up to date by the background poller and is at most
+           JobStatePoller.max_staleness seconds old.
         '''
-        return self.get_jobinfo(saga_jobid).state
+        if self._cw == None:
+            self._check_context()
+
+        native_id = saga_jobid.native_id
+        if self._known_jobs_exists(native_id):
+            if self._known_jobs_is_final(native_id):
+                return self._known_jobs[native_id].state
+        return self._poller.get_state(native_id)
 
     ######################################################################
     ##
     def get_bulk_job_states(self, saga_jobids):
         '''Returns a list of states for the job with the given jobids.
+           Stale states are refreshed with a single bulk query.
         '''
-        #jobids_str = list()
-        ##for jobid in saga_jobids:
-        #    jobids_str.append(str(jobid))
-        #self._pi.log_info("Trying to get bulk states for: %s " \
-        #  % (jobids_str))
+        if self._cw == None:
+            self._check_context()
 
-        states = list()
-        for jobinfo in self.get_jobinfo_bulk(saga_jobids):
-            states.append(jobinfo.state)
-        return states
+        return self._poller.get_states([jobid.native_id for jobid in saga_jobids])
+
+    def shellquote(self, s):
+        return "'" + s.replace("'", "'\\''") + "'"
+
+    ######################################################################
+    ##
+    def _split_task_id(self, native_id):
+        '''Returns (job id, task id) for an array task ('123.4'), or None
+           for a regular job.
+        '''
+        match = re.match(r'^(\d+)\.(\d+)$', native_id)
+        if match is None:
+            return None
+        return (match.group(1), int(match.group(2)))
 
     ######################################################################
     ##
-    def _sge_script_generator(self, jd):
+    def wait_jobs(self, saga_jobids, any=False, timeout=None):
+        '''Blocks until all (or, if 'any' is True, at least one) of the
+           given jobs are in a final state, or for up to 'timeout' seconds
+           (forever if None). Returns the jobids of the final jobs.
+        '''
+        if self._cw == None:
+            self._check_context()
+
+        native_ids = list()
+        for jobid in saga_jobids:
+            native_id = jobid.native_id
+            if self._known_jobs_exists(native_id):
+                if self._known_jobs_is_final(native_id):
+                    self._poller.update(native_id, self._known_jobs[native_id].state)
+            native_ids.append(native_id)
+
+        final = self._poller.wait(native_ids, any=any, timeout=timeout)
+        return [jobid for (jobid, native_id) in zip(saga_jobids, native_ids) \
+                if native_id in final]
+
+    ######################################################################
+    ##
+    def _sge_script_generator(self, jd, submitted={}, wayness=None):
         '''Generates a SGE script from a SAGA job description.
         '''
-        sge_params = str()
-        exec_n_args = str()
+        depends = self._resolve_dependencies(jd, submitted)
+        sgescript = "\n#!/bin/bash \n%s \n%s" % (self._sge_params(jd, depends, wayness),
+          jobstatus.wrap_command(self._check_dependencies(self._exec_n_args(jd),
+            depends), self._status_dir, "$JOB_ID"))
+        self._pi.log_debug("Generated SGE script: %s" % (sgescript))
+        return sgescript
 
+    def _exec_n_args(self, jd):
+        '''Returns the command line of a SAGA job description.
+        '''
+        exec_n_args = str()
         if jd.executable is not None:
             exec_n_args += "%s " % (jd.executable) 
         if jd.arguments is not None:
             for arg in jd.arguments:
                 exec_n_args += "%s " % (arg)
+        return exec_n_args
+
+    def _resolve_dependencies(self, jd, submitted={}):
+        '''Returns the (type, native id) dependencies of a SAGA job
+           description. 'submitted' maps the jobs that are submitted in
+           the same go to their jobinfos.
+        '''
+        depends = dependencies.resolve(jd, self._url, submitted,
+                                       self._known_jobs.get)
+        for (dep_type, native_id) in depends:
+            if dep_type == dependencies.AFTER_OK:
+                self._keep_markers.add(native_id)
+                try:
+                    self._collected.remove(native_id)
+                except ValueError:
+                    pass
+        return depends
+
+    def _check_dependencies(self, command, depends):
+        '''Returns 'command', or, if the job has 'afterok' dependencies,
+           a command that only runs it if they exited with 0. (-hold_jid
+           waits for them to finish, no matter how.)
+        '''
+        native_ids = [native_id for (dep_type, native_id) in depends \
+                      if dep_type == dependencies.AFTER_OK]
+        if len(native_ids) == 0:
+            return command
+        return "if %s; then\n%s\nelse\n" \
+               "echo 'Dependencies did not finish successfully: %s' >&2; false\nfi" \
+          % (jobstatus.succeeded_command(self._status_dir, native_ids,
+                                         quote=self.shellquote),
+             command, " ".join(native_ids))
+
+    def _lookup_wayness(self, queues):
+        '''Returns a dictionary {queue: wayness (or the exception if it
+           couldn't be determined)} for a list of queues. The queues that
+           haven't been looked up before are looked up in a single round
+           trip.
+        '''
+        wayness = dict()
+        missing = list()
+        self._wayness_lock.acquire()
+        try:
+            for queue in queues:
+                if queue in self._wayness:
+                    wayness[queue] = self._wayness[queue]
+                elif queue is not None and queue not in missing:
+                    missing.append(queue)
+        finally:
+            self._wayness_lock.release()
+        if len(missing) == 0:
+            return wayness
+
+        commands = ["qconf -sq %s | grep slots" % queue for queue in missing]
+        for (queue, command, result) in zip(missing, commands,
+                                            self._cw.run_many(commands)):
+            fields = result.stdout.split()
+            if result.returncode != 0 or len(fields) < 2 or not fields[1].isdigit():
+                wayness[queue] = Exception("Problem determining SMP wayness. Command was: %s" % command)
+                continue
+            wayness[queue] = int(fields[1])
+            self._pi.log_info("Determined 'wayness' for queue '%s': %s" % (queue, wayness[queue]))
+            self._wayness_lock.acquire()
+            try:
+                self._wayness[queue] = wayness[queue]
+            finally:
+                self._wayness_lock.release()
+        return wayness
+
+    def _sge_params(self, jd, depends=[], wayness=None):
+        '''Returns the #$ directives for a SAGA job description.
+           'depends' are its resolved dependencies, 'wayness' is the
+           result of _lookup_wayness() for (at least) the job's queue.
+        '''
+        sge_params = str()
 
         if jd.name is not None:    
             sge_params += "#$ -N %s \n" % jd.name
@@ -552,14 +1255,12 @@ class SGEService:
             sge_params += "#$ -l h_rt=%s:%s:00 \n" % (str(hours), str(minutes))
         if jd.queue is not None:
             sge_params += "#$ -q %s \n" % jd.queue
-            # deterine the "wayness" of the SMP nodes for the queue
-            result = self._cw.run("qconf -sq %s | grep slots" % (jd.queue))
-            if result.returncode != 0:
-                raise Exception("Problem determining SMP wayness. Command was: %s" % ("qconf -sq %s | grep slots" % (jd.queue)))
-            else:
-                self._ppn = result.stdout.split()[1]
-                self._pi.log_info("Determined 'wayness' for queue '%s': %s" % (jd.queue, self._ppn))
-                
+            # the "wayness" of the SMP nodes for the queue
+            if wayness is None or jd.queue not in wayness:
+                wayness = self._lookup_wayness([jd.queue])
+            ppn = wayness[jd.queue]
+            if isinstance(ppn, Exception):
+                raise ppn
         else:
             raise Exception("No queue defined.")
     
@@ -569,6 +1270,17 @@ class SGEService:
         if jd.contact is not None:
             sge_params += "#$ -m be \n"
             sge_params += "#$ -M %s \n" % jd.contact
+        if len(depends) > 0:
+            # array tasks can't be waited for one by one, only the
+            # whole array
+            hold = list()
+            for (dep_type, native_id) in depends:
+                task = self._split_task_id(native_id)
+                if task is not None:
+                    native_id = task[0]
+                if native_id not in hold:
+                    hold.append(native_id)
+            sge_params += "#$ -hold_jid %s \n" % ",".join(hold)
         
         # if no cores are requested at all, we default to one
         if jd.total_cpu_count is None:
@@ -578,19 +1290,16 @@ class SGEService:
         # multiplicity, i.e., if one core is requested and 
         # the cluster consists of 16-way SMP nodes, we will
         # request 16. If 17 cores are requested, we will
-        # request 32... and so on ... self.__ppn represents 
+        # request 32... and so on ... ppn represents 
         # the core count per single node
-        count = int(int(jd.total_cpu_count)/int(self._ppn))
-        if int(jd.total_cpu_count)%int(self._ppn) != 0:
+        count = int(int(jd.total_cpu_count)/ppn)
+        if int(jd.total_cpu_count)%ppn != 0:
             count = count + 1
-        count = count * int(self._ppn)
-
-        sge_params += "#$ -pe %sway %s" % (self._ppn, str(count))
+        count = count * ppn
 
+        sge_params += "#$ -pe %sway %s" % (ppn, str(count))
 
-        sgescript = "\n#!/bin/bash \n%s \n%s" % (sge_params, exec_n_args)
-        self._pi.log_debug("Generated SGE script: %s" % (sgescript))
-        return sgescript
+        return sge_params
 
 
     ######################################################################
@@ -598,39 +1307,256 @@ class SGEService:
     def submit_job(self, job):
         '''Submits a job to SGE and returns a jobinfo structure.
         '''
+        jobinfo = self.submit_jobs([job])[0]
+        if isinstance(jobinfo, Exception):
+            raise jobinfo
+        return jobinfo
+
+    def submit_jobs(self, jobs):
+        '''Submits a list of jobs to SGE and returns a list with a jobinfo
+           (or, if its submission failed, an exception) per job. The job
+           scripts are uploaded to the spool directory and submitted with
+           one command per 'bulk_submit_size' jobs, all in a single round
+           trip -- or, if some of the jobs depend on others in the list,
+           in one round trip per level of dependencies.
+        '''
+        if len(jobs) == 0:
+            return list()
         if self._cw == None:
             self._check_context()
 
-        script = self._sge_script_generator(job.get_description())
+        submitted = dict()
+        for job in jobs:
+            submitted[job._id()] = dependencies.DependencyException(
+              "Circular dependency")
+        for wave in dependencies.waves(jobs):
+            # (the jobs of earlier waves are queued already, so their
+            # jobinfos must not get lost if this wave fails as a whole)
+            try:
+                jobinfos = self._submit_wave(wave, submitted)
+            except Exception, ex:
+                jobinfos = [Exception("Couldn't submit job: %s" % ex)] * len(wave)
+            for (job, jobinfo) in zip(wave, jobinfos):
+                submitted[job._id()] = jobinfo
+        return [submitted[job._id()] for job in jobs]
+
+    def _submit_wave(self, jobs, submitted):
+        '''Submits a list of jobs that don't depend on each other'''
+        descriptions = [job.get_description() for job in jobs]
+        wayness = self._lookup_wayness([jd.queue for jd in descriptions])
+
+        scripts = list()
+        failed = dict()
+        for (i, jd) in enumerate(descriptions):
+            try:
+                scripts.append(self._sge_script_generator(jd, submitted, wayness))
+            except Exception, ex:
+                failed[i] = Exception("Couldn't submit job: %s" % ex)
+
+        tags = list()
+        commands = list()
+        for i in range(0, len(scripts), self.bulk_submit_size):
+            tags.append(bulksubmit.new_tag())
+            commands.append(bulksubmit.submit_command("qsub",
+              scripts[i:i+self.bulk_submit_size], tags[-1], self.spool_dir))
+        results = list()
+        if len(commands) > 0:
+            results = self._cw.run_many(commands)
+            # cached query results don't know about the new jobs yet
+            self._query_cache.invalidate()
+
+        jobinfos = list()
+        for (i, result) in enumerate(results):
+            count = len(scripts[i*self.bulk_submit_size:(i+1)*self.bulk_submit_size])
+            try:
+                if result.returncode != 0:
+                    raise Exception(result.stderr)
+                outputs = bulksubmit.parse_results(result.stdout, tags[i], count)
+            except Exception, ex:
+                jobinfos.extend([Exception("Error running 'qsub': %s" % ex)] * count)
+                continue
+            for (returncode, output) in outputs:
+                match = _QSUB_JOBID.search(output)
+                if returncode != 0 or match is None:
+                    jobinfos.append(Exception("Error running 'qsub': %s. Script was: %s" \
+                      % (output, scripts[len(jobinfos)])))
+                    continue
+                #depending on the SGE configuration, the job can already 
+                #have disappeared from the queue at this point, and a
+                #qstat per job would be expensive. that's why we create
+                #a dummy job info here and leave the rest to the poller.
+                ji = SGEJobInfo(None, self._pi)
+                ji._jobid = match.group(1)
+                ji._job_state = "qw"
+                self._known_jobs_update(ji.jobid, ji)
+                self._poller.track(ji.jobid, ji.state)
+                jobinfos.append(ji)
+
+        # (in the order of 'jobs', with the ones that failed early)
+        for i in sorted(failed.keys()):
+            jobinfos.insert(i, failed[i])
+        return jobinfos
+
+    def submit_job_async(self, job, on_submitted):
+        '''Queues a job for submission by a background thread, which
+           calls 'on_submitted(jobinfo)' once it's done. Blocks if there
+           are 'max_in_flight' jobs in the queue already. The jobs it
+           depends on have to be queued or submitted already.
+        '''
+        for (dep_type, parent) in dependencies.parents(job.get_description()):
+            if not self._pipeline.is_pending(parent._id()):
+                jobid = parent.get_job_id()
+                if jobid is None or jobid.native_id is None:
+                    raise dependencies.DependencyException(
+                      "Dependency %s hasn't been run yet" % parent._id())
+        self._pipeline.enqueue(job._id(), job, on_submitted)
+
+    def settle_job(self, job):
+        '''Waits until a job queued by submit_job_async() has been
+           submitted, and raises the exception if that failed.
+        '''
+        self._pipeline.settle(job._id())
+
+    def submission_failed(self, job):
+        '''Returns True if the (non-blocking) submission of a job failed'''
+        try:
+            self._pipeline.settle(job._id())
+            return False
+        except Exception, ex:
+            return True
+
+    def get_submission_stats(self):
+        '''Returns the submission pipeline's counters'''
+        return self._pipeline.stats()
+
+    ######################################################################
+    ##
+    def array_signature(self, jd):
+        '''Returns a key under which jobs can be submitted as tasks of
+           the same job array, or None if the job can't be part of one.
+           Jobs whose descriptions only differ in their executables and
+           arguments can.
+        '''
+        exec_n_args = self._exec_n_args(jd)
+        if exec_n_args.find("\n") != -1 or \
+          len(exec_n_args) > self.array_stage_size / 2:
+            return None
+        # the #$ directives themselves aren't used as the key, since
+        # generating them runs 'qconf'
+        environment = None
+        if jd.environment is not None:
+            environment = tuple(sorted(jd.environment.items()))
+        try:
+            depends = tuple(self._resolve_dependencies(jd))
+        except dependencies.DependencyException, ex:
+            return None # (fails in submit_jobs())
+        return (jd.name, environment, jd.working_directory, jd.output,
+                jd.error, jd.wall_time_limit, jd.queue, jd.project,
+                jd.contact, jd.total_cpu_count, depends)
 
-        # filter the script
-        #scprpt = script.replace("'", "\'")
-        #script = script.replace("\"", "\\\"")
-        result = self._cw.run("echo \'%s\' | qsub" % (script))
+    ######################################################################
+    ##
+    def submit_job_array(self, jobs):
+        '''Submits a list of jobs with the same array_signature() as one
+           'qsub -t' job array and returns a list of jobinfos, one per
+           task. The tasks' command lines are staged in a parameter file
+           which every task reads line $SGE_TASK_ID from.
+        '''
+        if self._cw == None:
+            self._check_context()
+
+        if len(jobs) > self.array_max_size:
+            raise Exception("Job arrays can't have more than %s tasks" \
+              % self.array_max_size)
+
+        descriptions = [job.get_description() for job in jobs]
+        (array_dir, commands) = bulksubmit.stage_array(
+          [self._exec_n_args(jd) for jd in descriptions], self.array_param_dir,
+          self.array_stage_size, self.shellquote, self.array_param_max_age)
+        for result in self._cw.run_many(commands):
+            if result.returncode != 0:
+                raise Exception("Error staging job array parameters: %s" \
+                  % result.stderr)
+
+        depends = self._resolve_dependencies(descriptions[0])
+        script = "\n#!/bin/bash \n#$ -t 1-%s \n%s \n" \
+          % (len(jobs), self._sge_params(descriptions[0], depends))
+        script += jobstatus.wrap_command(bulksubmit.array_command(array_dir,
+          "$SGE_TASK_ID", len(jobs),
+          wrap=lambda command: self._check_dependencies(command, depends)),
+          self._status_dir, "$JOB_ID.$SGE_TASK_ID")
+        self._pi.log_debug("Generated SGE array script: %s" % (script))
+
+        tag = bulksubmit.new_tag()
+        result = self._cw.run(bulksubmit.submit_command("qsub", [script],
+                                                        tag, self.spool_dir))
+        self._query_cache.invalidate()
         if result.returncode != 0:
-            if len(result.stdout) > 1:
-                error = result.stdout
-            raise Exception("Error running 'qsub': %s. Script was: %s" % (error, script))
-        else:
-            #depending on the SGE configuration, the job can already 
-            #have disappeared from the queue at this point. that's why
-            #we create a dummy job info here
-            ji = SGEJobInfo("", self._pi)
-
-            for line in result.stdout.split('\n'):
-                if line.find("Your job") != -1:
-                    ji._jobid = line.split(" ")[2]
-                 
-            if ji._jobid == None:
-                self._pi.log_error_and_raise(bliss.saga.Error.NoSuccess,
-                  "Couldn't parse Job ID from qsub output: %s" % (result.stdout))
-
-            ji._job_state = "R"
+            raise Exception("Error running 'qsub': %s. Script was: %s" % (result.stderr, script))
+        (returncode, output) = bulksubmit.parse_results(result.stdout, tag, 1)[0]
+        if returncode != 0:
+            raise Exception("Error running 'qsub': %s. Script was: %s" % (output, script))
+
+        # 'Your job-array 123.1-5:1 ("bliss_job") has been submitted'
+        match = _QSUB_JOBID.search(output)
+        if match == None:
+            self._pi.log_error_and_raise(bliss.saga.Error.NoSuccess,
+              "Couldn't parse Job ID from qsub output: %s" % (output))
+        array_id = match.group(1)
+
+        # as with submit_job(), we don't query the new tasks but
+        # create dummy job infos
+        jobinfos = list()
+        for task_id in range(1, len(jobs)+1):
+            ji = SGEJobInfo(None, self._pi)
+            ji._jobid = "%s.%s" % (array_id, task_id)
+            ji._job_state = "qw"
             self._known_jobs_update(ji.jobid, ji)
+            self._poller.track(ji.jobid, ji.state)
+            jobinfos.append(ji)
+        return jobinfos
 
-            jobinfo = self.get_jobinfo(bliss.utils.jobid.JobID(self._url, ji._jobid))
-              #result.stdout.split("\n")[0]))
-            return jobinfo
+    ######################################################################
+    ##
+    def cancel_jobs(self, saga_jobids):
+        '''Cancels a list of jobs with a single qdel. The tasks of a
+           job array are passed as task ranges ('123.1-5').
+        '''
+        if self._cw == None:
+            self._check_context()
+
+        targets = list()
+        tasks = dict()
+        for jobid in saga_jobids:
+            task = self._split_task_id(jobid.native_id)
+            if task is None:
+                targets.append(jobid.native_id)
+            else:
+                if task[0] not in tasks:
+                    tasks[task[0]] = list()
+                    targets.append(task[0])
+                tasks[task[0]].append(task[1])
+        if len(targets) == 0:
+            return
+
+        args = list()
+        for target in targets:
+            if target in tasks:
+                args.extend(["%s.%s" % (target, task_range) \
+                             for task_range in sge_task_ranges(tasks[target])])
+            else:
+                args.append(target)
+        result = self._cw.run("qdel %s" % " ".join(args))
+        self._query_cache.invalidate()
+
+        if result.returncode != 0:
+            raise Exception("Error running 'qdel': %s" % result.stderr)
+
+        for (jobid, jobinfo) in zip(saga_jobids, self.get_jobinfo_bulk(saga_jobids)):
+            if jobinfo.state == bliss.saga.job.Job.Done:
+                jobinfo._job_state = 'X' # pseudo-SGE 'Canceled'
+                self._known_jobs_update(jobid.native_id, jobinfo)
+            self._poller.update(jobid.native_id, jobinfo.state)
 
     ######################################################################
     ##
@@ -641,6 +1567,7 @@ class SGEService:
             self._check_context()
 
         result = self._cw.run("qdel %s" % (saga_jobid.native_id))
+        self._query_cache.invalidate()
  
         if result.returncode != 0:
             raise Exception("Error running 'qdel': %s" % result.stderr)
@@ -648,4 +1575,5 @@ class SGEService:
             jobinfo = self.get_jobinfo(saga_jobid)
             if jobinfo.state == bliss.saga.job.Job.Done:
                 self.get_jobinfo(saga_jobid)._job_state = 'X' # pseudo-SGE 'Canceled'
+            self._poller.update(saga_jobid.native_id, jobinfo.state)
             #return jobinfo
@@ -9,6 +9,8 @@ with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     import paramiko
 
+from bliss.utils.dependencies import DependencyGate
+
 class SSHJobProcess(object):
     '''A wrapper around an SSH process'''
     def __init__(self, jobdescription,  plugin, service_object):
@@ -54,6 +56,7 @@ class SSHJobProcess(object):
         self.state = bliss.saga.job.Job.New
         self._job_output=None
         self._job_error=None
+        self._gate = None
 
     def __del__(self):
         try:
@@ -74,6 +77,30 @@ class SSHJobProcess(object):
 
 
     def run(self, jd, url):
+        if jd.dependencies is not None:
+            # there's no scheduler that could hold the job, so it's
+            # started from here once its dependencies have finished
+            self.state = bliss.saga.job.Job.Pending
+            self._gate = DependencyGate(jd, lambda: self._start(jd, url), self._skip,
+                                        name="SSHJobGate(%s)" % self.executable)
+            self._gate.open()
+        else:
+            self._run(jd, url)
+
+    def _start(self, jd, url):
+        '''Called by the dependency gate'''
+        try:
+            self._run(jd, url)
+        except Exception, ex:
+            self.pi.log_warning("Couldn't start job: %s" % ex)
+            self.state = bliss.saga.job.Job.Failed
+
+    def _skip(self, reason):
+        '''Called by the dependency gate'''
+        self.pi.log_info("Not starting job: %s" % reason)
+        self.state = bliss.saga.job.Job.Canceled
+
+    def _run(self, jd, url):
         #check if there are things in the job descriptor that we don't support
 
         #load up ssh config file
@@ -251,10 +278,24 @@ class SSHJobProcess(object):
         return self.state
 
     def terminate(self):
+        if self._gate is not None and self._gate.cancel():
+            self.state = bliss.saga.job.Job.Canceled
+            return
         self.sshchannel.close()
         self.state = bliss.saga.job.Job.Canceled
 
     def wait(self, timeout):
+        if self._gate is not None:
+            # the job may not have been started yet
+            t_beginning = time.time()
+            if timeout == -1 or not timeout:
+                self._gate.wait()
+            elif not self._gate.wait(timeout):
+                return
+            else:
+                timeout = max(timeout - (time.time() - t_beginning), 0.1)
+            if self.sshchannel is None:
+                return # (canceled or skipped)
         if timeout == -1:
             self.returncode = self.sshchannel.recv_exit_status()
             self.sshchannel.close()
@@ -85,6 +85,7 @@ class Context(AttributeInterface, Object):
         self._usercert  = None
         self._userkey   = None
         self._userproxy = None
+        self._sshbackend = None
 
       
         # register properties with the attribute interface 
@@ -100,6 +101,8 @@ class Context(AttributeInterface, Object):
                                     accessor=self.__class__.userkey)  
         self._register_rw_attribute(name="UserProxy", 
                                     accessor=self.__class__.userproxy)  
+        self._register_rw_attribute(name="SSHBackend", 
+                                    accessor=self.__class__.sshbackend)  
 
         self.__logger = logging.getLogger('bliss.'+self.__class__.__name__)
 
@@ -235,3 +238,22 @@ class Context(AttributeInterface, Object):
         return locals()
     userproxy = property(**userproxy())
 
+    ######################################################################
+    ## Property: sshbackend
+    def sshbackend():
+        doc = """The backend used for ssh and gsissh connections.
+
+    'pexpect' (the default) drives one interactive shell per connection.
+    'controlmaster' starts one OpenSSH ControlMaster per host and identity
+    (user key or proxy) and runs every command on a separate channel on
+    top of it -- this requires non-interactive authentication (keys, agent
+    or GSI proxy). A '?ssh_backend=...' query parameter in the service URL
+    overrides this setting.
+        """
+        def fget(self):
+            return self._sshbackend
+        def fset(self, val):
+            self._sshbackend = val
+        return locals()
+    sshbackend = property(**sshbackend())
+
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import Queue
+import threading
+
+import bliss.saga
+from bliss.saga.Object import Object
+from bliss.saga.job.Job import Job
+
+class Container(Object):
+    '''Loosely represents a SAGA task container as defined in GFD.90
+
+    A job.Container groups L{job.Job}s that were created by the same
+    L{job.Service}, so that they can be run, waited for, inspected and
+    canceled together.  If the service's plugin supports it, these
+    operations are carried out in bulk (e.g., a single state query for
+    all jobs); otherwise, the container calls the individual jobs from a
+    small pool of threads.
+
+    Example::
+
+        js = saga.job.Service("pbs+ssh://india.futuregrid.org")
+        jc = saga.job.Container(js)
+
+        for i in range(0, 100):
+            jd = saga.job.Description()
+            jd.executable = '/bin/sleep'
+            jd.arguments  = [str(i)]
+            jc.add(js.create_job(jd))
+
+        jc.run()
+
+        # wait for the first job to finish...
+        j = jc.wait(saga.job.Container.Any)
+
+        # ...and then for all the others
+        jc.wait(saga.job.Container.All)
+
+        print jc.get_states()
+    '''
+
+    All = "saga.job.Container.All"
+    '''Wait mode: wait until all jobs are in a final state'''
+
+    Any = "saga.job.Container.Any"
+    '''Wait mode: wait until at least one job is in a final state'''
+
+    _final_states = [Job.Done, Job.Failed, Job.Canceled]
+
+    # number of threads used if the plugin doesn't support bulk operations
+    fallback_threads = 16
+
+    # seconds between two state checks if the plugin doesn't support
+    # bulk operations and the wait mode is 'Any'
+    fallback_poll_interval = 1.0
+
+    ######################################################################
+    ##
+    def __init__(self, service):
+        '''Construct a new, empty job container.
+           @param service: The job service that manages the container's jobs.
+           @type  service: L{job.Service}
+        '''
+        if type(service) != bliss.saga.job.Service:
+            raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+              "A job.Container object must be initialized with a job.Service.")
+
+        Object.__init__(self, session=service.session)
+        self._apitype = 'saga.job'
+        self._service = service
+        self._url = service._url
+        self._jobs = list()
+
+        # the container talks to the same plugin instance as its service
+        self._plugin = service._plugin
+        self._bulk = self._plugin_implements('container_object_register') \
+                 and self._plugin_implements('container_add_job')
+        if self._bulk:
+            self._plugin.container_object_register(self)
+        self._logger.info("Bound to plugin %s (bulk operations: %s)" \
+          % (repr(self._plugin), self._bulk))
+
+    ######################################################################
+    ##
+    def __del__(self):
+        '''Delete the container (but not its jobs).'''
+        if getattr(self, '_bulk', False):
+            try:
+                self._plugin.container_object_unregister(self)
+            except Exception:
+                pass # can't throw here
+
+    ######################################################################
+    ##
+    def add(self, job):
+        '''Add a job to the container.
+           @param job: A job that was created by the container's service.
+           @type  job: L{job.Job}
+        '''
+        if type(job) != Job:
+            raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+              "add() expects job.Job as parameter.")
+        if job._service is not self._service:
+            raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+              "Job and container have to belong to the same job.Service.")
+        if job in self._jobs:
+            raise bliss.saga.Exception(bliss.saga.Error.AlreadyExists,
+              "Job is already a member of the container.")
+        if self._bulk:
+            self._plugin.container_add_job(self, job)
+        self._jobs.append(job)
+
+    ######################################################################
+    ##
+    def remove(self, job):
+        '''Remove a job from the container.
+           @param job: A job that has been added to the container.
+           @type  job: L{job.Job}
+        '''
+        if job not in self._jobs:
+            raise bliss.saga.Exception(bliss.saga.Error.DoesNotExist,
+              "Job is not a member of the container.")
+        if self._bulk:
+            self._plugin.container_remove_job(self, job)
+        self._jobs.remove(job)
+
+    ######################################################################
+    ##
+    def list(self):
+        '''Return the jobs in the container.'''
+        return list(self._jobs)
+
+    ######################################################################
+    ##
+    def size(self):
+        '''Return the number of jobs in the container.'''
+        return len(self._jobs)
+
+    ######################################################################
+    ##
+    def run(self):
+        '''Run all jobs in the container.'''
+        if self._bulk and self._plugin_implements('container_run'):
+            self._plugin.container_run(self)
+        else:
+            self._parallel(lambda job: job.run())
+
+    ######################################################################
+    ##
+    def cancel(self):
+        '''Cancel all jobs in the container that aren't final yet.'''
+        if self._bulk and self._plugin_implements('container_cancel'):
+            self._plugin.container_cancel(self)
+        else:
+            def cancel(job):
+                if job.get_state() not in self._final_states:
+                    job.cancel()
+            self._parallel(cancel)
+
+    ######################################################################
+    ##
+    def get_states(self):
+        '''Return the states of all jobs in the container, in the order
+           in which the jobs were added.
+        '''
+        if self._bulk and self._plugin_implements('job_get_bulk_states'):
+            return self._plugin.job_get_bulk_states(self)
+        else:
+            return self._parallel(lambda job: job.get_state())
+
+    ######################################################################
+    ##
+    def wait(self, wait_mode=All, timeout=-1):
+        '''Wait for the jobs in the container to finish.
+
+           @param wait_mode: L{Container.All} or L{Container.Any}
+           @param timeout: Timeout in seconds (see L{job.Job.wait}).
+
+           In 'Any' mode, the call returns one of the jobs that are in a
+           final state (or None if the timeout expired before any job
+           finished).  In 'All' mode, it returns None.
+        '''
+        if wait_mode not in [Container.All, Container.Any]:
+            raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+              "Unknown wait mode: %s" % wait_mode)
+
+        if self._bulk and self._plugin_implements('container_wait'):
+            return self._plugin.container_wait(self, wait_mode, timeout)
+
+        if wait_mode == Container.All:
+            self._parallel(lambda job: job.wait(timeout))
+            return None
+
+        deadline = None
+        if timeout >= 0:
+            deadline = time.time() + timeout
+        while True:
+            for (job, state) in zip(self._jobs, self.get_states()):
+                if state in self._final_states:
+                    return job
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(self.fallback_poll_interval)
+
+    ######################################################################
+    ## PRIVATE
+    def _plugin_implements(self, name):
+        '''Return True if the plugin overrides the interface's method'''
+        # imported here, since bliss.interface imports bliss.saga
+        from bliss.interface import JobPluginInterface
+        method = getattr(self._plugin.__class__, name, None)
+        if method is None:
+            return False
+        default = getattr(JobPluginInterface, name, None)
+        if default is None:
+            return True
+        return method.im_func is not default.im_func
+
+    ######################################################################
+    ## PRIVATE
+    def _parallel(self, func):
+        '''Call func(job) for all jobs from a pool of threads. Return the
+           results in job order. The first exception is re-raised.
+        '''
+        jobs = list(self._jobs)
+        results = [None] * len(jobs)
+        errors = list()
+        queue = Queue.Queue()
+        for i in range(0, len(jobs)):
+            queue.put(i)
+
+        def worker():
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[i] = func(jobs[i])
+                except Exception, ex:
+                    errors.append(ex)
+
+        threads = list()
+        for n in range(0, min(self.fallback_threads, len(jobs))):
+            thread = threading.Thread(target=worker)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+        return results
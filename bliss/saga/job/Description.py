@@ -130,6 +130,10 @@ class Description(Object, AttributeInterface):
         jd_copy._number_of_processes = jd._number_of_processes
         jd_copy._spmd_variation      = jd._spmd_variation
         jd_copy._queue               = jd._queue
+        # dependencies
+        if jd._dependencies is not None:
+            jd_copy._dependencies    = dict([(k, list(v)) for (k, v) \
+                                             in jd._dependencies.iteritems()])
 
         return jd_copy
 
@@ -160,6 +164,9 @@ class Description(Object, AttributeInterface):
         self._spmd_variation      = None
         self._queue               = None
 
+        # dependencies
+        self._dependencies        = None
+
 
         # register properties with the attribute interface
         self._register_rw_attribute(name="Executable", 
@@ -186,6 +193,8 @@ class Description(Object, AttributeInterface):
                                     accessor=self.__class__.spmd_variation) 
         self._register_rw_attribute(name="Project", 
                                     accessor=self.__class__.project) 
+        self._register_rw_attribute(name="Dependencies", 
+                                    accessor=self.__class__.dependencies) 
 
         self._register_rw_vec_attribute(name="Arguments", 
                                         accessor=self.__class__.arguments) 
@@ -609,3 +618,51 @@ class Description(Object, AttributeInterface):
 
     """
 
+    ######################################################################
+    ## Property: 
+    def dependencies():
+        doc = "The jobs this job has to wait for."
+        def fget(self):
+            return self._dependencies
+        def fset(self, val):
+            if type(val) is type(None):
+                self._dependencies = None
+                return
+            if type(val) is not dict:
+                val = {'afterok': val}
+            deps = dict()
+            for (key, jobs) in val.iteritems():
+                if key != 'afterok' and key != 'afterany':
+                    raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+                    "'dependencies' must either be 'afterok' or 'afterany'")
+                if type(jobs) is not list:
+                    jobs = [jobs]
+                for job in jobs:
+                    if not isinstance(job, bliss.saga.job.Job):
+                        raise bliss.saga.Exception(bliss.saga.Error.BadParameter,
+                        "'dependencies' attribute expects 'Job' objects.")
+                deps[key] = list(jobs)
+            self._dependencies = deps
+        def fdel(self, val):
+            self._dependencies = None
+        return locals()
+    dependencies = property(**dependencies())
+    """
+    The jobs this job has to wait for.
+      - 'afterok': the job runs after these jobs have finished successfully.
+        If one of them fails or is canceled, the job doesn't run at all.
+      - 'afterany': the job runs after these jobs have finished, no matter
+        how.
+      - A job or a list of jobs (instead of a dict) means 'afterok'.
+      - The jobs have to be run before this one, but they don't have to be
+        finished (or even be submitted, if they were run with block=False
+        or are in the same container). Batch system backends hold the job
+        in the queue until its dependencies have finished, so that whole
+        workflows can be submitted at once. Other backends start the job
+        from the client side.
+
+    B{Example}::
+      jd = saga.job.Description()
+      jd.dependencies = {'afterok': [align_job], 'afterany': [stats_job]}
+
+    """
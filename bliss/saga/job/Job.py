@@ -217,14 +217,23 @@ class Job(Object, AttributeInterface):
 
     ######################################################################
     ##
-    def run(self):
+    def run(self, block=True):
         '''Execute the job via the associated job service.
+           @param block: If False, queue the job for submission and return
+                         right away.
         
         Request that the job is being executed by the backend.  If the backend
         is accepting this run request, the job will move to the 'Pending' or
         'Running' state -- otherwise this method will raise an error, and the
         job will be moved to 'Failed'.
 
+        With block=False, backends that support it (e.g., PBS and SGE) 
+        submit queued jobs in bulk in the background. run() only blocks if
+        too many jobs are queued already. Other calls on the job (state,
+        wait, cancel, ...) wait for its submission. If that failed, the 
+        job is 'Failed', and the calls raise the error. Other backends 
+        ignore 'block'.
+
 
         B{Example}::
 
@@ -251,7 +260,9 @@ class Job(Object, AttributeInterface):
 
         '''
         if self._plugin is not None:
-            return self._plugin.job_run(self)
+            if block:
+                return self._plugin.job_run(self)
+            return self._plugin.job_run_async(self)
         else:
             raise bliss.saga.Exception(bliss.saga.Error.NoSuccess, 
               "Object not bound to a plugin")
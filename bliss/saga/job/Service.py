@@ -170,19 +170,26 @@ class Service(Object):
 
     ######################################################################
     ##
-    def list(self):
+    def list(self, user=None, state=None, name_prefix=None, snapshot=False):
         '''List all jobs managed by this service instance.
+           @param user: Only list the jobs of this user.
+           @param state: Only list jobs in this state (or list of states).
+           @param name_prefix: Only list jobs whose names start with this.
+           @param snapshot: Return (job id, state, queue, exit code) tuples
+                            instead of job ids.
 
            As the job.Service represents a job management backend, list() will
-           return a list of job IDs for all jobs which are known to the backend,
+           return the job IDs of all jobs which are known to the backend,
            and which can potentially be accessed and managed by the application.
+           Some backends return an iterator that fetches the jobs lazily, 
+           and apply the filters on the remote side, e.g., as 'qstat -u'.
 
 
            Example::
 
 
              js  = saga.job.Service("fork://localhost")
-             ids = js.list()
+             ids = list(js.list())
 
              if my_job_id in ids :
                print "found my job again, wohhooo!"
@@ -193,9 +200,17 @@ class Service(Object):
                elif j.get_state() == saga.job.Job.Running  : print "running"
                else                                        : print "job is already final!"
 
+             for (id, state, queue, exitcode) in js.list(user="oweidner",
+               state=saga.job.Job.Done, snapshot=True):
+               print "%s finished in %s with %s" % (id, queue, exitcode)
+
         '''
         if self._plugin is not None:
-            return self._plugin.service_list(self)
+            if user is None and state is None and name_prefix is None \
+              and not snapshot:
+                return self._plugin.service_list(self)
+            return self._plugin.service_list_filtered(self, user=user,
+              state=state, name_prefix=name_prefix, snapshot=snapshot)
         else:
             raise bliss.saga.Exception(bliss.saga.Error.NoSuccess, 
               "Object not bound to a plugin")
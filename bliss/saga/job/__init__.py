@@ -55,3 +55,4 @@ from bliss.saga.job.Job         import JobID
 from bliss.saga.job.Service     import Service
 from bliss.saga.job.Description import Description
 
+from bliss.saga.job.Container   import Container
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''Incremental reads of batch system accounting files.
+
+   An AccountingTail remembers how far it has read an accounting file,
+   and returns a command that reads (and filters, with awk) only what
+   has been appended since. The first read starts 'initial_tail' bytes
+   before the end of the file. No read returns more than 'max_read'
+   bytes of the file; the rest is left for the next one.
+
+   The file can be a shell expression (e.g., one that evaluates to
+   the name of today's log file). If it evaluates to a different name
+   than last time, the rest of the previous file is read first, and
+   the new file from its start. If no file is readable, the command
+   runs 'fallback' (e.g., qacct) instead.
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+FILE     = "BLISS-ACCT-FILE"
+READ     = "BLISS-ACCT-READ"
+FALLBACK = "BLISS-ACCT-FALLBACK"
+
+################################################################################
+################################################################################
+
+class AccountingTail(object):
+    '''Reads new records from an accounting file.
+
+       'separator' and 'select' are the awk field separator and the
+       awk condition for the lines that are returned. In 'select', 'u'
+       is the name of the remote user.
+    '''
+
+    def __init__(self, separator, select, fallback=None,
+                 initial_tail=16*1024*1024, max_read=64*1024*1024):
+        '''Constructor'''
+        self._separator = separator
+        self._select = select
+        self._fallback = fallback
+        self._initial_tail = initial_tail
+        self._max_read = max_read
+        self._path = None     # the file that was read last, and
+        self._offset = None   # how far
+
+    def command(self, path_expr):
+        '''Returns the command that reads the new lines of the file that
+           'path_expr' evaluates to.
+        '''
+        sections = list()
+        if self._path is not None:
+            sections.append("f=%s; if [ -r \"$f\" ]; then %s; fi" \
+              % (self._quote(self._path), self._read(self._offset)))
+            sections.append("f=%s; if [ \"$f\" != %s ] && [ -r \"$f\" ]; then %s; fi" \
+              % (path_expr, self._quote(self._path), self._read(0)))
+        else:
+            sections.append("f=%s; if [ -r \"$f\" ]; then %s; fi" \
+              % (path_expr, self._read(-1)))
+        if self._fallback is not None:
+            sections.append("if [ ! -r \"$f\" ]; then echo %s; %s; fi" \
+              % (FALLBACK, self._fallback))
+        # (in a subshell, since the command may run in a persistent shell)
+        return "(u=\"$(whoami)\"; %s) 2>/dev/null" % "; ".join(sections)
+
+    def feed(self, output):
+        '''Parses the output of a command(). Returns the selected lines and
+           the output of the fallback command (None if it didn't run), or
+           None if nothing was readable at all.
+        '''
+        lines = list()
+        fallback = None
+        found = False
+        path = None
+        offset = None
+        for line in output.split('\n'):
+            if fallback is not None:
+                fallback.append(line)
+            elif line.startswith(FILE + " "):
+                (offset, path) = line[len(FILE)+1:].split(" ", 1)
+                offset = int(offset)
+                found = True
+            elif line.startswith(READ + " ") and path is not None:
+                self._path = path
+                self._offset = offset + int(line[len(READ)+1:])
+            elif line == FALLBACK:
+                fallback = list()
+                found = True
+            elif path is not None and len(line) > 0:
+                lines.append(line)
+        if not found:
+            return None
+        if fallback is not None:
+            fallback = "\n".join(fallback)
+        return (lines, fallback)
+
+    def _read(self, offset):
+        '''Returns the commands that read file "$f" from 'offset' (-1 for
+           the initial tail) and print the selected lines. awk holds back
+           the last line until it knows that it is complete.
+        '''
+        return "s=$(wc -c < \"$f\"); o=%d; " \
+               "[ $o -lt 0 ] && o=$((s > %d ? s - %d : 0)); " \
+               "[ $s -lt $o ] && o=0; " \
+               "[ $((s - o)) -gt %d ] && s=$((o + %d)); " \
+               "echo \"%s $o $f\"; " \
+               "tail -c +$((o + 1)) \"$f\" | head -c $((s - o)) | " \
+               "LC_ALL=C awk -F%s -v w=$((s - o)) -v u=\"$u\" " \
+               "'{ l = length($0) + 1; n += l; if (p != \"\") print p; p = \"\" } " \
+               "%s { p = $0 } " \
+               "END { if (n > w) { n -= l; p = \"\" } if (p != \"\") print p; print \"%s \" n + 0 }'" \
+               % (offset, self._initial_tail, self._initial_tail,
+                  self._max_read, self._max_read, FILE,
+                  self._quote(self._separator), self._select, READ)
+
+    def _quote(self, s):
+        return "'" + s.replace("'", "'\\''") + "'"
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import errno
+import subprocess
+
+import framing
+from which import which
+from reactor import Future, get_reactor, set_nonblocking
+from command_wrapper import CommandWrapperResult, CommandWrapperException
+
+################################################################################
+################################################################################
+
+class _ShellChannel(object):
+    '''A non-interactive shell (local, or remote via ssh) that speaks the
+       framed protocol over pipes. Commands are pipelined: they are written
+       as soon as they are submitted and their results are matched to the
+       submission order.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, reactor, args):
+        '''Constructor: 'args' is the command line that starts the shell'''
+        self._reactor = reactor
+        self._args = args
+        self._proc = None
+        self._fds = None
+        self._outbuf = ''
+        self._inbuf = ''
+        self._errbuf = ''
+        self._pending = list()   # [(tag, command, future)] in write order
+        self._ready = None
+        self._ready_tag = None
+        self._closed = False
+
+    ######################################################################
+    ##
+    def open(self):
+        '''Starts the shell. Returns a Future that is resolved once the
+           shell is ready for commands. Reactor thread only.
+        '''
+        self._ready = Future(self._reactor)
+        try:
+            self._proc = subprocess.Popen(self._args, stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=subprocess.PIPE,
+                                          close_fds=True)
+        except OSError, e:
+            self._ready.set_exception(CommandWrapperException(
+              "Couldn't start '%s': %s" % (" ".join(self._args), str(e))))
+            return self._ready
+
+        self._fds = (self._proc.stdin.fileno(), self._proc.stdout.fileno(),
+                     self._proc.stderr.fileno())
+        for fd in self._fds:
+            set_nonblocking(fd)
+        self._reactor.add_reader(self._fds[1], self._on_stdout)
+        self._reactor.add_reader(self._fds[2], self._on_stderr)
+
+        self._ready_tag = framing.new_tag()
+        self._write(framing.setup_command(self._ready_tag) + '\n')
+        return self._ready
+
+    ######################################################################
+    ##
+    def load(self):
+        '''Number of commands that haven't completed yet'''
+        return len(self._pending)
+
+    ######################################################################
+    ##
+    def submit(self, command, future):
+        '''Sends a framed command. Reactor thread only.'''
+        if self._closed:
+            future.set_exception(CommandWrapperException(
+              "Channel is closed: %s" % self._errbuf.strip()))
+            return
+        tag = framing.new_tag()
+        self._pending.append((tag, command, future))
+        self._write(framing.frame_command(command, tag) + '\n')
+
+    ######################################################################
+    ##
+    def close(self):
+        '''Terminates the shell. Reactor thread only.'''
+        if self._proc is None or self._closed:
+            return
+        try:
+            os.write(self._fds[0], 'exit\n')
+        except OSError:
+            pass
+        self._shutdown("Channel closed")
+
+    ######################################################################
+    ##
+    def _write(self, data):
+        self._outbuf += data
+        self._reactor.add_writer(self._fds[0], self._on_writable)
+
+    def _on_writable(self):
+        try:
+            n = os.write(self._fds[0], self._outbuf)
+            self._outbuf = self._outbuf[n:]
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                self._shutdown("Write error: %s" % str(e))
+                return
+        if len(self._outbuf) == 0:
+            self._reactor.remove_writer(self._fds[0])
+
+    def _on_stderr(self):
+        try:
+            data = os.read(self._fds[2], 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return False
+            data = ''
+        if data:
+            # keep the tail for error messages
+            self._errbuf = (self._errbuf + data)[-4096:]
+            return True
+        else:
+            self._reactor.remove_reader(self._fds[2])
+            return False
+
+    def _on_stdout(self):
+        try:
+            data = os.read(self._fds[1], 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            data = ''
+        if not data:
+            self._shutdown("Connection closed")
+            return
+        self._inbuf += data
+
+        if not self._ready.done():
+            marker = framing.ready_marker(self._ready_tag) + '\n'
+            i = self._inbuf.find(marker)
+            if i == -1:
+                return
+            self._inbuf = self._inbuf[i+len(marker):]
+            self._ready.set_result(None)
+
+        while self._pending:
+            (tag, command, future) = self._pending[0]
+            end = "%s-%s:" % (framing.END, tag)
+            e = self._inbuf.find(end)
+            if e == -1:
+                break
+            e = self._inbuf.find('\n', e)
+            if e == -1:
+                break
+            self._pending.pop(0)
+            frame = self._inbuf[:e+1]
+            self._inbuf = self._inbuf[e+1:]
+            try:
+                (stdout, stderr, rc) = framing.parse_frame(frame, tag)
+                future.set_result(CommandWrapperResult(command=command,
+                                                       stdout=stdout,
+                                                       stderr=stderr,
+                                                       returncode=rc))
+            except framing.FramingException, fe:
+                future.set_exception(CommandWrapperException(str(fe)))
+
+    def _shutdown(self, reason):
+        if self._closed:
+            return
+        self._closed = True
+        # pick up what's left of the error messages
+        while self._on_stderr():
+            pass
+        for fd in self._fds:
+            self._reactor.remove_reader(fd)
+            self._reactor.remove_writer(fd)
+        msg = "%s: %s" % (reason, self._errbuf.strip())
+        if not self._ready.done():
+            self._ready.set_exception(CommandWrapperException(msg))
+        pending = self._pending
+        self._pending = list()
+        for (tag, command, future) in pending:
+            future.set_exception(CommandWrapperException(
+              "Couldn't run '%s'. %s" % (command, msg)))
+        for f in (self._proc.stdin, self._proc.stdout, self._proc.stderr):
+            try:
+                f.close()
+            except (IOError, OSError):
+                pass
+        self._proc.poll()
+
+################################################################################
+################################################################################
+
+class AsyncCommandWrapper(object):
+    '''Non-blocking counterpart of CommandWrapper.
+
+       run() returns a Future for a CommandWrapperResult instead of blocking
+       until the command is done. All wrappers share a single Reactor, so
+       any number of commands on any number of hosts can be in flight from
+       one thread. Each wrapper opens 'channels' shells and distributes the
+       commands over them.
+
+       Remote shells are started with 'ssh -T host /bin/sh', i.e., without
+       a terminal, which requires non-interactive authentication (keys,
+       agent or GSI proxy).
+    '''
+
+    @classmethod
+    def initAsLocalWrapper(self, reactor=None, channels=1):
+        cw = AsyncCommandWrapper(reactor, channels)
+        cw._mode = 'local'
+        cw._args = ['/bin/sh']
+        return cw
+
+    @classmethod
+    def initAsSSHWrapper(self, hostname, port=22, username=None, userkey=None,
+                         reactor=None, channels=1):
+        if which('ssh') == None:
+            raise CommandWrapperException("Couldn't find 'ssh' executable in path")
+        cw = AsyncCommandWrapper(reactor, channels)
+        cw._mode = 'ssh'
+        cw._args = AsyncCommandWrapper._ssh_args('ssh', hostname, port,
+                                                 username, userkey)
+        return cw
+
+    @classmethod
+    def initAsGSISSHWrapper(self, hostname, port=22, username=None,
+                            reactor=None, channels=1):
+        if which('gsissh') == None:
+            raise CommandWrapperException("Couldn't find Globus 'gsissh' executable in path")
+        cw = AsyncCommandWrapper(reactor, channels)
+        cw._mode = 'gsissh'
+        cw._args = AsyncCommandWrapper._ssh_args('gsissh', hostname, port,
+                                                 username, None)
+        return cw
+
+    @staticmethod
+    def _ssh_args(executable, hostname, port, username, userkey):
+        args = [executable, '-T', '-o', 'BatchMode=yes', '-p', str(port)]
+        if username:
+            args.extend(['-l', username])
+        if userkey:
+            args.extend(['-i', userkey])
+        args.extend([hostname, '/bin/sh'])
+        return args
+
+    ######################################################################
+    ##
+    def __init__(self, reactor, channels):
+        '''Constructor'''
+        if reactor is None:
+            reactor = get_reactor()
+        self._reactor = reactor
+        self._num_channels = channels
+        self._channels = list()
+
+    ######################################################################
+    ##
+    def connect(self):
+        '''Opens the channels. Returns a Future that is done once all of
+           them are ready.
+        '''
+        future = Future(self._reactor)
+        self._reactor.call_soon(self._do_connect, future)
+        return future
+
+    def _do_connect(self, future):
+        self._channels = [_ShellChannel(self._reactor, self._args) \
+                          for i in range(0, self._num_channels)]
+        readies = [c.open() for c in self._channels]
+        state = {'left': len(readies)}
+        def ready(f):
+            state['left'] -= 1
+            if future.done():
+                return
+            if f.exception() is not None:
+                future.set_exception(f.exception())
+            elif state['left'] == 0:
+                future.set_result(None)
+        for r in readies:
+            r.add_done_callback(ready)
+
+    ######################################################################
+    ##
+    def disconnect(self):
+        '''Closes all channels. Pending commands fail.'''
+        self._reactor.call_soon(self._do_disconnect)
+
+    def _do_disconnect(self):
+        for channel in self._channels:
+            channel.close()
+        self._channels = list()
+
+    ######################################################################
+    ##
+    def run(self, executable, arguments=[]):
+        '''Runs a command. Returns a Future for its CommandWrapperResult.'''
+        cmd = executable
+        for arg in arguments:
+            cmd += " %s " % (arg)
+        future = Future(self._reactor)
+        self._reactor.call_soon(self._do_run, cmd, future)
+        return future
+
+    def _do_run(self, cmd, future):
+        if not self._channels:
+            future.set_exception(CommandWrapperException(
+              "Command wrapper is not connected"))
+            return
+        channel = min(self._channels, key=lambda c: c.load())
+        channel.submit(cmd, future)
+
+    ######################################################################
+    ##
+    def run_many(self, commands):
+        '''Runs a list of command lines. Returns a list of Futures.'''
+        return [self.run(command) for command in commands]
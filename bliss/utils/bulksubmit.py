@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''Bulk job submission in a single round trip.
+
+   The job scripts are uploaded to a remote spool directory first, each
+   one base64-encoded in a quoted here-doc. That way, no line of the
+   command is longer than 76 characters, and nothing in a script (quotes,
+   control characters, a line that looks like the here-doc's delimiter)
+   can get mangled by the remote shell or terminal. Identical scripts
+   (same content hash) are uploaded only once.
+
+   The scripts are then submitted as files ('qsub <file>'), one after
+   the other. For every job, the command prints one line::
+
+     BLISS-SUBMIT-<tag> <exit code> <output of the submit command>
+
+   with the output's newlines folded into blanks. Finally, the spool
+   directory is removed again -- qsub keeps its own copy of the script.
+
+   The command lines of job array elements are staged in a parameter
+   file of a directory of their own (stage_array()), which each element
+   reads its line from (array_command()). The last element to finish
+   removes the directory; directories of arrays that never finish (e.g.,
+   because they were canceled) are pruned once they are old enough.
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import re
+import uuid
+import base64
+import random
+import hashlib
+
+SUBMIT = "BLISS-SUBMIT"
+EOF    = "BLISS-EOF"
+
+################################################################################
+################################################################################
+
+class BulkSubmitException(Exception):
+    '''Raised for bulk submission exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+def new_tag():
+    '''Returns a new, random tag.'''
+    return "%08x" % random.getrandbits(32)
+
+def script_hash(script):
+    '''Returns the content hash of a script, which is also its file name
+       in the spool directory.
+    '''
+    if isinstance(script, unicode):
+        script = script.encode('utf-8')
+    return hashlib.sha1(script).hexdigest()
+
+def submit_command(submit, scripts, tag, spool_dir):
+    '''Returns a command that uploads 'scripts' to a new directory 'tag'
+       in 'spool_dir' (relative to $HOME) and runs 'submit <file>' for
+       each of them, in order.
+    '''
+    delimiter = "%s-%s" % (EOF, tag)
+    # no 'exit' here: the command may run in a persistent shell. if the
+    # directory can't be created, each job fails in qsub.
+    lines = ["d=\"$HOME/%s/%s\"" % (spool_dir, tag),
+             "mkdir -p \"$d\""]
+
+    hashes = list()
+    for script in scripts:
+        if isinstance(script, unicode):
+            script = script.encode('utf-8')
+        digest = script_hash(script)
+        if digest not in hashes:
+            lines.append("base64 -d > \"$d/%s\" <<'%s'" % (digest, delimiter))
+            lines.append(base64.encodestring(script) + delimiter)
+        hashes.append(digest)
+
+    lines.extend(["while read -r f; do",
+                  "  o=$(%s \"$d/$f\" 2>&1 </dev/null); r=$?" % submit,
+                  "  printf '%%s %%s %%s\\n' %s-%s \"$r\" \"$(printf '%%s' \"$o\" | tr '\\n' ' ')\"" \
+                    % (SUBMIT, tag),
+                  "done <<'%s'" % delimiter])
+    lines.extend(hashes)
+    lines.append(delimiter)
+    lines.append("rm -rf \"$d\"")
+    return "\n".join(lines)
+
+def parse_results(output, tag, count):
+    '''Returns a list of (exit code, output) tuples, one per script.
+       Raises BulkSubmitException if there are less than 'count'.
+    '''
+    results = list()
+    pattern = re.compile(r'^%s (\d+) ?(.*)$' % re.escape("%s-%s" % (SUBMIT, tag)),
+                         re.M)
+    for match in pattern.finditer(output):
+        results.append((int(match.group(1)), match.group(2).strip()))
+    if len(results) < count:
+        raise BulkSubmitException("Only %s of %s jobs were submitted: %s" \
+          % (len(results), count, output))
+    return results[:count]
+
+################################################################################
+################################################################################
+
+def stage_array(command_lines, param_dir, stage_size, quote, max_age=None):
+    '''Returns a tuple (array dir, commands). The commands stage
+       'command_lines' in a new directory in 'param_dir' (relative to
+       $HOME), one per line, with as few commands as a maximum command
+       length of 'stage_size' allows ('quote' quotes a command line for
+       the shell). If 'max_age' is set, they also remove the directories
+       that haven't changed for 'max_age' days (every element that
+       finishes changes its array's directory).
+    '''
+    array_dir = "$HOME/%s/%s" % (param_dir, uuid.uuid4().hex)
+    commands = ["mkdir -p \"%s\"" % array_dir]
+    if max_age is not None:
+        commands.append("find \"$HOME/%s\" -mindepth 1 -maxdepth 1 -type d "
+          "-mtime +%d -exec rm -rf {} \\; 2>/dev/null; true" % (param_dir, max_age))
+    chunk = str()
+    for command_line in command_lines:
+        line = " %s" % quote(command_line)
+        if len(chunk) + len(line) > stage_size:
+            commands.append("printf '%%s\\n'%s >> \"%s/params\"" % (chunk, array_dir))
+            chunk = str()
+        chunk += line
+    commands.append("printf '%%s\\n'%s >> \"%s/params\"" % (chunk, array_dir))
+    return (array_dir, commands)
+
+def array_command(array_dir, line_expr, count, wrap=None):
+    '''Returns the script lines that run line 'line_expr' (a shell
+       arithmetic expression, counting from 1) of the parameter file in
+       'array_dir'. Their exit status is the one of the command line.
+       Each element leaves a 'done.<line>' file, and the last of the
+       'count' elements to finish removes 'array_dir'. 'wrap(command)',
+       if set, returns the script lines that run the command line (e.g.,
+       only under some condition).
+    '''
+    command = "eval \"$(sed -n \"$((%s))p\" \"%s/params\")\"" % (line_expr, array_dir)
+    if wrap is not None:
+        command = wrap(command)
+    # (in a subshell, so that the command line can't 'exit' before the
+    # element has been counted)
+    return "(\n%s\n)\n" \
+           "bliss_array_rc=$?\n" \
+           "touch \"%s/done.$((%s))\" 2>/dev/null\n" \
+           "[ \"$(ls \"%s\" 2>/dev/null | grep -c '^done\\.')\" -ge %d ] && rm -rf \"%s\"\n" \
+           "(exit $bliss_array_rc)" \
+      % (command, array_dir, line_expr, array_dir, count, array_dir)
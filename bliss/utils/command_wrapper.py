@@ -5,10 +5,39 @@ __author__    = "Ole Christian Weidner"
 __copyright__ = "Copyright 2011-2012, Ole Christian Weidner"
 __license__   = "MIT"
 
+import urlparse
+import tempfile
 import subprocess
 from which import *
 from time import sleep
 from sshconnection import SSHConnection, SSHConnectionException
+from controlmaster import ControlMasterConnection, ControlMasterException
+from localshell import LocalShellConnection, LocalShellException, ProcessReader
+
+import framing
+
+# the available backends for ssh and gsissh wrappers
+SSH_BACKENDS = ['pexpect', 'controlmaster']
+
+def get_ssh_backend(url, default=None):
+    '''Returns the ssh backend requested for 'url'. A '?ssh_backend=...'
+       URL query parameter takes precedence over 'default', which is
+       usually a context's SSHBackend attribute. Without either, the
+       backend is 'pexpect'.
+    '''
+    backend = None
+    if url.query is not None:
+        values = urlparse.parse_qs(url.query).get('ssh_backend')
+        if values:
+            backend = values[-1]
+    if backend is None:
+        backend = default
+    if backend is None:
+        backend = 'pexpect'
+    if backend not in SSH_BACKENDS:
+        raise CommandWrapperException("Unknown ssh backend '%s'. Valid "
+          "backends are: %s" % (backend, ", ".join(SSH_BACKENDS)))
+    return backend
 
 class CommandWrapperException(Exception):
     '''Raised for CommandWrapper exceptions.
@@ -20,14 +49,17 @@ class CommandWrapper(object):
     '''
 
     @classmethod
-    def initAsLocalWrapper(self, logger):
+    def initAsLocalWrapper(self, logger, persistent=False):
         cw = CommandWrapper(logger)
         cw._mode = 'local'
+        # a persistent wrapper runs all commands in one long-lived shell
+        cw.persistent = persistent
         cw._is_connected = False # for consistency 
         return cw
 
     @classmethod
-    def initAsSSHWrapper(self, logger, hostname, port=22, username='', password='', userkey=''):
+    def initAsSSHWrapper(self, logger, hostname, port=22, username='', password='', userkey='',
+                         backend='pexpect'):
 
         if which('ssh') == None:
             raise CommandWrapperException("Couldn't find 'ssh' executable in path") 
@@ -39,11 +71,13 @@ class CommandWrapper(object):
         cw.username = username
         cw.password = password
         cw.userkey = userkey
+        cw.backend = backend
         cw._is_connected = False
         return cw
 
     @classmethod
-    def initAsGSISSHWrapper(self, logger, hostname, port=22, username='', password='', x509_userproxy=None):
+    def initAsGSISSHWrapper(self, logger, hostname, port=22, username='', password='', x509_userproxy=None,
+                            backend='pexpect'):
 
         if which('gsissh') == None:
             raise CommandWrapperException("Couldn't find Globus 'gsissh' executable in path") 
@@ -55,6 +89,7 @@ class CommandWrapper(object):
         cw.username = username
         cw.password = password
         cw.x509_userproxy = x509_userproxy
+        cw.backend = backend
         cw._is_connected = False
         return cw
 
@@ -67,6 +102,43 @@ class CommandWrapper(object):
         # connection tracker
         self._ssh_was_connected = False
 
+    ######################################################################
+    ##
+    def clone(self):
+        '''Returns a new, unconnected wrapper with the same configuration'''
+        if self._mode == 'local':
+            return CommandWrapper.initAsLocalWrapper(self._logger, 
+                persistent=self.persistent)
+        elif self._mode == 'ssh':
+            return CommandWrapper.initAsSSHWrapper(self._logger, self.hostname, 
+                port=self.port, username=self.username, password=self.password,
+                userkey=self.userkey, backend=self.backend)
+        elif self._mode == 'gsissh':
+            return CommandWrapper.initAsGSISSHWrapper(self._logger, self.hostname,
+                port=self.port, username=self.username, password=self.password,
+                x509_userproxy=self.x509_userproxy, backend=self.backend)
+
+    ######################################################################
+    ##
+    def pool_key(self):
+        '''Returns the (mode, user, host, port, credential) tuple that 
+           identifies equivalent connections, e.g., in a CommandWrapperPool.
+           'credential' is the user key (ssh) or proxy (gsissh), so that 
+           sessions are never shared between different identities.
+        '''
+        if self._mode == 'local':
+            return ('local', None, None, None, None)
+        if self._mode == 'gsissh':
+            credential = self.x509_userproxy
+        else:
+            credential = self.userkey
+        if self.backend != 'pexpect':
+            return ("%s+%s" % (self._mode, self.backend), self.username, 
+                    self.hostname, self.port, credential)
+        else:
+            return (self._mode, self.username, self.hostname, self.port,
+                    credential)
+
      
     ######################################################################
     ##
@@ -78,6 +150,12 @@ class CommandWrapper(object):
     def connect(self):
         '''Connect'''
         if self._mode == 'local':
+            if self.persistent:
+                try:
+                    self._connection = LocalShellConnection()
+                    self._connection.login()
+                except LocalShellException, e:
+                    raise CommandWrapperException(str(e))
             self._is_connected = True
 
         elif self._mode == 'ssh':
@@ -85,11 +163,17 @@ class CommandWrapper(object):
                 raise CommandWrapperException("No hostname defined")  
             self._logger.log_info('Trying to establish SSH connection with: %s' % self.hostname)
             try:
-                self._connection = SSHConnection(gsissh=False)
-                self._connection.login(hostname=self.hostname, port=self.port,
-                                       username=self.username, password=self.password)
+                if self.backend == 'controlmaster':
+                    self._connection = ControlMasterConnection(gsissh=False)
+                    self._connection.login(hostname=self.hostname, port=self.port,
+                                           username=self.username, password=self.password,
+                                           userkey=self.userkey)
+                else:
+                    self._connection = SSHConnection(gsissh=False)
+                    self._connection.login(hostname=self.hostname, port=self.port,
+                                           username=self.username, password=self.password)
                 self._is_connected = True
-            except SSHConnectionException, e:
+            except (SSHConnectionException, ControlMasterException), e:
                 raise CommandWrapperException(str(e))
 
         elif self._mode == 'gsissh':
@@ -103,11 +187,17 @@ class CommandWrapper(object):
                 self._logger.log_info('Setting X509_USER_PROXY to %s' % self.x509_userproxy)
 
             try:
-                self._connection = SSHConnection(gsissh=True)
-                self._connection.login(hostname=self.hostname, port=self.port,
-                                       username=self.username, password=self.password)
+                if self.backend == 'controlmaster':
+                    self._connection = ControlMasterConnection(gsissh=True)
+                    self._connection.login(hostname=self.hostname, port=self.port,
+                                           username=self.username, password=self.password,
+                                           x509_userproxy=self.x509_userproxy)
+                else:
+                    self._connection = SSHConnection(gsissh=True)
+                    self._connection.login(hostname=self.hostname, port=self.port,
+                                           username=self.username, password=self.password)
                 self._is_connected = True
-            except SSHConnectionException, e:
+            except (SSHConnectionException, ControlMasterException), e:
                 raise CommandWrapperException(str(e))
 
 
@@ -117,16 +207,93 @@ class CommandWrapper(object):
     def disconnect(self):
         '''Disconnect'''
         if self._mode == 'local':
-            pass
+            if self.persistent and self._is_connected:
+                self._connection.logout()
         elif self._mode == 'ssh':
             if self._is_connected:
                 self._connection.logout()
         elif self._mode == 'gsissh':
             if self._is_connected:
                 self._connection.logout()
+        self._is_connected = False
 
 
 
+    ######################################################################
+    ##
+    def run_many(self, commands):
+        '''Runs a list of commands (blocking) in a single round trip. 
+           Each command is either a command line or an (executable, 
+           arguments) tuple. Returns one CommandWrapperResult per command.
+        '''
+
+        if not self._is_connected:
+            raise CommandWrapperException("Command wrapper is not connected")
+
+        cmds = list()
+        for command in commands:
+            if type(command) == tuple:
+                (executable, arguments) = command
+                command = executable
+                for arg in arguments:
+                    command += " %s " % (arg)
+            cmds.append(command)
+
+        if self._mode == 'local' and not self.persistent:
+            # one shell for all commands instead of one per command
+            (tags, script) = framing.frame_script(cmds)
+            pid = subprocess.Popen(["/bin/sh"],
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, 
+                                      stderr=subprocess.PIPE)
+            out, err = pid.communicate(script)
+            try:
+                results = [{'exitcode':rc, 'output':stdout, 'stderr':stderr} \
+                           for (stdout, stderr, rc) in framing.parse_frames(out, tags)]
+            except framing.FramingException, e:
+                raise CommandWrapperException("%s: %s" % (str(e), err))
+
+        else:
+            try:
+                results = self._connection.execute_many(cmds)
+            except (SSHConnectionException, ControlMasterException, 
+                    LocalShellException), e:
+                raise CommandWrapperException(str(e))
+
+        return [CommandWrapperResult(command=cmd,
+                                     stdout=result['output'],
+                                     stderr=result['stderr'],
+                                     returncode=result['exitcode']) \
+                for (cmd, result) in zip(cmds, results)]
+
+    ######################################################################
+    ##
+    def run_stream(self, executable, arguments=[]):
+        '''Runs a command and returns a CommandWrapperStream that hands 
+           out the output incrementally, instead of a CommandWrapperResult
+           that holds it all at once.
+        '''
+
+        if not self._is_connected:
+            raise CommandWrapperException("Command wrapper is not connected")
+
+        cmd = executable
+        for arg in arguments:
+            cmd += " %s " % (arg)
+
+        if self._mode == 'local' and not self.persistent:
+            errfile = tempfile.TemporaryFile()
+            pid = subprocess.Popen(cmd, shell=True, 
+                                      stdout=subprocess.PIPE, 
+                                      stderr=errfile)
+            return CommandWrapperStream(cmd, ProcessReader(pid, errfile))
+        else:
+            try:
+                return CommandWrapperStream(cmd, self._connection.execute_stream(cmd))
+            except (SSHConnectionException, ControlMasterException, 
+                    LocalShellException), e:
+                raise CommandWrapperException(str(e))
+
     ######################################################################
     ##
     def run(self, executable, arguments=[]):
@@ -139,29 +306,32 @@ class CommandWrapper(object):
         for arg in arguments:
             cmd += " %s " % (arg)
 
-        if self._mode == 'local':
+        if self._mode == 'local' and not self.persistent:
             job_error = None
             job_output = None
             returncode = None
 
             pid = subprocess.Popen(cmd, shell=True, 
                                       stdout=subprocess.PIPE, 
-                                      stderr=subprocess.STDOUT)
+                                      stderr=subprocess.PIPE)
             out, err = pid.communicate() 
             cwr = CommandWrapperResult(command=cmd,
                                        stdout=out,
+                                       stderr=err,
                                        returncode=pid.returncode)
             return cwr                
             
-        elif self._mode == 'ssh' or self._mode == 'gsissh':
+        else:
             
             try:
                 result = self._connection.execute(cmd)
                 cwr = CommandWrapperResult(command=cmd,
                                            stdout=result['output'],
+                                           stderr=result['stderr'],
                                            returncode=result['exitcode'])
                 return cwr
-            except SSHConnectionException, e:
+            except (SSHConnectionException, ControlMasterException, 
+                    LocalShellException), e:
                 raise CommandWrapperException(str(e))
 
 
@@ -203,13 +373,20 @@ class CommandWrapper(object):
 
 class CommandWrapperResult(object):
     '''Represents a result.
+
+       Whichever way a command was run, 'stdout' doesn't end with a
+       newline: one trailing newline is stripped, since prompt-based ssh
+       sessions can't report it anyway.
     '''
 
     ######################################################################
     ##
-    def __init__(self, command, stdout=None, returncode=None):
+    def __init__(self, command, stdout=None, stderr=None, returncode=None):
         self.command = command
+        if stdout is not None and stdout.endswith('\n'):
+            stdout = stdout[:-1]
         self.stdout = stdout
+        self.stderr = stderr
         self.returncode = returncode
 
     ######################################################################
@@ -223,6 +400,94 @@ class CommandWrapperResult(object):
         ret = []
         ret.append(u'command: %s' % unicode(self.command))
         ret.append(u'stdout: %s' % unicode(self.stdout))
+        ret.append(u'stderr: %s' % unicode(self.stderr))
         ret.append(u'returncode: %s' % unicode(self.returncode))
         return u'\n'.join(ret)
 
+
+################################################################################
+################################################################################
+
+class CommandWrapperStream(object):
+    '''Represents a result whose output is read incrementally.
+
+       Iterating over the stream yields the lines of stdout. 'stderr' and
+       'returncode' are available once the output is exhausted. A stream
+       has to be consumed (or closed) completely before the next command
+       can run on the same connection.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, command, reader, on_close=None):
+        self.command = command
+        self.stderr = None
+        self.returncode = None
+        self._reader = reader
+        self._on_close = on_close
+
+    ######################################################################
+    ##
+    def __del__(self):
+        if self._on_close is not None:
+            # abandoned half-way -- the connection is in an unknown state
+            self._close(broken=True)
+
+    ######################################################################
+    ##
+    def chunks(self):
+        '''Yields stdout in chunks of arbitrary size'''
+        try:
+            for chunk in self._reader.chunks():
+                yield chunk
+        except Exception, e:
+            self._close(broken=True)
+            raise CommandWrapperException(str(e))
+        self.stderr = self._reader.stderr
+        self.returncode = self._reader.exitcode
+        self._close(broken=False)
+
+    ######################################################################
+    ##
+    def __iter__(self):
+        '''Yields the lines of stdout (with trailing newline)'''
+        return framing.iter_lines(self.chunks())
+
+    ######################################################################
+    ##
+    def records(self):
+        '''Yields the blocks of stdout that are separated by empty lines
+           (as in 'qstat -f' or 'pbsnodes' output), as strings without
+           the trailing newline.
+        '''
+        record = list()
+        for line in self:
+            if line.strip():
+                record.append(line)
+            elif record:
+                yield "".join(record).rstrip('\n')
+                record = list()
+        if record:
+            yield "".join(record).rstrip('\n')
+
+    ######################################################################
+    ##
+    def close(self):
+        '''Reads (and discards) the rest of the output'''
+        for chunk in self.chunks():
+            pass
+
+    ######################################################################
+    ##
+    def result(self):
+        '''Reads the rest of the output into a CommandWrapperResult'''
+        stdout = "".join(self.chunks())
+        return CommandWrapperResult(command=self.command, stdout=stdout,
+                                    stderr=self.stderr, 
+                                    returncode=self.returncode)
+
+    def _close(self, broken):
+        on_close = self._on_close
+        self._on_close = None
+        if on_close is not None:
+            on_close(broken)
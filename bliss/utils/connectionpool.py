@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import threading
+
+from command_wrapper import CommandWrapperException
+
+################################################################################
+################################################################################
+
+class CommandWrapperPoolException(CommandWrapperException):
+    '''Raised for CommandWrapperPool exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class _PoolEntry(object):
+    '''A connected CommandWrapper and its bookkeeping.'''
+
+    __slots__ = ('cw', 'key', 'last_used', 'last_checked')
+
+    def __init__(self, cw, key):
+        self.cw = cw
+        self.key = key
+        self.last_used = time.time()
+        self.last_checked = self.last_used
+
+################################################################################
+################################################################################
+
+class CommandWrapperPool(object):
+    '''A process-wide pool of connected CommandWrappers.
+
+       Connections are keyed by CommandWrapper.pool_key(), i.e., by (mode,
+       user, host, port, credential), so all services (and threads) that
+       talk to the same cluster as the same identity share a small number
+       of warm sessions instead of logging in on their own. A connection is
+       handed out exclusively via lease() and has to be given back with
+       release().
+
+       The pool keeps at most 'max_per_host' sessions per key. As long as
+       a key is in use (i.e., has been leased within 'idle_timeout'
+       seconds), at least 'min_idle' warm sessions are kept around for it.
+       Idle sessions that haven't been used for 'idle_timeout' seconds are
+       closed, and idle sessions are checked with a no-op command every
+       'keepalive_interval' seconds so that dead ones never get leased.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, max_per_host=4, min_idle=1, idle_timeout=300.0,
+                 keepalive_interval=60.0):
+        '''Constructor'''
+        self.max_per_host = max_per_host
+        self.min_idle = min_idle
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+
+        self._cond = threading.Condition()
+        self._idle = dict()       # key -> list of idle _PoolEntry
+        self._busy = dict()       # id(cw) -> leased _PoolEntry
+        self._count = dict()      # key -> number of sessions (incl. pending)
+        self._prototypes = dict() # key -> unconnected wrapper to clone from
+        self._last_lease = dict() # key -> time of the last lease
+
+        self._stats = {'created': 0, 'reused': 0, 'evicted': 0, 'broken': 0}
+        self._maintainer = None
+
+    ######################################################################
+    ##
+    def configure(self, max_per_host=None, min_idle=None, idle_timeout=None,
+                  keepalive_interval=None):
+        '''Changes the pool limits at runtime'''
+        self._cond.acquire()
+        try:
+            if max_per_host is not None:
+                self.max_per_host = max_per_host
+            if min_idle is not None:
+                self.min_idle = min_idle
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if keepalive_interval is not None:
+                self.keepalive_interval = keepalive_interval
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def lease(self, prototype, timeout=None):
+        '''Returns a connected CommandWrapper that is equivalent to the
+           (unconnected) 'prototype' wrapper. Blocks for up to 'timeout'
+           seconds (forever if None) if all sessions for the key are busy.
+        '''
+        key = prototype.pool_key()
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        self._cond.acquire()
+        try:
+            self._prototypes.setdefault(key, prototype)
+            self._last_lease[key] = time.time()
+            self._start_maintainer()
+
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    entry = idle.pop()
+                    self._busy[id(entry.cw)] = entry
+                    self._stats['reused'] += 1
+                    return entry.cw
+                if self._count.get(key, 0) < self.max_per_host:
+                    # reserve a slot, connect outside of the lock
+                    self._count[key] = self._count.get(key, 0) + 1
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise CommandWrapperPoolException(
+                          "Timeout: all %s sessions for %s are in use" \
+                          % (self.max_per_host, str(key)))
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        entry = self._connect(key, prototype)
+        self._cond.acquire()
+        try:
+            self._busy[id(entry.cw)] = entry
+        finally:
+            self._cond.release()
+        return entry.cw
+
+    ######################################################################
+    ##
+    def release(self, cw, broken=False):
+        '''Gives a leased wrapper back to the pool. Wrappers that are
+           'broken', e.g., because a command failed on the transport
+           level, are closed instead of being reused.
+        '''
+        self._cond.acquire()
+        try:
+            entry = self._busy.pop(id(cw), None)
+            if entry is None:
+                return
+            if broken:
+                self._stats['broken'] += 1
+                self._count[entry.key] -= 1
+            else:
+                entry.last_used = time.time()
+                self._idle.setdefault(entry.key, list()).append(entry)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+        if broken:
+            self._close(entry)
+
+    ######################################################################
+    ##
+    def stats(self):
+        '''Returns a dictionary with the pool's counters and occupancy'''
+        self._cond.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['idle'] = sum([len(l) for l in self._idle.values()])
+            stats['busy'] = len(self._busy)
+            stats['sessions'] = dict(self._count)
+            return stats
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def shutdown(self):
+        '''Closes all idle sessions. Leased sessions are closed when
+           they are released.
+        '''
+        self._cond.acquire()
+        try:
+            entries = list()
+            for key in self._idle.keys():
+                entries.extend(self._idle[key])
+                self._count[key] -= len(self._idle[key])
+            self._idle = dict()
+            self._prototypes = dict()
+            self._last_lease = dict()
+        finally:
+            self._cond.release()
+        for entry in entries:
+            self._close(entry)
+
+    ######################################################################
+    ##
+    def _connect(self, key, prototype):
+        '''Creates a new session for 'key'. The slot has to be reserved.'''
+        try:
+            cw = prototype.clone()
+            cw.connect()
+        except Exception:
+            self._cond.acquire()
+            try:
+                self._count[key] -= 1
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+            raise
+        self._cond.acquire()
+        try:
+            self._stats['created'] += 1
+        finally:
+            self._cond.release()
+        return _PoolEntry(cw, key)
+
+    ######################################################################
+    ##
+    def _close(self, entry):
+        '''Disconnects a session that has already left the pool.'''
+        try:
+            entry.cw.disconnect()
+        except Exception:
+            pass # the connection might be dead already
+
+    ######################################################################
+    ##
+    def _start_maintainer(self):
+        '''Starts the maintenance thread. Requires the lock.'''
+        if self._maintainer is None or not self._maintainer.isAlive():
+            self._maintainer = threading.Thread(target=self._maintain_loop,
+                                                name="CommandWrapperPool")
+            self._maintainer.setDaemon(True)
+            self._maintainer.start()
+
+    ######################################################################
+    ##
+    def _maintain_loop(self):
+        '''Body of the maintenance thread.'''
+        while True:
+            self._cond.acquire()
+            try:
+                interval = min(self.idle_timeout, self.keepalive_interval) / 2.0
+            finally:
+                self._cond.release()
+            time.sleep(max(interval, 1.0))
+            try:
+                self.maintain()
+            except Exception:
+                pass # never let the maintenance thread die
+
+    ######################################################################
+    ##
+    def maintain(self):
+        '''Evicts expired sessions, checks idle sessions and tops up the
+           warm sessions. Called periodically by the maintenance thread.
+        '''
+        now = time.time()
+        evict = list()
+        check = list()
+        warm = list()
+
+        self._cond.acquire()
+        try:
+            for key in self._idle.keys():
+                idle = self._idle[key]
+                in_use = (now - self._last_lease.get(key, 0)) < self.idle_timeout
+                keep = list()
+                removed = 0
+                # the most recently used sessions are at the end
+                for entry in reversed(idle):
+                    expired = (now - entry.last_used) > self.idle_timeout
+                    if expired and (not in_use or len(keep) >= self.min_idle):
+                        evict.append(entry)
+                        removed += 1
+                    elif (now - entry.last_checked) > self.keepalive_interval:
+                        # (keeps its slot while it's being checked)
+                        check.append(entry)
+                    else:
+                        keep.insert(0, entry)
+                self._idle[key] = keep
+                self._count[key] -= removed
+
+            for key in self._prototypes.keys():
+                in_use = (now - self._last_lease.get(key, 0)) < self.idle_timeout
+                missing = self.min_idle - len(self._idle.get(key, []))
+                free = self.max_per_host - self._count.get(key, 0)
+                if not in_use:
+                    continue
+                for i in range(0, max(0, min(missing, free))):
+                    self._count[key] = self._count.get(key, 0) + 1
+                    warm.append(key)
+            self._stats['evicted'] += len(evict)
+        finally:
+            self._cond.release()
+
+        for entry in evict:
+            self._close(entry)
+
+        # health checks and warm-ups run outside of the lock. checked
+        # sessions have left the idle list but still hold their slot, so
+        # the pool never grows beyond 'max_per_host' in the meantime.
+        for entry in check:
+            alive = False
+            try:
+                alive = (entry.cw.run("true").returncode == 0)
+            except Exception:
+                pass
+            self._cond.acquire()
+            try:
+                if alive:
+                    entry.last_checked = time.time()
+                    self._idle.setdefault(entry.key, list()).append(entry)
+                else:
+                    self._stats['broken'] += 1
+                    self._count[entry.key] -= 1
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+            if not alive:
+                self._close(entry)
+
+        for key in warm:
+            try:
+                entry = self._connect(key, self._prototypes[key])
+            except Exception:
+                continue
+            self._cond.acquire()
+            try:
+                self._idle.setdefault(key, list()).insert(0, entry)
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+
+################################################################################
+################################################################################
+
+class PooledCommandWrapper(object):
+    '''Drop-in replacement for a CommandWrapper that leases a session from
+       a CommandWrapperPool for every command it runs.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, prototype, pool=None):
+        '''Constructor: 'prototype' is an unconnected CommandWrapper.'''
+        if pool is None:
+            pool = get_connection_pool()
+        self._prototype = prototype
+        self._pool = pool
+        self._is_connected = False
+
+    ######################################################################
+    ##
+    def connect(self):
+        '''Makes sure that (at least) one session can be established.'''
+        cw = self._pool.lease(self._prototype)
+        self._pool.release(cw)
+        self._is_connected = True
+
+    ######################################################################
+    ##
+    def disconnect(self):
+        '''Sessions stay in the pool. Nothing to do.'''
+        self._is_connected = False
+
+    ######################################################################
+    ##
+    def run(self, executable, arguments=[]):
+        '''Runs a command (blocking) on a leased session'''
+        if not self._is_connected:
+            raise CommandWrapperException("Command wrapper is not connected")
+        cw = self._pool.lease(self._prototype)
+        try:
+            result = cw.run(executable, arguments)
+        except:
+            # whatever went wrong, the lease must not leak: lease()
+            # would block forever once all sessions are gone.
+            self._pool.release(cw, broken=True)
+            raise
+        self._pool.release(cw)
+        return result
+
+    ######################################################################
+    ##
+    def run_stream(self, executable, arguments=[]):
+        '''Runs a command and streams its output. The session is leased
+           until the stream has been consumed or closed.
+        '''
+        if not self._is_connected:
+            raise CommandWrapperException("Command wrapper is not connected")
+        cw = self._pool.lease(self._prototype)
+        try:
+            stream = cw.run_stream(executable, arguments)
+        except:
+            self._pool.release(cw, broken=True)
+            raise
+        def release(broken):
+            self._pool.release(cw, broken=broken)
+        stream._on_close = release
+        return stream
+
+    ######################################################################
+    ##
+    def run_many(self, commands):
+        '''Runs a list of commands (blocking) on one leased session'''
+        if not self._is_connected:
+            raise CommandWrapperException("Command wrapper is not connected")
+        cw = self._pool.lease(self._prototype)
+        try:
+            results = cw.run_many(commands)
+        except:
+            self._pool.release(cw, broken=True)
+            raise
+        self._pool.release(cw)
+        return results
+
+################################################################################
+################################################################################
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    '''Returns the process-wide CommandWrapperPool.'''
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = CommandWrapperPool()
+        return _pool
+    finally:
+        _pool_lock.release()
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''OpenSSH ControlMaster based remote command execution.
+
+   Instead of driving one interactive shell via pexpect, a single master
+   connection is started per (user, host, port, credential) -- the user
+   key, or the proxy with gsissh -- and every command runs as
+   a separate 'ssh -S <socket> host cmd' on top of it. Each command gets
+   its own channel, so exit code, stdout and stderr are always exact, and
+   any number of commands can be in flight at the same time on one
+   authenticated TCP connection.
+
+   Authentication has to work non-interactively (keys, agent, GSI proxy).
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import hashlib
+import shutil
+import atexit
+import tempfile
+import threading
+import subprocess
+
+import framing
+from localshell import ProcessReader
+
+################################################################################
+################################################################################
+
+class ControlMasterException(Exception):
+    '''Raised for ControlMasterConnection exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+_masters = dict()   # (executable, user, host, port, credential) -> [socket, refcount]
+_starting = dict()  # (executable, user, host, port, credential) -> threading.Event
+_masters_lock = threading.Lock()
+_socket_dir = None
+
+def _get_socket_dir():
+    '''Returns the (private) directory for the master sockets. Requires
+       the lock.
+    '''
+    global _socket_dir
+    if _socket_dir is None:
+        # keep it short -- unix socket paths are limited to ~100 chars
+        _socket_dir = tempfile.mkdtemp(prefix='bliss-cm-', dir='/tmp')
+        atexit.register(_shutdown_masters)
+    return _socket_dir
+
+def _shutdown_masters():
+    '''Stops all masters that are still running. Called at exit.'''
+    _masters_lock.acquire()
+    try:
+        for (key, (socket, refcount)) in _masters.items():
+            _control(key[0], socket, key[1], key[2], key[3], 'exit')
+        _masters.clear()
+        if _socket_dir is not None:
+            shutil.rmtree(_socket_dir, ignore_errors=True)
+    finally:
+        _masters_lock.release()
+
+def _base_args(executable, socket, username, hostname, port):
+    '''Returns the common command line for a master or a client'''
+    args = [executable, '-S', socket, '-p', str(port),
+            '-o', 'BatchMode=yes']
+    if username:
+        args.extend(['-l', username])
+    return args
+
+def _control(executable, socket, username, hostname, port, command):
+    '''Sends a control command ('check', 'exit') to a master. Returns
+       True on success.
+    '''
+    args = _base_args(executable, socket, username, hostname, port)
+    args.extend(['-O', command, hostname])
+    devnull = open(os.devnull, 'r+')
+    try:
+        return subprocess.call(args, stdin=devnull, stdout=devnull,
+                               stderr=devnull) == 0
+    finally:
+        devnull.close()
+
+################################################################################
+################################################################################
+
+class ControlMasterConnection(object):
+    '''Runs commands on a remote host via a shared OpenSSH ControlMaster.
+
+       The public interface is the same as the one of SSHConnection, so
+       both can be used interchangeably. Unlike SSHConnection, a single
+       ControlMasterConnection can be used by multiple threads at once.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, gsissh=False):
+        '''Constructor'''
+        if gsissh:
+            self._executable = 'gsissh'
+        else:
+            self._executable = 'ssh'
+        self._key = None
+        self._socket = None
+
+    ######################################################################
+    ##
+    def login(self, hostname, port=22, username=None, password=None,
+              userkey=None, x509_userproxy=None, connect_timeout=30):
+        '''Starts (or attaches to) the master for the given host and
+           credential. With gsissh, the credential is 'x509_userproxy'
+           (or $X509_USER_PROXY), otherwise 'userkey'.
+        '''
+        if password:
+            raise ControlMasterException("ControlMaster connections don't "
+              "support password authentication -- use keys or an agent")
+
+        # masters are never shared between different identities
+        if self._executable == 'gsissh':
+            credential = x509_userproxy or os.environ.get('X509_USER_PROXY')
+        else:
+            credential = userkey
+        key = (self._executable, username, hostname, int(port), credential)
+
+        # the lock only protects the tables -- starting or checking a
+        # master can take a while, and other hosts shouldn't have to
+        # wait for that.
+        while True:
+            _masters_lock.acquire()
+            try:
+                entry = _masters.get(key)
+                starting = _starting.get(key)
+                if entry is not None:
+                    entry[1] += 1
+                elif starting is None:
+                    _starting[key] = threading.Event()
+            finally:
+                _masters_lock.release()
+
+            if entry is not None:
+                if _control(self._executable, entry[0], username, hostname,
+                            port, 'check'):
+                    self._key = key
+                    self._socket = entry[0]
+                    return
+                # the master is gone -- start a new one
+                _masters_lock.acquire()
+                try:
+                    entry[1] -= 1
+                    if _masters.get(key) is entry:
+                        del _masters[key]
+                finally:
+                    _masters_lock.release()
+            elif starting is not None:
+                # another thread is starting the master
+                starting.wait()
+            else:
+                break
+
+        socket = None
+        try:
+            socket = self._start_master(key, hostname, port, username,
+                                        userkey, x509_userproxy,
+                                        connect_timeout)
+        finally:
+            _masters_lock.acquire()
+            try:
+                if socket is not None:
+                    _masters[key] = [socket, 1]
+                _starting.pop(key).set()
+            finally:
+                _masters_lock.release()
+        self._key = key
+        self._socket = socket
+
+    def _start_master(self, key, hostname, port, username, userkey,
+                      x509_userproxy, connect_timeout):
+        '''Starts a master for 'key' and returns its socket'''
+        # (the socket name is derived from the whole key, credential
+        # included)
+        _masters_lock.acquire()
+        try:
+            socket = os.path.join(_get_socket_dir(), "cm-%s" \
+              % hashlib.md5(str(key)).hexdigest()[:12])
+        finally:
+            _masters_lock.release()
+
+        args = _base_args(self._executable, socket, username, hostname, port)
+        args.extend(['-M', '-N', '-f',
+                     '-o', 'ConnectTimeout=%d' % connect_timeout,
+                     '-o', 'ServerAliveInterval=60'])
+        if userkey:
+            args.extend(['-i', userkey])
+        args.append(hostname)
+
+        # the master authenticates with the proxy once; the commands
+        # that run on top of it don't need it anymore
+        env = None
+        if x509_userproxy:
+            env = dict(os.environ)
+            env['X509_USER_PROXY'] = x509_userproxy
+
+        # with '-f', ssh goes to the background once it's authenticated.
+        # the background process keeps stderr open, so it goes to a file
+        # -- reading it from a pipe would block until the master exits.
+        devnull = open(os.devnull, 'r+')
+        errfile = tempfile.TemporaryFile()
+        try:
+            try:
+                master = subprocess.Popen(args, stdin=devnull, stdout=devnull,
+                                          stderr=errfile, env=env)
+                master.wait()
+            except OSError, e:
+                raise ControlMasterException("Couldn't start %s ControlMaster "
+                  "for %s: %s" % (self._executable, hostname, str(e)))
+            errfile.seek(0)
+            err = errfile.read()
+        finally:
+            devnull.close()
+            errfile.close()
+
+        if master.returncode != 0 or not \
+           _control(self._executable, socket, username, hostname, port, 'check'):
+            raise ControlMasterException("Couldn't start %s ControlMaster "
+              "for %s: %s" % (self._executable, hostname, err.strip()))
+        return socket
+
+    ######################################################################
+    ##
+    def logout(self):
+        '''Detaches from the master. The last one to leave stops it.'''
+        if self._key is None:
+            return
+        last = False
+        _masters_lock.acquire()
+        try:
+            entry = _masters.get(self._key)
+            if entry is not None and entry[0] == self._socket:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _masters[self._key]
+                    last = True
+        finally:
+            _masters_lock.release()
+        if last:
+            (executable, username, hostname, port) = self._key[:4]
+            _control(executable, self._socket, username, hostname, port, 'exit')
+        self._key = None
+        self._socket = None
+
+    ######################################################################
+    ##
+    def execute(self, command):
+        '''Executes a command on the remote host. Returns a dictionary
+           with the keys 'exitcode', 'output' and 'stderr'.
+        '''
+        if self._key is None:
+            raise ControlMasterException("Not logged in")
+
+        (executable, username, hostname, port) = self._key[:4]
+        args = _base_args(executable, self._socket, username, hostname, port)
+        args.extend([hostname, command])
+
+        devnull = open(os.devnull, 'r')
+        try:
+            proc = subprocess.Popen(args, stdin=devnull,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            (out, err) = proc.communicate()
+        except OSError, e:
+            raise ControlMasterException("Couldn't execute '%s': %s" \
+              % (command, str(e)))
+        finally:
+            devnull.close()
+
+        # 255 is either the remote exit code or an ssh error --
+        # only the latter leaves us without a master.
+        if proc.returncode == 255 and not \
+           _control(executable, self._socket, username, hostname, port, 'check'):
+            raise ControlMasterException("Lost ControlMaster connection to "
+              "%s while executing '%s': %s" % (hostname, command, err.strip()))
+
+        return {'exitcode': proc.returncode, 'output': out, 'stderr': err}
+
+    ######################################################################
+    ##
+    def execute_stream(self, command):
+        '''Executes a command on the remote host and returns a reader
+           that streams its output (see localshell.ProcessReader).
+        '''
+        if self._key is None:
+            raise ControlMasterException("Not logged in")
+
+        (executable, username, hostname, port) = self._key[:4]
+        args = _base_args(executable, self._socket, username, hostname, port)
+        args.extend([hostname, command])
+
+        devnull = open(os.devnull, 'r')
+        errfile = tempfile.TemporaryFile()
+        try:
+            proc = subprocess.Popen(args, stdin=devnull,
+                                    stdout=subprocess.PIPE,
+                                    stderr=errfile)
+        except OSError, e:
+            errfile.close()
+            raise ControlMasterException("Couldn't execute '%s': %s" \
+              % (command, str(e)))
+        finally:
+            devnull.close()
+        return ProcessReader(proc, errfile)
+
+    ######################################################################
+    ##
+    def execute_many(self, commands):
+        '''Executes a list of commands on the remote host in a single
+           round trip. Returns a list of dictionaries like execute().
+        '''
+        if self._key is None:
+            raise ControlMasterException("Not logged in")
+
+        (executable, username, hostname, port) = self._key[:4]
+        args = _base_args(executable, self._socket, username, hostname, port)
+        args.extend([hostname, '/bin/sh'])
+
+        (tags, script) = framing.frame_script(commands)
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            (out, err) = proc.communicate(script)
+        except OSError, e:
+            raise ControlMasterException("Couldn't execute %s: %s" \
+              % (commands, str(e)))
+
+        try:
+            frames = framing.parse_frames(out, tags)
+        except framing.FramingException, fe:
+            raise ControlMasterException("Couldn't execute %s on %s: %s %s" \
+              % (commands, hostname, str(fe), err.strip()))
+
+        return [{'exitcode': rc, 'output': stdout, 'stderr': stderr} \
+                for (stdout, stderr, rc) in frames]
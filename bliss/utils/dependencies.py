@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''Job dependencies.
+
+   A job description's 'dependencies' map a dependency type to the jobs
+   the job has to wait for::
+
+     afterok  -- the job runs after these jobs have finished successfully
+     afterany -- the job runs after these jobs have finished, no matter how
+
+   Batch system adaptors resolve the dependencies to native job ids and
+   let the scheduler hold the job (resolve(), waves()). Adaptors without
+   scheduler support start the job on the client side once its
+   dependencies have finished (DependencyGate).
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import threading
+
+import bliss.saga
+
+AFTER_OK  = "afterok"
+AFTER_ANY = "afterany"
+TYPES     = [AFTER_OK, AFTER_ANY]
+
+_FINAL = [bliss.saga.job.Job.Done, bliss.saga.job.Job.Failed,
+          bliss.saga.job.Job.Canceled]
+
+################################################################################
+################################################################################
+
+class DependencyException(Exception):
+    '''Raised for dependency exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+def parents(jd):
+    '''Returns the dependencies of a job description as a list of
+       (type, job) tuples.
+    '''
+    if jd.dependencies is None:
+        return list()
+    return [(dep_type, job) for dep_type in TYPES \
+            for job in jd.dependencies.get(dep_type, list())]
+
+def succeeded(state, exitcode):
+    '''Returns True if a job in 'state' satisfies an 'afterok' dependency'''
+    return state == bliss.saga.job.Job.Done and \
+      (exitcode is None or str(exitcode) == "0")
+
+def waves(jobs):
+    '''Splits a list of jobs into lists that can be submitted one after the
+       other: the jobs of each list only depend on jobs of earlier lists
+       (or on jobs that aren't in 'jobs' at all). Jobs with circular
+       dependencies end up in the last list.
+    '''
+    remaining = list(jobs)
+    waiting = set([job._id() for job in jobs])
+    result = list()
+    while len(remaining) > 0:
+        wave = [job for job in remaining \
+                if not [parent for (dep_type, parent) \
+                        in parents(job.get_description()) \
+                        if parent._id() in waiting]]
+        if len(wave) == 0:
+            wave = remaining
+        for job in wave:
+            waiting.discard(job._id())
+        remaining = [job for job in remaining if job._id() in waiting]
+        result.append(wave)
+    return result
+
+def resolve(jd, service_url, submitted, lookup):
+    '''Returns the dependencies of a job description as a list of (type,
+       native id) tuples, for jobs of the service at 'service_url'.
+
+       'submitted' maps the _id() of jobs that are submitted in the same
+       go to their jobinfos (or to the exception their submission raised).
+       'lookup(native_id)' returns the cached jobinfo of a job, or None.
+       Dependencies on jobs that are known to have finished are satisfied
+       already and left out. Raises DependencyException if a dependency
+       can't be satisfied anymore.
+    '''
+    resolved = list()
+    for (dep_type, parent) in parents(jd):
+        if parent._id() in submitted:
+            jobinfo = submitted[parent._id()]
+            if isinstance(jobinfo, Exception):
+                raise DependencyException("Dependency %s wasn't submitted: %s" \
+                  % (parent._id(), jobinfo))
+            native_id = jobinfo.jobid
+        else:
+            try:
+                jobid = parent.get_job_id()
+            except Exception, ex:
+                raise DependencyException("Dependency %s wasn't submitted: %s" \
+                  % (parent._id(), ex))
+            if jobid is None or jobid.native_id is None:
+                raise DependencyException("Dependency %s hasn't been run yet" \
+                  % parent._id())
+            if str(jobid.service_url) != str(service_url):
+                raise DependencyException(
+                  "Dependency %s is managed by a different job service: %s" \
+                  % (jobid, jobid.service_url))
+            native_id = jobid.native_id
+
+            jobinfo = lookup(native_id)
+            if jobinfo is not None and jobinfo.state in _FINAL:
+                if dep_type == AFTER_ANY or \
+                  succeeded(jobinfo.state, jobinfo.exitcode):
+                    continue
+                raise DependencyException("Dependency %s has failed" % jobid)
+        resolved.append((dep_type, native_id))
+    return resolved
+
+################################################################################
+################################################################################
+
+class DependencyGate(object):
+    '''Starts a job on the client side once its dependencies have finished.
+
+       A background thread polls the states of the parent jobs every
+       'poll_interval' seconds. Once all of them are final, it calls
+       'start()' -- or, if an 'afterok' dependency didn't finish
+       successfully, 'skip(reason)'. Both are called with the gate's lock
+       held, so cancel() doesn't interfere with a job that is just being
+       started.
+    '''
+
+    poll_interval = 1.0
+
+    ######################################################################
+    ##
+    def __init__(self, jd, start, skip, name="DependencyGate"):
+        '''Constructor'''
+        self._parents = parents(jd)
+        self._start = start
+        self._skip = skip
+        self._name = name
+        self._cond = threading.Condition()
+        self._open = False    # start() or skip() has been called
+        self._canceled = False
+
+    def open(self):
+        '''Starts waiting for the dependencies in the background'''
+        thread = threading.Thread(target=self._wait_loop, name=self._name)
+        thread.setDaemon(True)
+        thread.start()
+
+    def cancel(self):
+        '''Cancels the job, unless it has been started or skipped already.
+           Returns True if it has been canceled.
+        '''
+        self._cond.acquire()
+        try:
+            if not self._open:
+                self._canceled = True
+                self._cond.notifyAll()
+            return self._canceled
+        finally:
+            self._cond.release()
+
+    def wait(self, timeout=None):
+        '''Waits up to 'timeout' seconds (forever if None) until the job
+           has been started, skipped or canceled. Returns True if it has.
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self._cond.acquire()
+        try:
+            while not (self._open or self._canceled):
+                if deadline is None:
+                    self._cond.wait(self.poll_interval)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(min(remaining, self.poll_interval))
+            return self._open or self._canceled
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def _wait_loop(self):
+        '''Runs in the background thread'''
+        reason = None
+        pending = list(self._parents)
+        while len(pending) > 0:
+            self._cond.acquire()
+            try:
+                if self._canceled:
+                    return
+            finally:
+                self._cond.release()
+            waiting = list()
+            for (dep_type, parent) in pending:
+                try:
+                    state = parent.get_state()
+                except Exception, ex:
+                    state = bliss.saga.job.Job.Failed
+                if state not in _FINAL:
+                    waiting.append((dep_type, parent))
+                elif dep_type == AFTER_OK and reason is None and \
+                  not succeeded(state, self._exitcode(parent)):
+                    reason = "Dependency %s didn't finish successfully (%s)" \
+                      % (parent._id(), state)
+            pending = waiting
+            if len(pending) > 0:
+                time.sleep(self.poll_interval)
+
+        self._cond.acquire()
+        try:
+            if self._canceled:
+                return
+            self._open = True
+            if reason is None:
+                self._start()
+            else:
+                self._skip(reason)
+        finally:
+            self._cond.notifyAll()
+            self._cond.release()
+
+    def _exitcode(self, job):
+        try:
+            return job.exitcode
+        except Exception, ex:
+            return None
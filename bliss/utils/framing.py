@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''Framed command protocol for persistent shell connections.
+
+   Instead of scraping the output up to the next shell prompt and then
+   asking for 'echo $?' in a second exchange, every command is wrapped
+   in a set of unique sentinels::
+
+     BLISS-BEGIN-<tag>
+     <stdout>
+     BLISS-STDERR-<tag>
+     <stderr>
+     BLISS-END-<tag>:<exitcode>
+
+   so that stdout, stderr and the exit code can be demultiplexed from a
+   single response. The sentinels are never echoed verbatim by the shell
+   (the printf format strings split them up), so the echoed command line
+   can't produce a false match.
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import re
+import random
+
+BEGIN  = "BLISS-BEGIN"
+STDERR = "BLISS-STDERR"
+END    = "BLISS-END"
+READY  = "BLISS-READY"
+
+# the shell variable that points to the per-connection stderr spool file
+ERRFILE = "BLISS_ERRFILE"
+
+################################################################################
+################################################################################
+
+class FramingException(Exception):
+    '''Raised if a framed response can't be parsed.
+    '''
+
+################################################################################
+################################################################################
+
+def new_tag():
+    '''Returns a new, random sentinel tag.'''
+    return "%08x" % random.getrandbits(32)
+
+def ready_marker(tag):
+    '''Returns the marker the shell prints once setup_command() is done.'''
+    return "%s-%s" % (READY, tag)
+
+def end_pattern(tag):
+    '''Returns a regular expression that matches the end sentinel of the
+       command framed with 'tag'. Group 1 is the exit code.
+    '''
+    return re.escape("%s-%s:" % (END, tag)) + r"(\d+)\r?\n"
+
+def setup_command(tag):
+    '''Returns a command line that prepares an interactive (or piped) bash
+       for the framed protocol: no echo, no prompts, a private stderr spool
+       file. The shell prints ready_marker(tag) once it's done.
+    '''
+    return "stty -echo -onlcr 2>/dev/null; unset PROMPT_COMMAND; PS1=''; PS2=''; " \
+           "%s=$(mktemp /tmp/bliss.XXXXXX 2>/dev/null || echo /tmp/bliss.$$); " \
+           "trap 'rm -f \"$%s\"' EXIT; printf '%%s-%%s\\n' %s %s" \
+           % (ERRFILE, ERRFILE, READY, tag)
+
+def frame_command(commandline, tag):
+    '''Wraps 'commandline' into begin, stderr and end sentinels.
+
+       The command runs in the current shell (so 'cd' and variable
+       assignments persist), but with stdin redirected from /dev/null
+       so that it can't swallow the commands that follow it.
+    '''
+    if len(commandline.strip()) == 0:
+        commandline = ":"
+    return "printf '\\n%%s-%%s\\n' %s %s; { %s\n} </dev/null 2>\"$%s\"; BLISS_RC=$?; " \
+           "printf '\\n%%s-%%s\\n' %s %s; cat \"$%s\"; printf '\\n%%s-%%s:%%s\\n' %s %s $BLISS_RC" \
+           % (BEGIN, tag, commandline, ERRFILE, STDERR, tag, ERRFILE, END, tag)
+
+def parse_frame(data, tag):
+    '''Splits a framed response into (stdout, stderr, exitcode).
+
+       'data' has to contain everything the shell printed for the command
+       framed with 'tag', up to and including the end sentinel. Anything
+       in front of the begin sentinel is discarded.
+    '''
+    data = data.replace("\r\n", "\n")
+
+    begin  = "%s-%s\n" % (BEGIN, tag)
+    stderr = "\n%s-%s\n" % (STDERR, tag)
+    end    = "\n%s-%s:" % (END, tag)
+
+    b = data.find(begin)
+    s = data.find(stderr, b)
+    e = data.find(end, s)
+    if b == -1 or s == -1 or e == -1:
+        raise FramingException("Incomplete response for command frame %s" % tag)
+
+    try:
+        exitcode = int(data[e+len(end):].split("\n", 1)[0])
+    except ValueError:
+        raise FramingException("Invalid exit code in command frame %s" % tag)
+
+    return (data[b+len(begin):s], data[s+len(stderr):e], exitcode)
+
+def frame_script(commandlines):
+    '''Returns (tags, script): a self-contained shell script that runs all
+       'commandlines' framed with their own tag, for shells that read the
+       script from a pipe instead of a terminal. The output can be split
+       up again with parse_frames().
+    '''
+    tags = [new_tag() for c in commandlines]
+    lines = [setup_command(new_tag())]
+    for (commandline, tag) in zip(commandlines, tags):
+        lines.append(frame_command(commandline, tag))
+    return (tags, "\n".join(lines) + "\n")
+
+def parse_frames(data, tags):
+    '''Splits the output of several framed commands into a list of
+       (stdout, stderr, exitcode) tuples, one per tag.
+    '''
+    results = list()
+    for tag in tags:
+        end = "%s-%s:" % (END, tag)
+        e = data.find(end)
+        if e == -1:
+            raise FramingException("Incomplete response for command frame %s" % tag)
+        e = data.find("\n", e)
+        if e == -1:
+            e = len(data)
+        results.append(parse_frame(data[:e+1], tag))
+        data = data[e+1:]
+    return results
+
+################################################################################
+################################################################################
+
+class FrameReader(object):
+    '''Incrementally demultiplexes the response to a framed command.
+
+       'read' is a callable that returns the next chunk of output (of any
+       size) and raises an exception on EOF or timeout. Stdout is handed
+       out chunk by chunk via chunks(), so it never has to be held in
+       memory at once. The sentinels are searched for only in the newly
+       read data plus a short carry-over from the previous chunk, i.e.,
+       in a bounded window, so the total effort is linear in the output
+       size. Once chunks() is exhausted, 'stderr' and 'exitcode' are set
+       and 'remainder' holds any output read beyond the end sentinel.
+    '''
+
+    def __init__(self, read, tag, initial=''):
+        self._read = read
+        self._tag = tag
+        self._begin  = "%s-%s\n" % (BEGIN, tag)
+        self._stderr = "\n%s-%s\n" % (STDERR, tag)
+        self._end    = "\n%s-%s:" % (END, tag)
+
+        # all state lives here (and not in the chunks() generator), so
+        # that a reader that was abandoned half-way can still be drained
+        self._phase = 0   # 0: before begin, 1: stdout, 2: stderr, 3: done
+        self._buf = ''
+        self._data = self._normalize(initial)
+        self._errs = list()
+        self.stderr = None
+        self.exitcode = None
+        self.remainder = ''
+
+    def done(self):
+        '''Returns True once the end sentinel has been read'''
+        return self._phase == 3
+
+    def _normalize(self, data):
+        # keep a trailing '\r' until we know whether a '\n' follows
+        data = self._buf + data
+        if data.endswith('\r'):
+            self._buf = '\r'
+            data = data[:-1]
+        else:
+            self._buf = ''
+        return data.replace('\r\n', '\n')
+
+    def _step(self):
+        '''Consumes what's been read so far or reads more. Returns the
+           stdout data that has become available (possibly '').
+        '''
+        if self._phase == 0:
+            i = self._data.find(self._begin)
+            if i != -1:
+                self._data = self._data[i+len(self._begin):]
+                self._phase = 1
+            else:
+                self._data = self._data[-(len(self._begin)-1):] \
+                           + self._normalize(self._read())
+            return ''
+
+        elif self._phase == 1:
+            i = self._data.find(self._stderr)
+            if i != -1:
+                out = self._data[:i]
+                self._data = self._data[i+len(self._stderr):]
+                self._phase = 2
+                return out
+            # hand out everything that can't be part of the sentinel
+            keep = len(self._stderr) - 1
+            if len(self._data) > keep:
+                out = self._data[:-keep]
+                self._data = self._data[-keep:]
+                return out
+            self._data += self._normalize(self._read())
+            return ''
+
+        elif self._phase == 2:
+            # stderr is usually short, so it's collected
+            i = self._data.find(self._end)
+            if i != -1:
+                j = self._data.find('\n', i + len(self._end))
+                if j != -1:
+                    self._errs.append(self._data[:i])
+                    try:
+                        self.exitcode = int(self._data[i+len(self._end):j])
+                    except ValueError:
+                        raise FramingException("Invalid exit code in command frame %s" \
+                          % self._tag)
+                    self.stderr = "".join(self._errs)
+                    self.remainder = self._data[j+1:] + self._buf
+                    self._data = ''
+                    self._buf = ''
+                    self._phase = 3
+                    return ''
+            keep = len(self._end) + 16
+            if len(self._data) > keep:
+                self._errs.append(self._data[:-keep])
+                self._data = self._data[-keep:]
+            self._data += self._normalize(self._read())
+            return ''
+
+        return ''
+
+    def chunks(self):
+        '''Yields stdout in chunks'''
+        while self._phase != 3:
+            out = self._step()
+            if out:
+                yield out
+
+    def drain(self):
+        '''Reads (and discards) the rest of the response'''
+        for chunk in self.chunks():
+            pass
+
+################################################################################
+################################################################################
+
+def iter_lines(chunks):
+    '''Turns an iterator over chunks of output into one over lines. The
+       lines keep their trailing newline.
+    '''
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    if partial:
+        yield partial
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import urlparse
+import threading
+
+################################################################################
+################################################################################
+
+def get_job_cache_size(url, default=10000):
+    '''Returns the max. number of jobs that a service remembers, as
+       requested for 'url' via a '?job_cache_size=...' URL query
+       parameter, or 'default'.
+    '''
+    if url.query is not None:
+        values = urlparse.parse_qs(url.query).get('job_cache_size')
+        if values:
+            try:
+                size = int(values[-1])
+            except ValueError:
+                size = 0
+            if size < 1:
+                raise JobCacheException("Invalid job_cache_size '%s'" % values[-1])
+            return size
+    return default
+
+################################################################################
+################################################################################
+
+class JobCacheException(Exception):
+    '''Raised for JobCache exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class _Entry(object):
+    '''A node in the cache's LRU list.'''
+
+    __slots__ = ('key', 'value', 'final', 'prev', 'next')
+
+    def __init__(self, key=None, value=None):
+        self.key = key
+        self.value = value
+        self.final = False
+        self.prev = None
+        self.next = None
+
+################################################################################
+################################################################################
+
+class JobCache(object):
+    '''A bounded, dictionary-like cache for the job infos of a service.
+
+       Job infos that are stored with a final state are replaced by the
+       (much smaller) record that 'compact(jobinfo)' returns -- usually
+       just the job id, state and exit code. Once the cache holds more
+       than 'max_size' jobs, the least recently used final ones are
+       evicted, and 'on_evict(key)' is called for each of them. Jobs that
+       haven't finished yet are never evicted, since their states would
+       be lost for good.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, max_size, is_final, compact=None, on_evict=None):
+        '''Constructor'''
+        if max_size < 1:
+            raise JobCacheException("Invalid cache size: %s" % max_size)
+        self._max_size = max_size
+        self._is_final = is_final
+        self._compact = compact
+        self._on_evict = on_evict
+
+        self._lock = threading.RLock()
+        self._entries = dict()
+        self._lru = _Entry()   # sentinel: lru.next is the oldest final entry
+        self._lru.prev = self._lru.next = self._lru
+        self._final = 0        # number of entries in a final state
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                       'compactions': 0}
+
+    ######################################################################
+    ##
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    ######################################################################
+    ##
+    def __getitem__(self, key):
+        '''Returns the job info for 'key' and marks it as recently used.'''
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                raise KeyError(key)
+            self._stats['hits'] += 1
+            if entry.final:
+                self._unlink(entry)
+                self._append(entry)
+            return entry.value
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        '''Like dict.get()'''
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    ######################################################################
+    ##
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def put(self, key, value):
+        '''Stores (or replaces) the job info for 'key'. Returns what was
+           stored, i.e., 'value' or its compacted version.
+        '''
+        evicted = list()
+        self._lock.acquire()
+        try:
+            final = self._is_final(value)
+            if final and self._compact is not None:
+                value = self._compact(value)
+                self._stats['compactions'] += 1
+
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(key, value)
+                self._entries[key] = entry
+            else:
+                entry.value = value
+                if entry.final:
+                    self._unlink(entry)
+                    self._final -= 1
+            entry.final = final
+            if final:
+                self._final += 1
+                self._append(entry)
+
+            # the new entry itself is spared, even if it's the only
+            # one that could go
+            while len(self._entries) > self._max_size \
+              and self._lru.next is not self._lru \
+              and self._lru.next is not entry:
+                oldest = self._lru.next
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+                evicted.append(oldest.key)
+        finally:
+            self._lock.release()
+
+        # outside of the lock, since the callback may take other locks
+        if self._on_evict is not None:
+            for key in evicted:
+                self._on_evict(key)
+        return value
+
+    ######################################################################
+    ##
+    def __delitem__(self, key):
+        self._lock.acquire()
+        try:
+            self._remove(self._entries[key])
+        finally:
+            self._lock.release()
+
+    def pop(self, key, default=None):
+        '''Like dict.pop(), but with a default of None'''
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._remove(entry)
+            return entry.value
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def stats(self):
+        '''Returns the cache's occupancy and its counters'''
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_size'] = self._max_size
+            stats['final'] = self._final
+            return stats
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def _remove(self, entry):
+        del self._entries[entry.key]
+        if entry.final:
+            self._unlink(entry)
+            self._final -= 1
+
+    def _unlink(self, entry):
+        entry.prev.next = entry.next
+        entry.next.prev = entry.prev
+        entry.prev = entry.next = None
+
+    def _append(self, entry):
+        '''Makes 'entry' the most recently used one'''
+        last = self._lru.prev
+        last.next = entry
+        entry.prev = last
+        entry.next = self._lru
+        self._lru.prev = entry
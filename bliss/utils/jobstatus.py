@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''Job status marker files.
+
+   Generated batch scripts wrap the job's command line so that it writes
+   a marker file, named after the job's native id, to a status directory
+   (relative to the remote home directory)::
+
+     start <timestamp>
+     end <timestamp> <exit code>
+
+   Once a job has left the queue, its exit code can be read from there.
+   collect_command() returns a command that prints the 'end' lines of
+   a list of jobs (and removes the markers of jobs that have already
+   been collected), which parse_collected() turns into a dictionary.
+   Markers that are never collected (e.g., of jobs whose client went
+   away) are removed once they are older than a few days.
+
+   A job can check the markers of other jobs, too: succeeded_command()
+   returns a condition that tells whether they all exited with 0.
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import re
+
+_END = re.compile(r'^(.+):end (\d+) (\d+)\s*$', re.M)
+
+################################################################################
+################################################################################
+
+def wrap_command(command, status_dir, id_expr):
+    '''Returns the script lines that run 'command' and record its start
+       and end times and its exit code in the marker file. 'id_expr' is
+       a shell expression for the job's native id (e.g., '$PBS_JOBID').
+    '''
+    return "bliss_status=\"$HOME/%s/%s\"\n" \
+           "mkdir -p \"$HOME/%s\" && echo \"start $(date +%%s)\" > \"$bliss_status\"\n" \
+           "%s\n" \
+           "bliss_rc=$?\n" \
+           "echo \"end $(date +%%s) $bliss_rc\" >> \"$bliss_status\"\n" \
+           "exit $bliss_rc\n" % (status_dir, id_expr, status_dir, command)
+
+def succeeded_command(status_dir, native_ids, quote=str):
+    '''Returns a shell condition that is true if the markers of all of
+       'native_ids' have an 'end' line with exit code 0.
+    '''
+    return "(cd \"$HOME/%s\" 2>/dev/null && for f in %s; do " \
+           "grep -q '^end [0-9]* 0$' -- \"$f\" 2>/dev/null || exit 1; done)" \
+      % (status_dir, " ".join([quote(i) for i in native_ids]))
+
+def collect_command(status_dir, native_ids, remove_ids=[], quote=str,
+                    max_age=None):
+    '''Returns a command that prints the 'end' line of the markers of
+       'native_ids' as '<native id>:end <timestamp> <exit code>', and
+       removes the markers of 'remove_ids' (and, if 'max_age' is set,
+       all markers older than 'max_age' days). 'quote' quotes a native
+       id for the shell.
+    '''
+    commands = [":"]
+    if max_age is not None:
+        commands.append("find . -type f -mtime +%d -exec rm -f {} \\;" % max_age)
+    if len(remove_ids) > 0:
+        commands.append("rm -f -- %s" % " ".join([quote(i) for i in remove_ids]))
+    if len(native_ids) > 0:
+        commands.append("grep -H '^end ' -- %s 2>/dev/null" \
+          % " ".join([quote(i) for i in native_ids]))
+    # (in a subshell, since the command may run in a persistent shell)
+    return "(cd \"$HOME/%s\" 2>/dev/null && { %s; }) || true" \
+      % (status_dir, "; ".join(commands))
+
+def parse_collected(output):
+    '''Returns a dictionary {native id: (end timestamp, exit code)}'''
+    collected = dict()
+    for match in _END.finditer(output):
+        collected[match.group(1)] = (int(match.group(2)), int(match.group(3)))
+    return collected
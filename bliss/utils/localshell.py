@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import time
+import signal
+import select
+import threading
+import subprocess
+
+import framing
+
+################################################################################
+################################################################################
+
+class LocalShellException(Exception):
+    '''Raised for LocalShellConnection exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class LocalShellConnection(object):
+    '''A long-lived local '/bin/sh' coprocess that runs commands via the
+       framed protocol, so that a command costs a pipe round trip instead
+       of a fork+exec of the (possibly large) Python process plus a shell
+       startup.
+
+       The public interface is the same as the one of SSHConnection. Only
+       one command runs at a time; use a CommandWrapperPool for more.
+    '''
+
+    # seconds to wait for a command to finish
+    command_timeout = 300
+
+    # number of bytes read at once by execute_stream()
+    read_size = 65536
+
+    # seconds that logout() gives the shell to exit before it's killed
+    stop_grace = 1.0
+
+    ######################################################################
+    ##
+    def __init__(self, shell='/bin/sh'):
+        '''Constructor'''
+        self._shell = shell
+        self._proc = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    ######################################################################
+    ##
+    def login(self, hostname=None, port=None, username=None, password=None):
+        '''Starts the shell. The arguments are ignored.'''
+        self._lock.acquire()
+        try:
+            self._start()
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def logout(self):
+        '''Terminates the shell.'''
+        self._lock.acquire()
+        try:
+            self._stop()
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def execute(self, commandline):
+        '''Executes a command. Returns a dictionary with the keys
+           'exitcode', 'output' and 'stderr'.
+        '''
+        return self.execute_many([commandline])[0]
+
+    ######################################################################
+    ##
+    def execute_many(self, commandlines):
+        '''Executes a list of commands in one exchange. Returns a list of
+           dictionaries like execute().
+        '''
+        self._lock.acquire()
+        try:
+            self._prepare()
+            tags = [framing.new_tag() for c in commandlines]
+            script = "".join([framing.frame_command(c, t) + '\n' \
+                              for (c, t) in zip(commandlines, tags)])
+            try:
+                data = self._exchange(script, framing.END + '-' + tags[-1] + ':')
+                frames = framing.parse_frames(data, tags)
+            except (LocalShellException, framing.FramingException), e:
+                self._stop(kill=True)
+                raise LocalShellException("Couldn't run %s: %s" \
+                  % (commandlines, str(e)))
+        finally:
+            self._lock.release()
+        return [{'exitcode': rc, 'output': stdout, 'stderr': stderr} \
+                for (stdout, stderr, rc) in frames]
+
+    ######################################################################
+    ##
+    def execute_stream(self, commandline):
+        '''Executes a command and returns a framing.FrameReader for its
+           output. The next command drains whatever hasn't been read.
+        '''
+        self._lock.acquire()
+        try:
+            self._prepare()
+            tag = framing.new_tag()
+            try:
+                os.write(self._proc.stdin.fileno(),
+                         framing.frame_command(commandline, tag) + '\n')
+            except OSError, e:
+                self._stop(kill=True)
+                raise LocalShellException("Couldn't run '%s': %s" \
+                  % (commandline, str(e)))
+            self._reader = framing.FrameReader(self._read, tag)
+            return self._reader
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def _prepare(self):
+        '''Gets the shell ready for the next command'''
+        if self._reader is not None:
+            reader = self._reader
+            self._reader = None
+            try:
+                reader.drain()
+            except (LocalShellException, framing.FramingException):
+                self._stop(kill=True)
+        # a shell that died between two commands (e.g., because a
+        # command called 'exit') is restarted transparently.
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+
+    def _read(self):
+        '''Returns the next chunk of output'''
+        if self._proc is None:
+            raise LocalShellException("Shell terminated")
+        fd = self._proc.stdout.fileno()
+        (r, w, x) = select.select([fd], [], [], self.command_timeout)
+        if not r:
+            raise LocalShellException("Timeout after %ss" % self.command_timeout)
+        data = os.read(fd, self.read_size)
+        if not data:
+            raise LocalShellException("Shell terminated")
+        return data
+
+    def _start(self):
+        '''Starts the shell and waits for it to become ready'''
+        self._stop(kill=True)
+        devnull = open(os.devnull, 'w')
+        try:
+            # (in a process group of its own, so that a hung command
+            # can be killed along with the shell)
+            self._proc = subprocess.Popen([self._shell], stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE,
+                                          stderr=devnull, close_fds=True,
+                                          preexec_fn=os.setpgrp)
+        except OSError, e:
+            raise LocalShellException("Couldn't start %s: %s" \
+              % (self._shell, str(e)))
+        finally:
+            devnull.close()
+        tag = framing.new_tag()
+        try:
+            self._exchange(framing.setup_command(tag) + '\n',
+                           framing.ready_marker(tag) + '\n')
+        except LocalShellException:
+            self._stop(kill=True)
+            raise
+
+    def _stop(self, kill=False):
+        '''Terminates the shell, if any. An idle shell exits once its
+           stdin is closed; one that is still busy (e.g., with a command
+           that timed out) is killed, together with its commands --
+           right away if 'kill' is True, else after 'stop_grace' seconds.
+        '''
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+            self._proc.stdout.close()
+        except (IOError, OSError):
+            pass
+        if not kill:
+            deadline = time.time() + self.stop_grace
+            while self._proc.poll() is None and time.time() < deadline:
+                time.sleep(0.01)
+        if self._proc.poll() is None:
+            try:
+                os.killpg(self._proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+        try:
+            self._proc.wait()
+        except OSError:
+            pass
+        self._proc = None
+
+    def _exchange(self, data, marker):
+        '''Writes 'data' to the shell and reads its output until (and
+           including) the line that contains 'marker'. Reading and writing
+           are interleaved, so large scripts can't fill up the pipes.
+        '''
+        stdin = self._proc.stdin.fileno()
+        stdout = self._proc.stdout.fileno()
+        deadline = time.time() + self.command_timeout
+        output = list()
+        tail = ''
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LocalShellException("Timeout after %ss" % self.command_timeout)
+            if data:
+                (r, w, x) = select.select([stdout], [stdin], [], remaining)
+            else:
+                (r, w, x) = select.select([stdout], [], [], remaining)
+            if w:
+                try:
+                    n = os.write(stdin, data[:4096])
+                    data = data[n:]
+                except OSError, e:
+                    raise LocalShellException("Shell terminated: %s" % str(e))
+            if r:
+                chunk = os.read(stdout, 65536)
+                if not chunk:
+                    raise LocalShellException("Shell terminated")
+                output.append(chunk)
+                # only the (short) tail can contain the marker
+                tail = tail[-(len(marker)+16):] + chunk
+                i = tail.find(marker)
+                if i != -1 and tail.find('\n', i) != -1:
+                    return "".join(output)
+
+################################################################################
+################################################################################
+
+class ProcessReader(object):
+    '''Streams the stdout of a subprocess. Stderr goes to a temporary file
+       so that it can't block the process while we read stdout. Provides
+       the same interface as framing.FrameReader.
+    '''
+
+    def __init__(self, proc, errfile, read_size=65536):
+        self._proc = proc
+        self._errfile = errfile
+        self._read_size = read_size
+        self._done = False
+        self.stderr = None
+        self.exitcode = None
+
+    def done(self):
+        return self._done
+
+    def chunks(self):
+        '''Yields stdout in chunks'''
+        if self._done:
+            return
+        fd = self._proc.stdout.fileno()
+        while True:
+            data = os.read(fd, self._read_size)
+            if not data:
+                break
+            yield data
+        self._proc.stdout.close()
+        self.exitcode = self._proc.wait()
+        self._errfile.seek(0)
+        self.stderr = self._errfile.read()
+        self._errfile.close()
+        self._done = True
+
+    def drain(self):
+        for chunk in self.chunks():
+            pass
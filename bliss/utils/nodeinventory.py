@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import array
+import itertools
+
+# NumPy is optional. Without it, the columns are plain 'array' arrays,
+# and the filters run as (slower) loops over them.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+################################################################################
+################################################################################
+
+# node states, as reported by pbsnodes. a node can be in several states
+# at once (e.g., 'down,offline'), so they are stored as bit flags.
+NODE_STATES = ['free', 'job-exclusive', 'job-sharing', 'busy', 'reserve',
+               'down', 'offline', 'unknown']
+
+def state_flags(states):
+    '''Returns the bit flags for a state name or a list of state names.
+       Names that aren't in NODE_STATES count as 'unknown'.
+    '''
+    if isinstance(states, basestring):
+        states = states.split(',')
+    flags = 0
+    for state in states:
+        state = state.strip()
+        if state in NODE_STATES:
+            flags |= 1 << NODE_STATES.index(state)
+        elif state:
+            flags |= 1 << NODE_STATES.index('unknown')
+    return flags
+
+def memory_to_kb(value):
+    '''Converts a PBS memory size ('64gb', '1024mb', '67108864kb', ...)
+       into kilobytes. Returns 0.0 if 'value' can't be parsed.
+    '''
+    units = {'b': 1.0/1024, 'kb': 1.0, 'mb': 1024.0, 'gb': 1024.0**2,
+             'tb': 1024.0**3, 'w': 8.0/1024, 'kw': 8.0, 'mw': 8.0*1024,
+             'gw': 8.0*1024**2}
+    value = value.strip().lower()
+    digits = value.rstrip('abcdefghijklmnopqrstuvwxyz')
+    try:
+        return float(digits) * units.get(value[len(digits):] or 'b', 0.0)
+    except ValueError:
+        return 0.0
+
+################################################################################
+################################################################################
+
+class NodeInventoryBuilder(object):
+    '''Collects nodes one by one and turns them into a NodeInventory.
+    '''
+
+    def __init__(self):
+        '''Constructor'''
+        self._names = list()
+        self._np = array.array('l')
+        self._used = array.array('l')
+        self._state = array.array('l')
+        self._physmem = array.array('d')
+        self._load = array.array('d')
+        self._properties = dict()   # property -> list of node indices
+
+    def append(self, name, np=0, used=0, state='unknown', physmem=0.0,
+               load=0.0, properties=[]):
+        '''Adds a node. 'state' is a (comma-separated) state name or a
+           list of state names, 'physmem' is in kilobytes.
+        '''
+        index = len(self._names)
+        self._names.append(name)
+        self._np.append(int(np))
+        self._used.append(int(used))
+        self._state.append(state_flags(state))
+        self._physmem.append(float(physmem))
+        self._load.append(float(load))
+        for prop in properties:
+            if prop not in self._properties:
+                self._properties[prop] = list()
+            self._properties[prop].append(index)
+
+    def build(self):
+        '''Returns the NodeInventory'''
+        size = len(self._names)
+        properties = dict()
+        for (prop, indices) in self._properties.iteritems():
+            column = array.array('B', [0]) * size
+            for index in indices:
+                column[index] = 1
+            properties[prop] = column
+        return NodeInventory(self._names, self._np, self._used, self._state,
+                             self._physmem, self._load, properties)
+
+################################################################################
+################################################################################
+
+class NodeInventory(object):
+    '''The nodes of a cluster, stored column by column: the host names,
+       and one array each for the number of processors ('np'), the number
+       of processors in use ('used'), the state flags, the physical memory
+       (in kilobytes) and the load, plus one boolean column per property.
+
+       select() combines filters into a mask, which the aggregates
+       (count(), cores(), free_cores(), names(), nodes_per_property())
+       take as an argument. E.g., the free cores on nodes with at least
+       64GB of memory are:
+
+         inv.free_cores(inv.select(state='free', min_physmem=64*1024**2))
+    '''
+
+    def __init__(self, names, np, used, state, physmem, load, properties):
+        '''Constructor. The columns are sequences of equal length.'''
+        self.hostname = list(names)
+        if numpy is not None:
+            self.np = numpy.array(np, dtype=numpy.int64)
+            self.used = numpy.array(used, dtype=numpy.int64)
+            self.state = numpy.array(state, dtype=numpy.int64)
+            self.physmem = numpy.array(physmem, dtype=numpy.float64)
+            self.load = numpy.array(load, dtype=numpy.float64)
+            self.properties = dict([(prop, numpy.array(column, dtype=bool)) \
+                                    for (prop, column) in properties.iteritems()])
+        else:
+            self.np = array.array('l', np)
+            self.used = array.array('l', used)
+            self.state = array.array('l', state)
+            self.physmem = array.array('d', physmem)
+            self.load = array.array('d', load)
+            self.properties = dict([(prop, array.array('B', column)) \
+                                    for (prop, column) in properties.iteritems()])
+
+    def __len__(self):
+        return len(self.hostname)
+
+    ######################################################################
+    ##
+    def select(self, state=None, exclude_state=None, min_np=None,
+               min_free=None, min_physmem=None, max_load=None,
+               properties=[]):
+        '''Returns a mask of the nodes that are in one of the states in
+           'state', in none of the states in 'exclude_state', have at
+           least 'min_np' processors, 'min_free' unused processors and
+           'min_physmem' kilobytes of memory, a load of at most
+           'max_load', and all of the given 'properties'.
+        '''
+        mask = self._all()
+        if state is not None:
+            flags = state_flags(state)
+            mask = self._filter(mask, self.state, lambda s: (s & flags) != 0)
+        if exclude_state is not None:
+            flags = state_flags(exclude_state)
+            mask = self._filter(mask, self.state, lambda s: (s & flags) == 0)
+        if min_np is not None:
+            mask = self._filter(mask, self.np, lambda n: n >= min_np)
+        if min_free is not None:
+            mask = self._filter(mask, self._free(), lambda f: f >= min_free)
+        if min_physmem is not None:
+            mask = self._filter(mask, self.physmem, lambda m: m >= min_physmem)
+        if max_load is not None:
+            mask = self._filter(mask, self.load, lambda l: l <= max_load)
+        for prop in properties:
+            column = self.properties.get(prop)
+            if column is None:
+                return self._none()
+            mask = self._filter(mask, column, lambda p: p != 0)
+        return mask
+
+    def count(self, mask=None):
+        '''Returns the number of (selected) nodes'''
+        if mask is None:
+            return len(self)
+        if numpy is not None:
+            return int(numpy.count_nonzero(mask))
+        return sum(mask)
+
+    def cores(self, mask=None):
+        '''Returns the number of processors on the (selected) nodes'''
+        return self._sum(self.np, mask)
+
+    def free_cores(self, mask=None):
+        '''Returns the number of unused processors on the (selected)
+           nodes that are neither down nor offline
+        '''
+        mask = self._filter(mask if mask is not None else self._all(),
+          self.state, lambda s: (s & state_flags('down,offline')) == 0)
+        return self._sum(self._free(), mask)
+
+    def names(self, mask=None):
+        '''Returns the names of the (selected) nodes'''
+        return self.values(self.hostname, mask)
+
+    def values(self, column, mask=None):
+        '''Returns the values of a column for the (selected) nodes, as a
+           list
+        '''
+        if numpy is not None and isinstance(column, numpy.ndarray):
+            if mask is None:
+                return column.tolist()
+            return column[mask].tolist()
+        if mask is None:
+            return list(column)
+        return [v for (v, m) in itertools.izip(column, mask) if m]
+
+    def nodes_per_property(self, mask=None):
+        '''Returns a dictionary {property: number of (selected) nodes}'''
+        result = dict()
+        for (prop, column) in self.properties.iteritems():
+            if mask is not None:
+                column = self._filter(mask, column, lambda p: p != 0)
+            result[prop] = self.count(column)
+        return result
+
+    ######################################################################
+    ##
+    def _all(self):
+        if numpy is not None:
+            return numpy.ones(len(self), dtype=bool)
+        return array.array('B', [1]) * len(self)
+
+    def _none(self):
+        if numpy is not None:
+            return numpy.zeros(len(self), dtype=bool)
+        return array.array('B', [0]) * len(self)
+
+    def _free(self):
+        '''Returns the column of unused processors'''
+        if numpy is not None:
+            return numpy.maximum(self.np - self.used, 0)
+        return array.array('l', [max(n - u, 0) for (n, u) \
+                                 in itertools.izip(self.np, self.used)])
+
+    def _filter(self, mask, column, test):
+        '''ANDs 'mask' with test(column). With NumPy, 'test' is applied
+           to the whole column at once.
+        '''
+        if numpy is not None:
+            return mask & test(column)
+        return array.array('B', [m and test(v) for (m, v) \
+                                 in itertools.izip(mask, column)])
+
+    def _sum(self, column, mask):
+        if numpy is not None:
+            if mask is None:
+                return int(column.sum())
+            return int(column[mask].sum())
+        if mask is None:
+            return sum(column)
+        return sum([v for (v, m) in itertools.izip(column, mask) if m])
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+import urlparse
+import threading
+
+################################################################################
+################################################################################
+
+def get_query_ttl(url, default=2.0):
+    '''Returns the query cache TTL (in seconds) requested for 'url' via
+       a '?query_ttl=...' URL query parameter, or 'default'. A TTL of 0
+       disables caching, but concurrent queries are still coalesced.
+    '''
+    if url.query is not None:
+        values = urlparse.parse_qs(url.query).get('query_ttl')
+        if values:
+            try:
+                return max(0.0, float(values[-1]))
+            except ValueError:
+                raise QueryCacheException("Invalid query_ttl '%s'" % values[-1])
+    return default
+
+def succeeded(result):
+    '''Returns False if 'result' -- or, for a list of results, any of
+       them -- has got a non-zero 'returncode'.
+    '''
+    if isinstance(result, (list, tuple)):
+        return len([r for r in result if not succeeded(r)]) == 0
+    return getattr(result, 'returncode', 0) == 0
+
+################################################################################
+################################################################################
+
+class QueryCacheException(Exception):
+    '''Raised for QueryCache exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class _Flight(object):
+    '''A query that is currently being executed.'''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+################################################################################
+################################################################################
+
+class QueryCache(object):
+    '''Coalesces and caches the results of read-only queries.
+
+       If several threads ask for the same key at the same time, only the
+       first one executes the query, and all others wait for (and share)
+       its result ('single-flight'). Results are cached for 'ttl' seconds.
+       Failed queries, and results for which 'is_cacheable(result)' is
+       False (by default: commands that exited with a non-zero code),
+       aren't cached. Use invalidate() after operations that change what
+       the queries would return.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, ttl=2.0, is_cacheable=succeeded):
+        '''Constructor'''
+        self.ttl = ttl
+        self._is_cacheable = is_cacheable
+        self._lock = threading.Lock()
+        self._results = dict()   # key -> (timestamp, result)
+        self._flights = dict()   # key -> _Flight
+        self._generation = 0
+        self._max_ttl = ttl      # the longest ttl asked for so far
+        self._next_prune = 0
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    ######################################################################
+    ##
+    def get(self, key, query, ttl=None):
+        '''Returns the result of query() for 'key' -- from the cache if
+           it's younger than 'ttl' (default: the cache's ttl) seconds.
+        '''
+        if ttl is None:
+            ttl = self.ttl
+
+        self._lock.acquire()
+        try:
+            self._max_ttl = max(self._max_ttl, ttl)
+            cached = self._results.get(key)
+            if cached is not None and cached[0] + ttl > time.time():
+                self._stats['hits'] += 1
+                return cached[1]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats['coalesced'] += 1
+                owner = False
+            else:
+                self._stats['misses'] += 1
+                flight = _Flight()
+                self._flights[key] = flight
+                generation = self._generation
+                owner = True
+        finally:
+            self._lock.release()
+
+        if not owner:
+            flight.event.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            return flight.result
+
+        completed = False
+        try:
+            try:
+                flight.result = query()
+            except Exception:
+                flight.exc_info = sys.exc_info()
+            completed = True
+        finally:
+            # (even if query() raised KeyboardInterrupt or SystemExit --
+            # the other callers would wait for this flight forever)
+            if not completed:
+                try:
+                    raise QueryCacheException("Query %s was interrupted" % (key,))
+                except QueryCacheException:
+                    flight.exc_info = sys.exc_info()
+            self._lock.acquire()
+            try:
+                del self._flights[key]
+                # don't cache results that might predate an invalidate()
+                if flight.exc_info is None and generation == self._generation \
+                  and self._is_cacheable(flight.result):
+                    self._insert(key, flight.result)
+            finally:
+                self._lock.release()
+            flight.event.set()
+
+        if flight.exc_info is not None:
+            raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+        return flight.result
+
+    ######################################################################
+    ##
+    def put(self, key, result):
+        '''Caches a result that was obtained some other way'''
+        self._lock.acquire()
+        try:
+            self._insert(key, result)
+        finally:
+            self._lock.release()
+
+    def _insert(self, key, result):
+        '''Caches a result and, at most once per ttl, drops the results
+           that have expired. Requires the lock.
+        '''
+        now = time.time()
+        if now >= self._next_prune:
+            for (k, (timestamp, r)) in self._results.items():
+                if timestamp + self._max_ttl <= now:
+                    del self._results[k]
+            self._next_prune = now + self._max_ttl
+        self._results[key] = (now, result)
+
+    ######################################################################
+    ##
+    def invalidate(self, key=None):
+        '''Drops the cached result for 'key' or, if None, all results'''
+        self._lock.acquire()
+        try:
+            if key is None:
+                self._results.clear()
+                self._generation += 1
+            else:
+                self._results.pop(key, None)
+        finally:
+            self._lock.release()
+
+    ######################################################################
+    ##
+    def stats(self):
+        '''Returns the hit, miss and coalesced counters'''
+        self._lock.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._results)
+            return stats
+        finally:
+            self._lock.release()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''A minimal select()-based event loop.
+
+   A Reactor multiplexes non-blocking file descriptors in a single thread
+   and resolves Future objects once the operations they stand for are
+   complete. It can either be driven by the threads that wait for a
+   result (Future.result() runs the loop until the future is done), or
+   run in a background thread via start(). Only one thread runs the loop
+   at a time; the others wait until it has resolved their futures or
+   until it's their turn.
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import sys
+import time
+import fcntl
+import errno
+import select
+import threading
+
+################################################################################
+################################################################################
+
+class ReactorException(Exception):
+    '''Raised for Reactor and Future exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+def set_nonblocking(fd):
+    '''Puts a file descriptor into non-blocking mode'''
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+################################################################################
+################################################################################
+
+class Future(object):
+    '''The (eventual) result of an asynchronous operation.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, reactor):
+        '''Constructor'''
+        self._reactor = reactor
+        self._event = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = list()
+
+    ######################################################################
+    ##
+    def done(self):
+        '''Returns True if the result (or an error) is available'''
+        return self._event.isSet()
+
+    ######################################################################
+    ##
+    def result(self, timeout=None):
+        '''Returns the result. Blocks for up to 'timeout' seconds (forever
+           if None) and re-raises the exception if the operation failed.
+        '''
+        if not self.done():
+            if self._reactor.is_running_elsewhere():
+                self._event.wait(timeout)
+            else:
+                self._reactor.run_until_complete([self], timeout)
+        if not self.done():
+            raise ReactorException("Timeout while waiting for result")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    ######################################################################
+    ##
+    def exception(self):
+        '''Returns the exception of a failed operation, or None'''
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    ######################################################################
+    ##
+    def add_done_callback(self, callback):
+        '''Calls callback(future) (in the reactor thread) once the future
+           is done. If it's done already, the callback is called right away.
+        '''
+        if self.done():
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    ######################################################################
+    ##
+    def set_result(self, result):
+        '''Resolves the future. Called by the reactor.'''
+        self._result = result
+        self._finish()
+
+    ######################################################################
+    ##
+    def set_exception(self, exception):
+        '''Fails the future. Called by the reactor.'''
+        try:
+            raise exception
+        except Exception:
+            self._exc_info = sys.exc_info()
+        self._finish()
+
+    def _finish(self):
+        self._event.set()
+        callbacks = self._callbacks
+        self._callbacks = list()
+        for callback in callbacks:
+            callback(self)
+
+################################################################################
+################################################################################
+
+class Reactor(object):
+    '''A single-threaded event loop for non-blocking file descriptors.
+
+       Readers and writers are registered per file descriptor and called
+       whenever select() reports it as ready. call_soon(), start() and
+       run_until_complete() are the only methods that may be called from
+       other threads while the loop is running.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self):
+        '''Constructor'''
+        self._readers = dict()
+        self._writers = dict()
+        self._calls = list()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+        # the thread that currently runs the loop, if any
+        self._driver = None
+        self._driver_cond = threading.Condition()
+
+        # self-pipe to wake up select() from other threads
+        (self._wake_r, self._wake_w) = os.pipe()
+        set_nonblocking(self._wake_r)
+        set_nonblocking(self._wake_w)
+
+    ######################################################################
+    ##
+    def add_reader(self, fd, callback):
+        '''Calls callback() whenever 'fd' is readable'''
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def add_writer(self, fd, callback):
+        '''Calls callback() whenever 'fd' is writable'''
+        self._writers[fd] = callback
+
+    def remove_writer(self, fd):
+        self._writers.pop(fd, None)
+
+    ######################################################################
+    ##
+    def call_soon(self, callback, *args):
+        '''Schedules callback(*args) to be run by the reactor thread'''
+        self._lock.acquire()
+        try:
+            self._calls.append((callback, args))
+        finally:
+            self._lock.release()
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            pass # pipe full -- the reactor wakes up anyway
+
+    ######################################################################
+    ##
+    def is_running_elsewhere(self):
+        '''Returns True if the reactor runs in a different thread'''
+        return self._thread is not None and self._thread.isAlive() and \
+               self._thread is not threading.currentThread()
+
+    ######################################################################
+    ##
+    def run_once(self, timeout=None):
+        '''Waits for up to 'timeout' seconds for I/O and dispatches it'''
+        self._lock.acquire()
+        try:
+            calls = self._calls
+            self._calls = list()
+        finally:
+            self._lock.release()
+        for (callback, args) in calls:
+            callback(*args)
+        if calls:
+            timeout = 0
+
+        readers = self._readers.keys() + [self._wake_r]
+        writers = self._writers.keys()
+        try:
+            (r, w, x) = select.select(readers, writers, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd in w:
+            callback = self._writers.get(fd)
+            if callback is not None:
+                callback()
+        for fd in r:
+            if fd == self._wake_r:
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            callback = self._readers.get(fd)
+            if callback is not None:
+                callback()
+
+    ######################################################################
+    ##
+    def run_until_complete(self, futures, timeout=None):
+        '''Runs the loop until all 'futures' are done or 'timeout' seconds
+           have passed. Returns True if all futures are done.
+        '''
+        if self.is_running_elsewhere():
+            raise ReactorException("Reactor is running in another thread")
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        done = lambda: len([f for f in futures if not f.done()]) == 0
+        if self._driver is threading.currentThread():
+            # called from a callback -- we're running the loop already
+            return self._run_until(done, deadline)
+        if not self._acquire_loop(done, deadline):
+            return done()
+        try:
+            return self._run_until(done, deadline)
+        finally:
+            self._release_loop()
+
+    def _run_until(self, done, deadline):
+        while True:
+            if done():
+                return True
+            if deadline is None:
+                self.run_once(None)
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.run_once(remaining)
+            # wake up the threads that wait for their futures
+            self._driver_cond.acquire()
+            try:
+                self._driver_cond.notifyAll()
+            finally:
+                self._driver_cond.release()
+
+    def _acquire_loop(self, done=None, deadline=None):
+        '''Waits until no other thread runs the loop and makes the current
+           thread its driver. Returns False (without that) if done()
+           becomes True or the deadline passes in the meantime.
+        '''
+        self._driver_cond.acquire()
+        try:
+            while self._driver is not None:
+                if done is not None and done():
+                    return False
+                if deadline is None:
+                    self._driver_cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._driver_cond.wait(remaining)
+            self._driver = threading.currentThread()
+            return True
+        finally:
+            self._driver_cond.release()
+
+    def _release_loop(self):
+        self._driver_cond.acquire()
+        try:
+            self._driver = None
+            self._driver_cond.notifyAll()
+        finally:
+            self._driver_cond.release()
+
+    ######################################################################
+    ##
+    def start(self):
+        '''Runs the loop in a background (daemon) thread'''
+        if self._thread is not None and self._thread.isAlive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run_forever, name="Reactor")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stops the background thread'''
+        self._stopped = True
+        self.call_soon(lambda: None)
+        if self.is_running_elsewhere():
+            self._thread.join()
+        self._thread = None
+
+    def _run_forever(self):
+        # wake up the driving thread, if any, so that it hands over
+        self.call_soon(lambda: None)
+        self._acquire_loop()
+        try:
+            while not self._stopped:
+                self.run_once(None)
+        finally:
+            self._release_loop()
+
+################################################################################
+################################################################################
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+def get_reactor():
+    '''Returns the process-wide default Reactor.'''
+    global _reactor
+    _reactor_lock.acquire()
+    try:
+        if _reactor is None:
+            _reactor = Reactor()
+        return _reactor
+    finally:
+        _reactor_lock.release()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+import urlparse
+import threading
+
+################################################################################
+################################################################################
+
+def get_service_info_ttl(url, default=15.0):
+    '''Returns the number of seconds for which service infos are
+       considered fresh, as requested for 'url' via a
+       '?service_info_ttl=...' URL query parameter, or 'default'.
+    '''
+    if url.query is not None:
+        values = urlparse.parse_qs(url.query).get('service_info_ttl')
+        if values:
+            try:
+                ttl = float(values[-1])
+            except ValueError:
+                ttl = -1.0
+            if ttl < 0.0:
+                raise RefresherException("Invalid service_info_ttl '%s'" % values[-1])
+            return ttl
+    return default
+
+################################################################################
+################################################################################
+
+class RefresherException(Exception):
+    '''Raised for Refresher exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class Refresher(object):
+    '''Holds a value that is expensive to fetch, and serves it
+       'stale-while-revalidate'.
+
+       The value is fetched lazily: the first get() calls fetch() and
+       waits for it (concurrent first callers share that one call). Once
+       the value is older than 'ttl' seconds, get() starts a background
+       thread that fetches a new one, and keeps returning the old value
+       until the new one is there. At most one refresh runs at a time. If
+       a background refresh fails, the old value is kept, 'on_error(ex)'
+       is called, and the next get() tries again.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, fetch, ttl=15.0, on_error=None, name="Refresher"):
+        '''Constructor'''
+        self.ttl = ttl
+        self._fetch = fetch
+        self._on_error = on_error
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._value = None
+        self._updated = None      # when _value was fetched; None: never
+        self._refreshing = False
+        self._exc_info = None     # why the last synchronous fetch failed
+        self._stats = {'hits': 0, 'stale': 0, 'fetches': 0, 'errors': 0}
+
+    ######################################################################
+    ##
+    def get(self):
+        '''Returns the value. Blocks only if there is none yet.'''
+        self._cond.acquire()
+        try:
+            while self._updated is None:
+                if not self._refreshing:
+                    # first fetch: done by this thread, outside the lock
+                    self._refreshing = True
+                    break
+                self._cond.wait()
+                if self._exc_info is not None and self._updated is None:
+                    exc_info = self._exc_info
+                    raise exc_info[0], exc_info[1], exc_info[2]
+            else:
+                if time.time() - self._updated < self.ttl:
+                    self._stats['hits'] += 1
+                elif self._refreshing:
+                    self._stats['stale'] += 1
+                else:
+                    self._stats['stale'] += 1
+                    self._refreshing = True
+                    thread = threading.Thread(target=self._refresh,
+                                              name=self._name)
+                    thread.setDaemon(True)
+                    thread.start()
+                return self._value
+        finally:
+            self._cond.release()
+
+        # only the first caller gets here
+        try:
+            self._update(self._fetch())
+        except Exception:
+            self._cond.acquire()
+            try:
+                self._stats['errors'] += 1
+                self._exc_info = sys.exc_info()
+                self._refreshing = False
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+            raise
+        return self.peek()
+
+    def peek(self):
+        '''Returns the value (or None), without fetching it.'''
+        self._cond.acquire()
+        try:
+            return self._value
+        finally:
+            self._cond.release()
+
+    def invalidate(self):
+        '''Makes the next get() refresh the value.'''
+        self._cond.acquire()
+        try:
+            if self._updated is not None:
+                self._updated = 0.0
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        '''Returns the number of fresh and stale reads, fetches and
+           failed fetches, and the age of the value in seconds
+        '''
+        self._cond.acquire()
+        try:
+            stats = dict(self._stats)
+            if self._updated is None:
+                stats['age'] = None
+            else:
+                stats['age'] = time.time() - self._updated
+            return stats
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def _update(self, value):
+        self._cond.acquire()
+        try:
+            self._value = value
+            self._updated = time.time()
+            self._exc_info = None
+            self._refreshing = False
+            self._stats['fetches'] += 1
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _refresh(self):
+        '''Runs in a background thread'''
+        try:
+            self._update(self._fetch())
+        except Exception, ex:
+            self._cond.acquire()
+            try:
+                self._stats['errors'] += 1
+                self._refreshing = False
+            finally:
+                self._cond.release()
+            if self._on_error is not None:
+                self._on_error(ex)
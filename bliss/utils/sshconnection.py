@@ -6,6 +6,7 @@ __copyright__ = "Copyright 2012, Ole Christian Weidner"
 __license__   = "MIT"
 
 import os
+import re
 from pexpect import *
 import  pxssh 
 from pxssh import ExceptionPxssh
@@ -13,6 +14,8 @@ import time
 import pexpect
 import getpass
 
+import framing
+
 import socket
 socket.setdefaulttimeout(20) #default timeout for connect()
 
@@ -166,7 +169,7 @@ class _pxssh (spawn):
 
     ### TODO: This is getting messy and I'm pretty sure this isn't perfect.
     ### TODO: I need to draw a flow chart for this.
-    def login (self,server,username,password='',terminal_type='ansi',original_prompt=r"[#$]",login_timeout=10,port=None,auto_prompt_reset=True):
+    def login (self,server,username,password='',terminal_type='ansi',original_prompt=r"[#$]",login_timeout=10,port=None,auto_prompt_reset=True,fast_login=True):
 
         """This logs the user into the given server. It uses the
         'original_prompt' to try to find the prompt right after login. When it
@@ -189,7 +192,22 @@ class _pxssh (spawn):
         inhibit setting the prompt to the UNIQUE_PROMPT. Remember that pxssh
         uses a unique prompt in the prompt() method. If the original prompt is
         not reset then this will disable the prompt() method unless you
-        manually set the PROMPT attribute. """
+        manually set the PROMPT attribute. 
+        
+        With 'fast_login' (the default), the remote side doesn't start a
+        plain /bin/bash but a command that prints a unique login marker 
+        and then execs a bash without line editing. The marker replaces 
+        'original_prompt', so readiness is detected as soon as it shows 
+        up, without the sleeps and heuristics of sync_original_prompt(). 
+        If the marker doesn't show up within 'login_timeout', login()
+        falls back to sync_original_prompt(). """
+
+        if fast_login:
+            login_marker = "BLISS-LOGIN-%s" % framing.new_tag()
+            remote_cmd = '"echo %s; exec /bin/bash --noediting -i"' % login_marker
+            original_prompt = re.escape(login_marker)
+        else:
+            remote_cmd = "/bin/bash"
 
         if self.use_gsissh:
 
@@ -198,7 +216,7 @@ class _pxssh (spawn):
                 ssh_options = ssh_options + ' ' + self.SSH_OPTS
             if port is not None:
                 ssh_options = ssh_options + ' -p %s'%(str(port))
-            cmd = "gsissh %s -t -l %s %s /bin/bash" % (ssh_options, username, server)
+            cmd = "gsissh %s -t -l %s %s %s" % (ssh_options, username, server, remote_cmd)
 
         else:
 
@@ -207,7 +225,7 @@ class _pxssh (spawn):
                 ssh_options = ssh_options + ' ' + self.SSH_OPTS
             if port is not None:
                 ssh_options = ssh_options + ' -p %s'%(str(port))
-            cmd = "ssh %s -t -l %s %s /bin/bash" % (ssh_options, username, server)
+            cmd = "ssh %s -t -l %s %s %s" % (ssh_options, username, server, remote_cmd)
 
 
         # This does not distinguish between a remote server 'password' prompt
@@ -270,7 +288,11 @@ class _pxssh (spawn):
         else: # Unexpected 
             self.close()
             raise ExceptionPxssh ('unexpected login response')
-        if not self.sync_original_prompt():
+        if fast_login and i == 1:
+            # we've seen the login marker. the shell that follows 
+            # will read whatever we send from now on.
+            pass
+        elif not self.sync_original_prompt():
             self.close()
             raise ExceptionPxssh ('could not synchronize with original prompt')
         # We appear to be in.
@@ -339,11 +361,32 @@ class SSHConnection(object):
     '''This class provides a persistent SSH connection
        based on either the SSH or GSISSH command line 
        tools. It requires the 'pexpect' module.
+
+       By default, commands are executed using the framed protocol 
+       (see bliss.utils.framing), i.e., stdout, stderr and the exit 
+       code are read back in a single round trip. With framed=False, 
+       the old prompt-scraping mode is used which needs a second 
+       round trip ('echo $?') to get the exit code.
+
+       With fast_login=False, the login falls back to the slow, 
+       heuristic prompt detection of the original pxssh.
     '''
 
-    def __init__(self, gsissh=False):
+    # seconds to wait for a framed command to finish
+    command_timeout = 300
+
+    # maximum number of bytes written at once by execute_many()
+    batch_size = 2048
+
+    # maximum number of bytes read at once
+    read_size = 65536
+
+    def __init__(self, gsissh=False, framed=True, fast_login=True):
         self._use_gsissh=gsissh
-        self._ssh = _pxssh(gsissh=gsissh)
+        self._ssh = _pxssh(gsissh=gsissh, maxread=self.read_size)
+        self._framed = framed
+        self._fast_login = fast_login
+        self._reader = None
 
         self._is_connected = False
 
@@ -378,7 +421,7 @@ class SSHConnection(object):
         # see if it is valid, the port is open, etc...
         try:
             s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((hostname, int(port)))
+            s.connect((hostname, int(self._port)))
             s.shutdown(2)
         except Exception, ex:
             raise SSHConnectionException("Couldn't connect to %s:%s: %s" 
@@ -386,15 +429,21 @@ class SSHConnection(object):
 
         # ip:port seem to exist. now we can try ssh
         try:
+            # in framed mode, the prompt is switched off anyway 
             self._ssh.login(server=self._hostname, 
                             port=self._port,
-			    username=self._username, 
-                            password=self._password)
+                            username=self._username, 
+                            password=self._password,
+                            auto_prompt_reset=not self._framed,
+                            fast_login=self._fast_login)
             self._is_connected = True
         except pxssh.ExceptionPxssh, ex:
             raise SSHConnectionException("Couldn't login to %s:%s: %s" 
                   % (self._hostname, self._port, ex))
 
+        if self._framed:
+            self._init_framing()
+
     def logout(self):
         ''' Close the connection.
         '''
@@ -407,34 +456,190 @@ class SSHConnection(object):
             # just ignore any errors here
             pass
 
+    def _init_framing(self):
+        ''' Switch the remote shell into framed mode (no echo, 
+            no prompts) and wait until it has confirmed that.
+        '''
+        tag = framing.new_tag()
+        self._ssh.sendline(framing.setup_command(tag))
+        i = self._ssh.expect([re.escape(framing.ready_marker(tag)), TIMEOUT, EOF], timeout=30)
+        if i != 0:
+            self._is_connected = False
+            self._ssh.close()
+            raise SSHConnectionException("Couldn't initialize command framing on %s:%s"
+                  % (self._hostname, self._port))
+        # pexpect pauses before every send to not confuse password 
+        # prompts. with framing there's nothing left to confuse.
+        self._ssh.delaybeforesend = 0
+
     def execute(self, commandline):
         ''' Execute a command.
         '''
         if not self._is_connected:
             raise SSHConnectionException("Not connected!")
         try:
-            # execute command & capture output
-            self._ssh.sendline (commandline)
-            self._ssh.prompt()
-            output = self._ssh.before.splitlines()
-            output = os.linesep.join(output[len(commandline.splitlines()):])
+            self._finish_stream()
+            if self._framed:
+                return self._execute_framed(commandline)
+            else:
+                return self._execute_prompt(commandline)
+
+        except pxssh.ExceptionPxssh, pxe:
+            raise SSHConnectionException("Couldn't run command '%s': %s" 
+                  % (commandline, str(pxe)))
+        except OSError, ose:
+            raise SSHConnectionException("Couldn't run command '%s': %s" 
+                  % (commandline, str(ose)))
 
-            # try to get the return code
-            self._ssh.sendline ('echo $?')
-            self._ssh.prompt()
-            returncode = self._ssh.before
+    def execute_many(self, commandlines):
+        ''' Execute a list of commands. In framed mode, the commands are
+            sent in as few writes as possible and their results are read 
+            back from a single response stream.
+        '''
+        if not self._is_connected:
+            raise SSHConnectionException("Not connected!")
+        try:
+            self._finish_stream()
+            if self._framed:
+                return self._execute_many_framed(commandlines)
+            else:
+                return [self._execute_prompt(c) for c in commandlines]
 
-            returncode = int(os.linesep.join([s for s in returncode.splitlines() if s != 'echo $?']))
+        except pxssh.ExceptionPxssh, pxe:
+            raise SSHConnectionException("Couldn't run commands %s: %s" 
+                  % (commandlines, str(pxe)))
+        except OSError, ose:
+            raise SSHConnectionException("Couldn't run commands %s: %s" 
+                  % (commandlines, str(ose)))
 
-            return {'exitcode':returncode, 'output':output}
+    def execute_stream(self, commandline):
+        ''' Execute a command and return a framing.FrameReader that 
+            streams its output. Requires framed mode. The next command 
+            drains whatever hasn't been read.
+        '''
+        if not self._is_connected:
+            raise SSHConnectionException("Not connected!")
+        if not self._framed:
+            raise SSHConnectionException("Streaming requires framed mode")
+        try:
+            self._finish_stream()
+            tag = framing.new_tag()
+            self._ssh.send(framing.frame_command(commandline, tag) + '\n')
+            self._reader = self._new_reader(commandline, tag)
+            return self._reader
 
         except pxssh.ExceptionPxssh, pxe:
-            raise SSHConnectionException("Couldn't run command '%s':" 
+            raise SSHConnectionException("Couldn't run command '%s': %s" 
                   % (commandline, str(pxe)))
         except OSError, ose:
-            raise SSHConnectionException("Couldn't run command '%s':" 
+            raise SSHConnectionException("Couldn't run command '%s': %s" 
                   % (commandline, str(ose)))
 
+    def _finish_stream(self):
+        ''' Drain the output of the last streamed command, if any.
+        '''
+        if self._reader is not None:
+            reader = self._reader
+            self._reader = None
+            reader.drain()
+            self._ssh.buffer = reader.remainder + self._ssh.buffer
+
+    def _new_reader(self, commandline, tag):
+        ''' Return a FrameReader for the command framed with 'tag'. The
+            output is read in chunks of up to 'read_size' bytes and the
+            sentinels are searched for in a bounded window only -- unlike
+            expect(), which re-scans the whole buffer after every read.
+        '''
+        def read():
+            try:
+                return self._ssh.read_nonblocking(self.read_size, 
+                                                  self.command_timeout)
+            except TIMEOUT:
+                raise SSHConnectionException("Command '%s' timed out after %ss" 
+                      % (commandline, self.command_timeout))
+            except EOF:
+                self._is_connected = False
+                raise SSHConnectionException("Connection closed while running '%s'" 
+                      % (commandline))
+        initial = self._ssh.buffer
+        self._ssh.buffer = ''
+        return framing.FrameReader(read, tag, initial)
+
+    def _execute_framed(self, commandline):
+        ''' Execute a command and read stdout, stderr and the exit
+            code in one round trip.
+        '''
+        tag = framing.new_tag()
+        self._ssh.send(framing.frame_command(commandline, tag) + '\n')
+        return self._read_frame(commandline, tag)
+
+    def _execute_many_framed(self, commandlines):
+        ''' Pipeline framed commands. The terminal only buffers a few
+            kilobytes of input, and we don't read any output while we're 
+            writing -- so the frames are sent in batches of at most 
+            'batch_size' bytes, which keeps a large batch from blocking 
+            on a full terminal.
+        '''
+        results = list()
+        pending = list()
+        size = 0
+        for commandline in commandlines:
+            tag = framing.new_tag()
+            frame = framing.frame_command(commandline, tag) + '\n'
+            if pending and size + len(frame) > self.batch_size:
+                results.extend(self._send_batch(pending))
+                pending = list()
+                size = 0
+            pending.append((commandline, tag, frame))
+            size += len(frame)
+        if pending:
+            results.extend(self._send_batch(pending))
+        return results
+
+    def _send_batch(self, batch):
+        ''' Send a batch of frames in one write and read the results.
+        '''
+        self._ssh.send(''.join([frame for (c, t, frame) in batch]))
+        return [self._read_frame(c, t) for (c, t, frame) in batch]
+
+    def _read_frame(self, commandline, tag):
+        ''' Read the response to the command framed with 'tag'.
+        '''
+        reader = self._new_reader(commandline, tag)
+        try:
+            stdout = "".join(reader.chunks())
+        except framing.FramingException, fe:
+            raise SSHConnectionException("Couldn't run command '%s': %s" 
+                  % (commandline, str(fe)))
+        self._ssh.buffer = reader.remainder + self._ssh.buffer
+        (stderr, returncode) = (reader.stderr, reader.exitcode)
+        return {'exitcode':returncode, 'output':stdout, 'stderr':stderr}
+
+    def _execute_prompt(self, commandline):
+        ''' Execute a command by scraping the output up to the next
+            prompt. Needs a second round trip for the exit code.
+        '''
+        # execute command & capture output
+        self._ssh.sendline (commandline)
+        self._ssh.prompt()
+        output = self._ssh.before.splitlines()
+        output = os.linesep.join(output[len(commandline.splitlines()):])
+
+        # try to get the return code
+        self._ssh.sendline ('echo $?')
+        self._ssh.prompt()
+        returncode = self._ssh.before
+
+        returncode = int(os.linesep.join([s for s in returncode.splitlines() if s != 'echo $?']))
+
+        # the terminal mixes stderr into the output. if the command
+        # failed, that's most likely where its error message is.
+        if returncode != 0:
+            stderr = output
+        else:
+            stderr = ''
+        return {'exitcode':returncode, 'output':output, 'stderr':stderr}
+
 
 class SSHConnectionException(Exception):
     '''Raised for SSHConnection exceptions.
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import threading
+
+################################################################################
+################################################################################
+
+class JobStatePollerException(Exception):
+    '''Raised for JobStatePoller exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class _Record(object):
+    '''What the poller knows about a job.'''
+
+    __slots__ = ('state', 'tracked', 'updated', 'due')
+
+    def __init__(self, state, now):
+        self.state = state
+        self.tracked = now   # when the poller started to track the job
+        self.updated = now   # when 'state' was last confirmed
+        self.due = now       # when the job has to be polled next
+
+################################################################################
+################################################################################
+
+class JobStatePoller(object):
+    '''Keeps the states of a service's jobs up to date with a background
+       thread that runs one bulk query per sweep, instead of one query per
+       job and caller.
+
+       'refresh' is called with a list of job ids and has to return a
+       dictionary {jobid: state} for (at least) these jobs. States of
+       other tracked jobs that it returns are taken as well. Jobs in one of
+       the 'final_states' aren't polled anymore. Jobs in one of the
+       'queued_states' are polled every 'queued_interval' seconds at first,
+       and less often the longer they wait, up to every 'max_interval'
+       seconds. All other (i.e., running) jobs are polled every
+       'running_interval' seconds.
+
+       get_state() and get_states() answer from memory as long as the
+       states aren't older than 'max_staleness' seconds. Otherwise, they
+       trigger a sweep right away and wait for it. The thread exits when
+       there are no more jobs to poll and is restarted on demand.
+    '''
+
+    running_interval = 5.0
+    queued_interval  = 10.0
+    max_interval     = 30.0
+    max_staleness    = 30.0
+
+    # seconds to wait for a sweep before get_state() gives up
+    sweep_timeout    = 300.0
+
+    ######################################################################
+    ##
+    def __init__(self, refresh, final_states, queued_states=[],
+                 name="JobStatePoller"):
+        '''Constructor'''
+        self._refresh = refresh
+        self._final_states = list(final_states)
+        self._queued_states = list(queued_states)
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._records = dict()   # jobid -> _Record
+        self._thread = None
+        self._stopped = False
+        self._error = None
+        self._stats = {'sweeps': 0, 'polled': 0, 'errors': 0, 'forced': 0}
+
+    ######################################################################
+    ##
+    def track(self, jobid, state=None):
+        '''Starts polling a job. If 'state' is given, it is taken as the
+           job's current state and the first poll happens after the usual
+           interval.
+        '''
+        self._cond.acquire()
+        try:
+            now = time.time()
+            record = _Record(state, now)
+            if state is None:
+                record.updated = 0.0
+            else:
+                record.due = now + self._interval(record, now)
+            self._records[jobid] = record
+            self._wakeup()
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def update(self, jobid, state):
+        '''Records a state that was obtained some other way, e.g., right
+           after a job was canceled.
+        '''
+        self._cond.acquire()
+        try:
+            now = time.time()
+            record = self._records.get(jobid)
+            if record is None:
+                record = _Record(state, now)
+                self._records[jobid] = record
+            record.state = state
+            record.updated = now
+            record.due = now + self._interval(record, now)
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def forget(self, jobid):
+        '''Stops polling a job'''
+        self._cond.acquire()
+        try:
+            self._records.pop(jobid, None)
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def get_state(self, jobid, max_staleness=None):
+        '''Returns the state of a job. Jobs that aren't tracked yet are
+           tracked from now on.
+        '''
+        return self.get_states([jobid], max_staleness)[0]
+
+    ######################################################################
+    ##
+    def get_states(self, jobids, max_staleness=None):
+        '''Returns the states of a list of jobs. All jobs with stale
+           states are refreshed in one sweep.
+        '''
+        if max_staleness is None:
+            max_staleness = self.max_staleness
+
+        self._cond.acquire()
+        try:
+            now = time.time()
+            stale = list()
+            for jobid in jobids:
+                record = self._records.get(jobid)
+                if record is None:
+                    record = _Record(None, now)
+                    record.updated = 0.0
+                    self._records[jobid] = record
+                if record.state in self._final_states:
+                    continue
+                if now - record.updated > max_staleness:
+                    record.due = 0.0
+                    stale.append(record)
+
+            if stale:
+                self._stats['forced'] += 1
+                self._wakeup()
+                deadline = now + self.sweep_timeout
+                sweeps = self._stats['sweeps']
+                while [r for r in stale if r.updated < now]:
+                    if self._stats['sweeps'] != sweeps and self._error is not None:
+                        raise JobStatePollerException(
+                          "Couldn't refresh job states: %s" % str(self._error))
+                    sweeps = self._stats['sweeps']
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise JobStatePollerException(
+                          "Timeout after %ss while refreshing job states" \
+                          % self.sweep_timeout)
+                    self._cond.wait(remaining)
+
+            return [self._records[jobid].state for jobid in jobids]
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def wait(self, jobids, any=False, timeout=None):
+        '''Blocks until all jobs (or, if 'any' is True, at least one of
+           them) are in a final state, or for up to 'timeout' seconds
+           (forever if None). Waiters are woken up after every sweep, so
+           any number of them costs no more than one query per sweep.
+           Returns the ids of the jobs that are in a final state.
+        '''
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        self._cond.acquire()
+        try:
+            now = time.time()
+            for jobid in jobids:
+                if jobid not in self._records:
+                    record = _Record(None, now)
+                    record.updated = 0.0
+                    self._records[jobid] = record
+            self._wakeup()
+
+            sweeps = self._stats['sweeps']
+            while True:
+                final = [jobid for jobid in jobids \
+                         if jobid in self._records \
+                         and self._records[jobid].state in self._final_states]
+                if len(final) == len(jobids) or (any and len(final) > 0):
+                    return final
+                if self._stats['sweeps'] != sweeps and self._error is not None:
+                    raise JobStatePollerException(
+                      "Couldn't refresh job states: %s" % str(self._error))
+                sweeps = self._stats['sweeps']
+                # wake up every now and then, so that the thread can
+                # be interrupted
+                remaining = self.running_interval
+                if deadline is not None:
+                    remaining = min(remaining, deadline - time.time())
+                    if remaining <= 0:
+                        return final
+                self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def stats(self):
+        '''Returns the poller's counters and the number of tracked jobs'''
+        self._cond.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['tracked'] = len(self._records)
+            stats['active'] = len(self._active())
+            return stats
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def stop(self):
+        '''Stops the background thread. It is restarted on demand.'''
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._cond.notifyAll()
+            thread = self._thread
+        finally:
+            self._cond.release()
+        if thread is not None and thread is not threading.currentThread():
+            thread.join()
+
+    ######################################################################
+    ##
+    def _active(self):
+        '''Returns the records that have to be polled. Requires the lock.'''
+        return [(jobid, record) for (jobid, record) in self._records.items() \
+                if record.state not in self._final_states]
+
+    def _interval(self, record, now):
+        '''Returns the number of seconds until the next poll of a job'''
+        if record.state in self._queued_states:
+            # the longer a job has been waiting, the less likely it
+            # is to start within the next few seconds
+            age = now - record.tracked
+            return min(self.max_interval, self.queued_interval + age / 10.0)
+        return self.running_interval
+
+    def _wakeup(self):
+        '''Makes sure the thread runs and re-checks due jobs. Requires
+           the lock.
+        '''
+        self._stopped = False
+        if self._thread is None or not self._thread.isAlive():
+            self._thread = threading.Thread(target=self._poll_loop,
+                                            name=self._name)
+            self._thread.setDaemon(True)
+            self._thread.start()
+        self._cond.notifyAll()
+
+    ######################################################################
+    ##
+    def _poll_loop(self):
+        '''Body of the polling thread.'''
+        while True:
+            self._cond.acquire()
+            try:
+                while True:
+                    active = self._active()
+                    if self._stopped or not active:
+                        self._thread = None
+                        return
+                    now = time.time()
+                    if min([r.due for (j, r) in active]) <= now:
+                        # jobs that would be due soon are polled along,
+                        # so that the jobs' schedules don't drift apart
+                        window = now + self.running_interval / 2.0
+                        due = [jobid for (jobid, record) in active \
+                               if record.due <= window]
+                        break
+                    self._cond.wait(min([r.due for (j, r) in active]) - now)
+            finally:
+                self._cond.release()
+
+            # the query runs outside of the lock
+            error = None
+            states = dict()
+            try:
+                states = self._refresh(due)
+            except Exception, ex:
+                error = ex
+
+            self._cond.acquire()
+            try:
+                now = time.time()
+                self._stats['sweeps'] += 1
+                self._stats['polled'] += len(due)
+                self._error = error
+                for jobid in due:
+                    record = self._records.get(jobid)
+                    if record is None:
+                        continue # forgotten in the meantime
+                    if error is not None:
+                        # try again later, but don't spin
+                        record.due = now + self.running_interval
+                        continue
+                    if jobid in states:
+                        record.state = states[jobid]
+                    record.updated = now
+                    record.due = now + self._interval(record, now)
+                polled = set(due)
+                for (jobid, state) in states.items():
+                    # a bulk query that answered for more jobs than
+                    # were due saves their next poll
+                    record = self._records.get(jobid)
+                    if record is None or jobid in polled or \
+                      record.state in self._final_states:
+                        continue
+                    record.state = state
+                    record.updated = now
+                    record.due = now + self._interval(record, now)
+                if error is not None:
+                    self._stats['errors'] += 1
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
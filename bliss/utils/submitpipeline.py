@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import threading
+import collections
+
+################################################################################
+################################################################################
+
+class SubmissionPipelineException(Exception):
+    '''Raised for SubmissionPipeline exceptions.
+    '''
+
+################################################################################
+################################################################################
+
+class SubmissionPipeline(object):
+    '''Submits jobs in the background, in batches.
+
+       enqueue() hands a job over and returns right away -- unless there
+       are already 'max_in_flight' jobs queued or being submitted, in
+       which case it waits until there is room again. A background thread
+       takes up to 'batch_size' queued jobs at a time and passes them to
+       'submit(jobs)', which has to return one result per job: a jobinfo,
+       or the exception that the job's submission raised. The thread
+       exits when the queue is empty and is restarted on demand.
+
+       settle(key) waits until the job enqueued under 'key' has been
+       submitted, and raises its exception if the submission failed.
+       The exceptions of the last 'max_failed' failed jobs are kept
+       around for that; settle() doesn't know about older failures.
+    '''
+
+    ######################################################################
+    ##
+    def __init__(self, submit, max_in_flight=500, batch_size=100,
+                 max_failed=10000, name="SubmissionPipeline"):
+        '''Constructor'''
+        if max_in_flight < 1 or batch_size < 1:
+            raise SubmissionPipelineException(
+              "Invalid pipeline size: %s / %s" % (max_in_flight, batch_size))
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.max_failed = max_failed
+        self._submit = submit
+        self._name = name
+
+        self._cond = threading.Condition()
+        self._queue = list()      # [(key, job, on_submitted)]
+        self._in_flight = dict()  # key -> None, for queued and running jobs
+        self._failed = dict()     # key -> exception
+        self._failed_order = collections.deque() # (key, exception), oldest first
+        self._thread = None
+        self._stats = {'submitted': 0, 'failed': 0, 'batches': 0, 'waits': 0}
+
+    ######################################################################
+    ##
+    def enqueue(self, key, job, on_submitted):
+        '''Queues 'job' for submission. 'on_submitted(jobinfo)' is called
+           (by the background thread) once it has been submitted.
+        '''
+        self._cond.acquire()
+        try:
+            if key in self._in_flight:
+                raise SubmissionPipelineException(
+                  "Job %s is already being submitted" % key)
+            if len(self._in_flight) >= self.max_in_flight:
+                self._stats['waits'] += 1
+                while len(self._in_flight) >= self.max_in_flight:
+                    self._cond.wait()
+            self._failed.pop(key, None)
+            self._in_flight[key] = None
+            self._queue.append((key, job, on_submitted))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._submit_loop,
+                                                name=self._name)
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._cond.release()
+
+    def is_pending(self, key):
+        '''Returns True if the job hasn't been submitted yet'''
+        return key in self._in_flight
+
+    def settle(self, key):
+        '''Waits until the job enqueued under 'key' (if any) has been
+           submitted. Raises the exception of a failed submission.
+        '''
+        self._cond.acquire()
+        try:
+            while key in self._in_flight:
+                self._cond.wait()
+            if key in self._failed:
+                raise self._failed[key]
+        finally:
+            self._cond.release()
+
+    def flush(self):
+        '''Waits until all queued jobs have been submitted'''
+        self._cond.acquire()
+        try:
+            while len(self._in_flight) > 0:
+                self._cond.wait()
+        finally:
+            self._cond.release()
+
+    def stats(self):
+        '''Returns the number of submitted and failed jobs, of batches,
+           and how often enqueue() had to wait for room
+        '''
+        self._cond.acquire()
+        try:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._in_flight)
+            return stats
+        finally:
+            self._cond.release()
+
+    ######################################################################
+    ##
+    def _submit_loop(self):
+        '''Runs in the background thread'''
+        while True:
+            self._cond.acquire()
+            try:
+                if len(self._queue) == 0:
+                    self._thread = None
+                    return
+                batch = self._queue[:self.batch_size]
+                del self._queue[:self.batch_size]
+            finally:
+                self._cond.release()
+
+            try:
+                results = self._submit([job for (key, job, callback) in batch])
+            except Exception, ex:
+                results = [ex] * len(batch)
+            if len(results) != len(batch):
+                results = [SubmissionPipelineException(
+                  "Got %s results for %s jobs" % (len(results), len(batch)))] \
+                  * len(batch)
+
+            failed = dict()
+            for ((key, job, on_submitted), result) in zip(batch, results):
+                if not isinstance(result, Exception):
+                    try:
+                        on_submitted(result)
+                    except Exception, ex:
+                        result = ex
+                if isinstance(result, Exception):
+                    failed[key] = result
+
+            self._cond.acquire()
+            try:
+                self._stats['batches'] += 1
+                self._stats['submitted'] += len(batch) - len(failed)
+                self._stats['failed'] += len(failed)
+                self._failed.update(failed)
+                self._failed_order.extend(failed.items())
+                while len(self._failed_order) > self.max_failed:
+                    (key, ex) = self._failed_order.popleft()
+                    # (unless the job has been enqueued and failed again)
+                    if self._failed.get(key) is ex:
+                        del self._failed[key]
+                for (key, job, on_submitted) in batch:
+                    del self._in_flight[key]
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
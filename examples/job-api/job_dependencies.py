@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+'''This examples shows how to submit a small workflow at once
+
+   The 'align' job only starts after both 'prepare' jobs have
+   finished successfully, and the 'cleanup' job after 'align'
+   has finished, no matter how. With a PBS or SGE job service
+   (e.g., "pbs+ssh://..."), the jobs are held by the scheduler;
+   with fork:// they are started from here.
+
+   If something doesn't work as expected, try to set
+   SAGA_VERBOSE=3 in your environment before you run the
+   script in order to get some debug output.
+
+   If you think you have encountered a defect, please
+   report it at: https://github.com/saga-project/bliss/issues
+'''
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2011-2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys, time
+import bliss.saga as saga
+
+def main():
+
+    try:
+        # create a job service for the local machine
+        js = saga.job.Service("fork://localhost")
+        container = saga.job.Container(js)
+
+        # two independent jobs
+        jd = saga.job.Description()
+        jd.executable = '/bin/sleep'
+        jd.arguments  = ['2']
+        prepare = [js.create_job(jd), js.create_job(jd)]
+
+        # runs after both of them have finished successfully
+        jd.arguments    = ['1']
+        jd.dependencies = {'afterok': prepare}
+        align = js.create_job(jd)
+
+        # runs after 'align' has finished, no matter how
+        jd.executable   = '/bin/true'
+        jd.arguments    = None
+        jd.dependencies = {'afterany': [align]}
+        cleanup = js.create_job(jd)
+
+        for job in prepare + [align, cleanup]:
+            container.add(job)
+
+        print "\n...starting all jobs...\n"
+        start = time.time()
+        container.run()
+
+        print "Job States : %s" % (container.get_states())
+
+        print "\n...waiting for the workflow...\n"
+        container.wait(saga.job.Container.All)
+
+        print "Job States : %s" % (container.get_states())
+        print "Elapsed    : %.0fs" % (time.time() - start)
+
+    except saga.Exception, ex:
+        print "An error occured during job execution: %s" % (str(ex))
+        sys.exit(-1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+
+from bliss.plugins.pbs.cmdlinewrapper import parse_pbsnodes
+from bliss.utils import nodeinventory
+
+PROPERTIES = ['ib', 'bigmem', 'gpu', 'ssd', 'rack1', 'rack2', 'rack3']
+
+def synthetic_pbsnodes(nodes):
+    """Returns 'pbsnodes -a' output for the given number of nodes
+    """
+    records = list()
+    for i in range(0, nodes):
+        np = [8, 16, 32][i % 3]
+        used = i % (np+1)
+        state = 'free'
+        if used == np:
+            state = 'job-exclusive'
+        if i % 97 == 0:
+            state = 'down,offline'
+        jobs = ", ".join(["%s/%s.cluster.org" % (slot, 100000+i) \
+                          for slot in range(0, used)])
+        props = ",".join([PROPERTIES[(i+k) % len(PROPERTIES)] \
+                          for k in range(0, i % 3 + 1)])
+        records.append("node%05d\n" \
+          "     state = %s\n" \
+          "     np = %s\n" \
+          "     properties = %s\n" \
+          "     ntype = cluster\n" \
+          "     jobs = %s\n" \
+          "     status = rectime=1350550000,varattr=,jobs=,state=free," \
+          "netload=1234567,gres=,loadave=%.2f,ncpus=%s," \
+          "physmem=%skb,availmem=1000kb,totmem=1000kb,idletime=10," \
+          "nusers=1,nsessions=1,uname=Linux node 2.6.32 x86_64,opsys=linux\n" \
+          "     gpus = 0\n" \
+          % (i, state, np, props, jobs, (i % 17) / 2.0, np,
+             [32, 64, 128][i % 3] * 1024 * 1024))
+    return "\n".join(records) + "\n"
+
+def legacy_nodeinfo(output):
+    """Parses the output into a list of per-node dicts, as the previous
+       PBSServiceInfo did
+    """
+    nodeinfo = list()
+    for node_raw in output.split('\n\n'):
+        lines = node_raw.split('\n')
+        node_data = dict()
+        for line in lines[1:]:
+            if line:
+                (key, value) = line.split(" = ", 1)
+                node_data[key.strip()] = value
+        nodeinfo.append(node_data)
+    return nodeinfo
+
+def legacy_queries(nodeinfo):
+    """Answers the benchmark's questions by looping over the dicts
+    """
+    free_64gb = 0
+    per_property = dict()
+    for node in nodeinfo:
+        if 'np' not in node:
+            continue
+        status = dict([item.split('=', 1) for item \
+                       in node['status'].split(',') if item.find('=') != -1])
+        physmem = float(status['physmem'].replace('kb', ''))
+        if node['state'] == 'free' and physmem >= 64*1024**2:
+            used = len([job for job in node['jobs'].split(',') if job.strip()])
+            free_64gb += int(node['np']) - used
+        for prop in node['properties'].split(','):
+            per_property[prop] = per_property.get(prop, 0) + 1
+    return (free_64gb, per_property)
+
+def inventory_queries(inventory):
+    """Answers the benchmark's questions with filters over the columns
+    """
+    free_64gb = inventory.free_cores(
+      inventory.select(state='free', min_physmem=64*1024**2))
+    return (free_64gb, inventory.nodes_per_property())
+
+def best_of(repeat, function, *args):
+    best = None
+    for i in range(0, repeat):
+        t0 = time.time()
+        result = function(*args)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+def run(nodes, repeat):
+    """Compares dict lists with the columnar node inventory
+    """
+    output = synthetic_pbsnodes(nodes)
+    print "%s nodes, pbsnodes -a: %.1f MB, columns: %s" \
+      % (nodes, len(output)/1e6, nodeinventory.numpy is not None \
+         and "numpy" or "array")
+
+    (t_legacy_parse, nodeinfo) = best_of(repeat, legacy_nodeinfo, output)
+    (t_legacy_query, legacy) = best_of(repeat, legacy_queries, nodeinfo)
+    (t_parse, inventory) = best_of(repeat, parse_pbsnodes, output)
+    (t_query, result) = best_of(repeat, inventory_queries, inventory)
+
+    print "%-18s: parse %7.3fs | query %8.4fs" \
+      % ("legacy (dicts)", t_legacy_parse, t_legacy_query)
+    print "%-18s: parse %7.3fs | query %8.4fs" \
+      % ("inventory", t_parse, t_query)
+
+    if legacy != result:
+        print "FAILED: results differ: %s vs. %s" % (legacy, result)
+        return True
+    return False
+
+
+def usage():
+    print 'Usage: python %s ' % __file__
+    print '                <NODES (default: 5000)>'
+    print '                <REPETITIONS (default: 3)>'
+
+def main():
+    nodes = 5000
+    repeat = 3
+
+    args = sys.argv[1:]
+    if len(args) > 2:
+        usage()
+        sys.exit(-1)
+    try:
+        if len(args) > 0:
+            nodes = int(args[0])
+        if len(args) > 1:
+            repeat = int(args[1])
+    except ValueError:
+        usage()
+        sys.exit(-1)
+
+    return run(nodes, repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
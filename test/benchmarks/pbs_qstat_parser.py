@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+
+from bliss.plugins.pbs.cmdlinewrapper import PBSQstatParser, PBSQstatXMLParser
+
+# the attributes of a typical 'qstat -f1' record
+ATTRIBUTES = [
+    ("Job_Name", "bliss_job"),
+    ("Job_Owner", "user@login1.cluster.org"),
+    ("resources_used.cput", "00:12:04"),
+    ("resources_used.mem", "104852kb"),
+    ("resources_used.vmem", "389224kb"),
+    ("resources_used.walltime", "00:12:10"),
+    ("job_state", "R"),
+    ("queue", "batch"),
+    ("server", "cluster.org"),
+    ("Checkpoint", "u"),
+    ("ctime", "Thu Oct 18 10:00:00 2012"),
+    ("Error_Path", "login1.cluster.org:/home/user/bliss_job.e%(id)s"),
+    ("exec_host", "node%(node)s/0"),
+    ("Hold_Types", "n"),
+    ("Join_Path", "n"),
+    ("Keep_Files", "n"),
+    ("Mail_Points", "a"),
+    ("mtime", "Thu Oct 18 10:00:05 2012"),
+    ("Output_Path", "login1.cluster.org:/home/user/bliss_job.o%(id)s"),
+    ("Priority", "0"),
+    ("qtime", "Thu Oct 18 10:00:00 2012"),
+    ("Rerunable", "True"),
+    ("Resource_List.nodect", "1"),
+    ("Resource_List.nodes", "1:ppn=8"),
+    ("Resource_List.walltime", "01:00:00"),
+    ("session_id", "%(id)s"),
+    ("Variable_List", "PBS_O_HOME=/home/user,PBS_O_LANG=en_US.UTF-8," \
+     "PBS_O_LOGNAME=user,PBS_O_PATH=/usr/local/bin:/usr/bin:/bin," \
+     "PBS_O_SHELL=/bin/bash,PBS_O_HOST=login1.cluster.org," \
+     "PBS_O_WORKDIR=/home/user,PBS_O_QUEUE=batch"),
+    ("etime", "Thu Oct 18 10:00:00 2012"),
+    ("exit_status", "0"),
+    ("submit_args", "-"),
+    ("start_time", "Thu Oct 18 10:00:05 2012"),
+    ("start_count", "1"),
+    ("fault_tolerant", "False"),
+    ("submit_host", "login1.cluster.org"),
+    ("init_work_dir", "/home/user"),
+]
+
+def synthetic_text(jobs):
+    """Returns 'qstat -f1' output for the given number of jobs
+    """
+    records = list()
+    for i in range(0, jobs):
+        values = {'id': 100000+i, 'node': i % 512}
+        lines = ["Job Id: %s.cluster.org" % (100000+i)]
+        for (key, value) in ATTRIBUTES:
+            lines.append("    %s = %s" % (key, value % values))
+        records.append("\n".join(lines) + "\n")
+    return "\n".join(records) + "\n"
+
+def synthetic_xml(jobs):
+    """Returns 'qstat -x' output for the given number of jobs
+    """
+    records = list()
+    for i in range(0, jobs):
+        values = {'id': 100000+i, 'node': i % 512}
+        elements = ["<Job_Id>%s.cluster.org</Job_Id>" % (100000+i)]
+        groups = dict()
+        for (key, value) in ATTRIBUTES:
+            value = value % values
+            if key.find(".") != -1:
+                (group, key) = key.split(".")
+                if group not in groups:
+                    groups[group] = list()
+                    elements.append(group)
+                groups[group].append("<%s>%s</%s>" % (key, value, key))
+            else:
+                elements.append("<%s>%s</%s>" % (key, value, key))
+        for (n, element) in enumerate(elements):
+            if element in groups:
+                elements[n] = "<%s>%s</%s>" % (element, "".join(groups[element]), element)
+        records.append("<Job>%s</Job>" % "".join(elements))
+    return "<Data>%s</Data>" % "".join(records)
+
+class LegacyJobInfo(object):
+    """The previous PBSJobInfo: every attribute in the instance __dict__
+    """
+    def __init__(self, qstat_f_output):
+        lines = qstat_f_output.split("\n")
+        self._jobid = lines[0].split(":")[1].strip()
+        for line in lines[1:]:
+            try:
+                (key, value) = line.split(" = ")
+                self.__dict__["_%s" % key.strip()] = value
+            except Exception:
+                pass
+
+def parse_legacy(output, chunk_size):
+    """Splits the complete output into records, as the previous
+       get_jobinfo_bulk() did
+    """
+    return [LegacyJobInfo(record.strip("\n")) \
+            for record in output.split("\n\n") if len(record.strip()) > 0]
+
+def parse_streaming(parser, output, chunk_size):
+    """Feeds the output to the parser chunk by chunk, as it comes in
+       from a CommandWrapperStream
+    """
+    for i in range(0, len(output), chunk_size):
+        parser.feed(output[i:i+chunk_size])
+    return parser.close()
+
+def record_size(record):
+    """Approximates the memory that a record takes up
+    """
+    size = sys.getsizeof(record)
+    if hasattr(record, '__dict__'):
+        size += sys.getsizeof(record.__dict__)
+        for value in record.__dict__.values():
+            size += sys.getsizeof(value)
+    else:
+        for slot in record.__slots__:
+            value = getattr(record, slot)
+            if value is not None:
+                size += sys.getsizeof(value)
+    return size
+
+def measure(name, parse, output, jobs, chunk_size, repeat):
+    """Runs a parser 'repeat' times and prints the best result
+    """
+    best = None
+    for i in range(0, repeat):
+        t0 = time.time()
+        records = parse(output, chunk_size)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    if len(records) != jobs or getattr(records[-1], '_job_state', None) != 'R':
+        print "%-18s: FAILED (%s records)" % (name, len(records))
+        return True
+    print "%-18s: %7.3fs | %8.0f jobs/s | ~%4d bytes/record" \
+      % (name, best, jobs/best, record_size(records[-1]))
+    return False
+
+def run(jobs, chunk_size, repeat):
+    """Compares the previous parser with the streaming parsers
+    """
+    text = synthetic_text(jobs)
+    xml = synthetic_xml(jobs)
+    print "%s jobs, qstat -f1: %.1f MB, qstat -x: %.1f MB, %s byte chunks" \
+      % (jobs, len(text)/1e6, len(xml)/1e6, chunk_size)
+
+    failed = measure("legacy (-f1)", parse_legacy, text, jobs, chunk_size, repeat)
+    failed |= measure("streaming (-f1)",
+      lambda output, size: parse_streaming(PBSQstatParser(), output, size),
+      text, jobs, chunk_size, repeat)
+    failed |= measure("streaming (-x)",
+      lambda output, size: parse_streaming(PBSQstatXMLParser(), output, size),
+      xml, jobs, chunk_size, repeat)
+    return failed
+
+
+def usage():
+    print 'Usage: python %s ' % __file__
+    print '                <JOBS (default: 50000)>'
+    print '                <CHUNK SIZE (default: 65536)>'
+    print '                <REPETITIONS (default: 3)>'
+
+def main():
+    jobs = 50000
+    chunk_size = 65536
+    repeat = 3
+
+    args = sys.argv[1:]
+    if len(args) > 3:
+        usage()
+        sys.exit(-1)
+    try:
+        if len(args) > 0:
+            jobs = int(args[0])
+        if len(args) > 1:
+            chunk_size = int(args[1])
+        if len(args) > 2:
+            repeat = int(args[2])
+    except ValueError:
+        usage()
+        sys.exit(-1)
+
+    return run(jobs, chunk_size, repeat)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+import getpass
+import threading
+
+from bliss.utils.command_wrapper import CommandWrapper, CommandWrapperException
+
+class _Logger(object):
+    """Minimal logger for the CommandWrapper
+    """
+    def log_info(self, msg):
+        pass
+
+def measure(hostname, port, username, backend, commands, threads):
+    """Measures connect time, sequential and concurrent command latency
+    """
+    t0 = time.time()
+    cw = CommandWrapper.initAsSSHWrapper(_Logger(), hostname, port=port,
+                                         username=username, backend=backend)
+    cw.connect()
+    connect = time.time() - t0
+
+    t0 = time.time()
+    for i in range(0, commands):
+        cw.run("true")
+    sequential = (time.time() - t0) / commands
+
+    # the pexpect backend drives a single shell, so it can only run one
+    # command at a time -- the threads are serialized by a lock.
+    lock = threading.Lock()
+    def worker():
+        for i in range(0, commands / threads):
+            if backend == 'pexpect':
+                lock.acquire()
+                try:
+                    cw.run("true")
+                finally:
+                    lock.release()
+            else:
+                cw.run("true")
+
+    workers = [threading.Thread(target=worker) for i in range(0, threads)]
+    t0 = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    concurrent = (time.time() - t0) / ((commands / threads) * threads)
+
+    cw.disconnect()
+    return (connect, sequential, concurrent)
+
+def run(hostname, port, username, commands, threads):
+    """Compares the pexpect and the ControlMaster backend
+    """
+    try:
+        for backend in ['pexpect', 'controlmaster']:
+            (connect, sequential, concurrent) = measure(hostname, port, username,
+                                                        backend, commands, threads)
+            print "%-14s: connect %.3fs | %.1fms/command sequential | %.1fms/command with %d threads" \
+              % (backend, connect, sequential*1000, concurrent*1000, threads)
+    except CommandWrapperException, ex:
+        print "Benchmark FAILED: %s" % (str(ex))
+        return True
+    return False
+
+
+def usage():
+    print 'Usage: python %s ' % __file__
+    print '                <HOSTNAME[:PORT]>'
+    print '                <REMOTEUSERNAME (default: local username)>'
+    print '                <COMMANDS (default: 100)>'
+    print '                <THREADS (default: 8)>'
+
+def main():
+    remoteusername = getpass.getuser()
+    commands = 100
+    threads = 8
+
+    args = sys.argv[1:]
+    if len(args) < 1:
+        usage()
+        sys.exit(-1)
+    else:
+        hostname = args[0]
+        port = 22
+        if hostname.find(':') != -1:
+            (hostname, port) = hostname.split(':')
+
+    try:
+        remoteusername = args[1]
+        commands = int(args[2])
+        threads = int(args[3])
+    except IndexError:
+        pass
+
+    return run(hostname, port, remoteusername, commands, threads)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import sys
+import time
+import getpass
+
+from bliss.utils.sshconnection import SSHConnection, SSHConnectionException
+
+def measure(hostname, port, username, fast_login, rounds):
+    """Measures the connect-to-first-command latency of an SSHConnection
+    """
+    samples = list()
+    for i in range(0, rounds):
+        t0 = time.time()
+        conn = SSHConnection(fast_login=fast_login)
+        conn.login(hostname=hostname, port=port, username=username)
+        t1 = time.time()
+        conn.execute("true")
+        t2 = time.time()
+        conn.logout()
+        samples.append((t1-t0, t2-t0))
+    return samples
+
+def run(hostname, port, username, rounds):
+    """Compares the fast login handshake with the heuristic prompt sync
+    """
+    try:
+        for (label, fast_login) in [("fast login", True), ("prompt sync", False)]:
+            samples = measure(hostname, port, username, fast_login, rounds)
+            login = [s[0] for s in samples]
+            first = [s[1] for s in samples]
+            print "%-12s: login %.3fs (min %.3fs) | first command after %.3fs (min %.3fs)" \
+              % (label, sum(login)/len(login), min(login), sum(first)/len(first), min(first))
+    except SSHConnectionException, ex:
+        print "Benchmark FAILED: %s" % (str(ex))
+        return True
+    return False
+
+
+def usage():
+    print 'Usage: python %s ' % __file__
+    print '                <HOSTNAME[:PORT]>'
+    print '                <REMOTEUSERNAME (default: local username)>'
+    print '                <ROUNDS (default: 5)>'
+
+def main():
+    remoteusername = getpass.getuser()
+    rounds = 5
+
+    args = sys.argv[1:]
+    if len(args) < 1:
+        usage()
+        sys.exit(-1)
+    else:
+        hostname = args[0]
+        port = 22
+        if hostname.find(':') != -1:
+            (hostname, port) = hostname.split(':')
+
+    try:
+        remoteusername = args[1]
+        rounds = int(args[2])
+    except IndexError:
+        pass
+
+    return run(hostname, port, remoteusername, rounds)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
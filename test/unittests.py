@@ -25,15 +25,39 @@ if __name__ == '__main__':
     suite_job = unittest.TestSuite()
     suite_job.addTests(unittest.TestLoader().loadTestsFromTestCase(JobDescriptionTests))
     suite_job.addTests(unittest.TestLoader().loadTestsFromTestCase(JobIssueTests))
+    suite_job.addTests(unittest.TestLoader().loadTestsFromTestCase(JobContainerTests))
  #  suite_job.addTests(unittest.TestLoader().loadTestsFromTestCase(JobMiscTests))
 
     # Filesystem package tests
     suite_file = unittest.TestSuite()
     suite_file.addTests(unittest.TestLoader().loadTestsFromTestCase(FilesystemDirectoryTests))
  
+    # Utility tests (offline)
+    suite_utils = unittest.TestSuite()
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(FrameReaderTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(LocalShellTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(CommandWrapperTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(AsyncCommandWrapperTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(CommandWrapperPoolTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(SubmissionPipelineTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(QueryCacheTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(JobStatePollerTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(JobCacheTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(NodeInventoryTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(BulkSubmitTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(JobStatusTests))
+    suite_utils.addTests(unittest.TestLoader().loadTestsFromTestCase(AccountingTailTests))
+
+    # Adaptor tests (offline)
+    suite_plugins = unittest.TestSuite()
+    suite_plugins.addTests(unittest.TestLoader().loadTestsFromTestCase(SGEQstatParserTests))
+    suite_plugins.addTests(unittest.TestLoader().loadTestsFromTestCase(PBSQstatParserTests))
+ 
     alltests = unittest.TestSuite([suite_lnf, 
                                    suite_job,
-                                   suite_file])
+                                   suite_file,
+                                   suite_utils,
+                                   suite_plugins])
 
     result = unittest.TextTestRunner(verbosity=10).run(alltests)
     sys.exit(not result.wasSuccessful())
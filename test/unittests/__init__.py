@@ -14,5 +14,23 @@ from url        import *
 from job.description import *
 from job.issues      import *
 from job.misc        import *
+from job.container   import *
 
 from file.directory  import * 
+
+from utils.framing import *
+from utils.localshell import *
+from utils.command_wrapper import *
+from utils.async_command_wrapper import *
+from utils.connectionpool import *
+from utils.submitpipeline import *
+from utils.querycache import *
+from utils.statepoller import *
+from utils.jobcache import *
+from utils.nodeinventory import *
+from utils.bulksubmit import *
+from utils.jobstatus import *
+from utils.accounting import *
+
+from plugins.sge import *
+from plugins.pbs import *
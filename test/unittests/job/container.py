@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import bliss.saga as saga
+import unittest
+
+###############################################################################
+#
+class JobContainerTests(unittest.TestCase):
+    """
+    Tests for the saga.job.Container class
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.js = saga.job.Service("fork://localhost/")
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def _create_job(self, seconds):
+        jd = saga.job.Description()
+        jd.executable = "/bin/sleep"
+        jd.arguments = [str(seconds)]
+        return self.js.create_job(jd)
+
+    ###########################################################################
+    #
+    def test_add_remove(self):
+        """
+        Test container add(), remove(), list() and size()
+        """
+        jc = saga.job.Container(self.js)
+        j1 = self._create_job(0)
+        j2 = self._create_job(0)
+        jc.add(j1)
+        jc.add(j2)
+        self.assertEqual(jc.size(), 2)
+        self.assertEqual(jc.list(), [j1, j2])
+
+        try:
+            jc.add(j1)
+            self.fail("Adding a job twice should raise AlreadyExists")
+        except saga.Exception, e:
+            self.assertEqual(e.error, saga.Error.AlreadyExists)
+
+        jc.remove(j1)
+        self.assertEqual(jc.list(), [j2])
+        try:
+            jc.remove(j1)
+            self.fail("Removing a non-member should raise DoesNotExist")
+        except saga.Exception, e:
+            self.assertEqual(e.error, saga.Error.DoesNotExist)
+
+    ###########################################################################
+    #
+    def test_run_wait_all(self):
+        """
+        Test container run(), wait(All) and get_states()
+        """
+        jc = saga.job.Container(self.js)
+        for i in range(0, 4):
+            jc.add(self._create_job(0))
+        self.assertEqual(jc.get_states(), [saga.job.Job.New] * 4)
+
+        jc.run()
+        jc.wait(saga.job.Container.All)
+        self.assertEqual(jc.get_states(), [saga.job.Job.Done] * 4)
+
+    ###########################################################################
+    #
+    def test_wait_any(self):
+        """
+        Test container wait(Any) with a timeout
+        """
+        jc = saga.job.Container(self.js)
+        fast = self._create_job(0)
+        slow = self._create_job(10)
+        jc.add(slow)
+        jc.add(fast)
+        jc.run()
+
+        job = jc.wait(saga.job.Container.Any, 5.0)
+        self.assertTrue(job is fast)
+        self.assertEqual(slow.get_state(), saga.job.Job.Running)
+
+        jc.cancel()
+        self.assertEqual(slow.get_state(), saga.job.Job.Canceled)
+
+    ###########################################################################
+    #
+    def test_wait_mode(self):
+        """
+        Test that wait() rejects unknown wait modes
+        """
+        jc = saga.job.Container(self.js)
+        try:
+            jc.wait("sometimes")
+            self.fail("Unknown wait mode should raise BadParameter")
+        except saga.Exception, e:
+            self.assertEqual(e.error, saga.Error.BadParameter)
@@ -240,6 +240,91 @@ class JobDescriptionTests(unittest.TestCase):
         except saga.Exception, e : 
             self.fail(e)
 
+    ###########################################################################
+    #
+    def test_dependencies(self) :
+        """
+        Test if job description dependencies work as expected
+        """
+
+        try :
+            js = saga.job.Service ('fork://localhost')
+            jd = saga.job.Description()
+            jd.executable = 'true'
+            j1 = js.create_job (jd)
+            j2 = js.create_job (jd)
+
+            if jd.dependencies != None :
+                self.fail("Attribute Error - should have been None")
+
+            jd.dependencies = [j1, j2]
+            if jd.dependencies != {'afterok' : [j1, j2]} :
+                self.fail("Attribute Error - unexpected value")
+
+            jd.dependencies = {'afterok' : j1, 'afterany' : [j2]}
+            if jd.get_attribute("Dependencies") != {'afterok' : [j1], 'afterany' : [j2]} :
+                self.fail("Attribute Error - unexpected value")
+
+            j3 = js.create_job (jd)
+            jd.dependencies = None
+            if j3.get_description().dependencies != {'afterok' : [j1], 'afterany' : [j2]} :
+                self.fail("Deep Copy Error: dependencies have changed unexpectedly")
+
+        except saga.Exception, e : 
+            self.fail(e)
+
+        for value in ['job', {'after' : [j1]}, {'afterok' : ['job']}] :
+            try:
+                jd.dependencies = value
+                self.fail("Exception in case of unsupported attribute value expected!")
+            except saga.Exception, e:
+                pass
+
+    ###########################################################################
+    #
+    def test_dependencies_fork(self) :
+        """
+        Test if jobs with dependencies wait for them on fork://
+        """
+
+        try :
+            js = saga.job.Service ('fork://localhost')
+
+            jd = saga.job.Description()
+            jd.executable = '/bin/sleep'
+            jd.arguments  = ['1']
+            ok = js.create_job (jd)
+            jd.executable = '/bin/false'
+            jd.arguments  = None
+            failed = js.create_job (jd)
+
+            jd.executable = 'true'
+            jd.dependencies = [ok]
+            after_ok = js.create_job (jd)
+            jd.dependencies = [failed]
+            after_failed = js.create_job (jd)
+            jd.dependencies = {'afterany' : [failed]}
+            after_any = js.create_job (jd)
+
+            for j in [after_ok, after_failed, after_any, ok, failed] :
+                j.run ()
+            if after_ok.get_state() != saga.job.Job.Pending :
+                self.fail("Unexpected state: %s" % after_ok.get_state())
+
+            for j in [after_ok, after_failed, after_any] :
+                j.wait ()
+            if after_ok.get_state() != saga.job.Job.Done :
+                self.fail("Unexpected state: %s" % after_ok.get_state())
+            if ok.get_state() != saga.job.Job.Done :
+                self.fail("Dependent job started before its dependency finished")
+            if after_failed.get_state() != saga.job.Job.Canceled :
+                self.fail("Unexpected state: %s" % after_failed.get_state())
+            if after_any.get_state() != saga.job.Job.Done :
+                self.fail("Unexpected state: %s" % after_any.get_state())
+
+        except saga.Exception, e : 
+            self.fail(e)
+
     ###########################################################################
     #
     def test_spmd_variation(self) :
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+import bliss.saga as saga
+from bliss.utils.jobid import JobID
+from bliss.utils.command_wrapper import CommandWrapperResult
+from bliss.plugins.pbs.cmdlinewrapper import PBSService, PBSJobInfo, \
+  PBSQstatParser, PBSQstatXMLParser
+
+# 'qstat -t -f1': job 10 runs, 11 is held until 10 has finished, and
+# the two elements of array 12 have finished and are queued
+QSTAT_F1 = """Job Id: 10.server.cluster
+    Job_Name = prepare
+    Job_Owner = alice@login1.cluster
+    resources_used.cput = 00:00:29
+    resources_used.mem = 12288kb
+    resources_used.vmem = 123456kb
+    resources_used.walltime = 00:00:30
+    job_state = R
+    queue = batch
+    server = server.cluster
+    Checkpoint = u
+    ctime = Thu Oct 18 10:00:00 2012
+    Error_Path = login1.cluster:/home/alice/prepare.e10
+    exec_host = node1/1+node1/0
+    Hold_Types = n
+    Join_Path = n
+    Keep_Files = n
+    Mail_Points = a
+    mtime = Thu Oct 18 10:00:01 2012
+    Output_Path = login1.cluster:/home/alice/prepare.o10
+    Priority = 0
+    qtime = Thu Oct 18 10:00:00 2012
+    Rerunable = True
+    Resource_List.nodes = 1:ppn=2
+    Resource_List.walltime = 01:00:00
+    Variable_List = PBS_O_HOME=/home/alice,PBS_O_LOGNAME=alice,PBS_O_PATH=/usr/bin:/bin,PBS_O_QUEUE=batch,PBS_O_HOST=login1.cluster
+    etime = Thu Oct 18 10:00:00 2012
+    submit_args = /home/alice/.bliss/spool/1a2b3c4d/f00
+
+Job Id: 11.server.cluster
+    Job_Name = align
+    Job_Owner = alice@login1.cluster
+    job_state = H
+    queue = batch
+    server = server.cluster
+    depend = afterok:10.server.cluster
+    Error_Path = login1.cluster:/home/alice/align.e11
+    Output_Path = login1.cluster:/home/alice/align.o11
+    Resource_List.walltime = 00:10:00
+
+Job Id: 12[1].server.cluster
+    Job_Name = bliss_job-1
+    Job_Owner = alice@login1.cluster
+    resources_used.walltime = 00:00:05
+    job_state = C
+    queue = batch
+    exit_status = 137
+    Resource_List.walltime = 00:10:00
+    job_array_id = 1
+
+Job Id: 12[2].server.cluster
+    Job_Name = bliss_job-2
+    Job_Owner = alice@login1.cluster
+    job_state = Q
+    queue = batch
+    Resource_List.walltime = 00:10:00
+    job_array_id = 2
+
+"""
+
+# the same jobs as 'qstat -t -x'. (TORQUE prints it in one line; job 11
+# lists its limits before its resource usage.)
+QSTAT_X = "<Data>" \
+  "<Job><Job_Id>10.server.cluster</Job_Id><Job_Name>prepare</Job_Name>" \
+  "<Job_Owner>alice@login1.cluster</Job_Owner><resources_used><cput>00:00:29</cput>" \
+  "<mem>12288kb</mem><vmem>123456kb</vmem><walltime>00:00:30</walltime></resources_used>" \
+  "<job_state>R</job_state><queue>batch</queue><server>server.cluster</server>" \
+  "<Error_Path>login1.cluster:/home/alice/prepare.e10</Error_Path>" \
+  "<Output_Path>login1.cluster:/home/alice/prepare.o10</Output_Path>" \
+  "<Resource_List><nodes>1:ppn=2</nodes><walltime>01:00:00</walltime></Resource_List>" \
+  "<Variable_List>PBS_O_HOME=/home/alice,PBS_O_QUEUE=batch</Variable_List></Job>" \
+  "<Job><Job_Id>11.server.cluster</Job_Id><Job_Name>align</Job_Name>" \
+  "<job_state>H</job_state><queue>batch</queue>" \
+  "<Error_Path>login1.cluster:/home/alice/align.e11</Error_Path>" \
+  "<Output_Path>login1.cluster:/home/alice/align.o11</Output_Path>" \
+  "<Resource_List><walltime>00:10:00</walltime></Resource_List>" \
+  "<resources_used><walltime>00:00:00</walltime></resources_used></Job>" \
+  "<Job><Job_Id>12[1].server.cluster</Job_Id><Job_Name>bliss_job-1</Job_Name>" \
+  "<resources_used><walltime>00:00:05</walltime></resources_used>" \
+  "<job_state>C</job_state><queue>batch</queue><exit_status>137</exit_status>" \
+  "<Resource_List><walltime>00:10:00</walltime></Resource_List></Job>" \
+  "<Job><Job_Id>12[2].server.cluster</Job_Id><Job_Name>bliss_job-2</Job_Name>" \
+  "<job_state>Q</job_state><queue>batch</queue>" \
+  "<Resource_List><walltime>00:10:00</walltime></Resource_List></Job>" \
+  "</Data>\n"
+
+EXPECTED = [("10.server.cluster", "prepare", "R", "batch", None, "01:00:00",
+             "login1.cluster:/home/alice/prepare.o10",
+             "login1.cluster:/home/alice/prepare.e10"),
+            ("11.server.cluster", "align", "H", "batch", None, "00:10:00",
+             "login1.cluster:/home/alice/align.o11",
+             "login1.cluster:/home/alice/align.e11"),
+            ("12[1].server.cluster", "bliss_job-1", "C", "batch", "137",
+             "00:10:00", None, None),
+            ("12[2].server.cluster", "bliss_job-2", "Q", "batch", None,
+             "00:10:00", None, None)]
+
+###############################################################################
+#
+class _FakeWrapper(object):
+    """
+    Answers every qstat with 'document' (and an error for the job that
+    has left the queue), and the status marker commands with 'markers'
+    """
+    def __init__(self, document, markers):
+        self.document = document
+        self.markers = markers
+        self.commands = list()
+
+    def run_many(self, commands):
+        self.commands.append(commands)
+        results = list()
+        for command in commands:
+            if command.startswith("qstat"):
+                results.append(CommandWrapperResult(command=command,
+                  stdout=self.document, returncode=153,
+                  stderr="qstat: Unknown Job Id 13.server.cluster"))
+            else:
+                results.append(CommandWrapperResult(command=command,
+                  stdout=self.markers, stderr="", returncode=0))
+        return results
+
+class _FakePlugin(object):
+    def __getattr__(self, name):
+        return lambda *args: None
+
+class _FakeServiceObject(object):
+    def __init__(self, url):
+        self._url = saga.Url(url)
+
+###############################################################################
+#
+class PBSQstatParserTests(unittest.TestCase):
+    """
+    Tests for the PBS qstat -f1 and qstat -x parsers
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        pass
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def parse(self, parser, document, chunk_size):
+        for i in range(0, len(document), chunk_size):
+            parser.feed(document[i:i+chunk_size])
+        return [(r.jobid, r.name, r._job_state, r.queue, r.exitcode,
+                 r.walltime_limit, r.output_path, r.error_path) \
+                for r in parser.close()]
+
+    ###########################################################################
+    #
+    def test_qstat_f1(self):
+        """
+        Test that 'qstat -f1' is parsed the same, no matter how it is
+        split into chunks
+        """
+        for chunk_size in [1, 7, 4096]:
+            self.assertEqual(self.parse(PBSQstatParser(), QSTAT_F1, chunk_size),
+                             EXPECTED)
+        self.assertEqual(self.parse(PBSQstatParser(), "", 1), [])
+        # (without the blank line at the end)
+        self.assertEqual(self.parse(PBSQstatParser(), QSTAT_F1.rstrip(), 5)[-1],
+                         EXPECTED[-1])
+
+    ###########################################################################
+    #
+    def test_qstat_x(self):
+        """
+        Test that 'qstat -x' is parsed the same, no matter how it is
+        split into chunks, and that only the walltime limit is taken
+        """
+        for chunk_size in [1, 7, 4096]:
+            self.assertEqual(self.parse(PBSQstatXMLParser(), QSTAT_X, chunk_size),
+                             EXPECTED)
+        # qstat prints nothing at all if there are no jobs
+        self.assertEqual(self.parse(PBSQstatXMLParser(), "", 1), [])
+        self.assertEqual(self.parse(PBSQstatXMLParser(), "\n", 1), [])
+
+    ###########################################################################
+    #
+    def test_jobinfo(self):
+        """
+        Test that a PBSJobInfo can be built from 'qstat -f1' output
+        """
+        jobinfo = PBSJobInfo(QSTAT_F1, None)
+        self.assertEqual((jobinfo.jobid, jobinfo.state, jobinfo.queue),
+                         ("10.server.cluster", saga.job.Job.Running, "batch"))
+        self.assertRaises(Exception, PBSJobInfo, "qstat: Unknown Job Id", None)
+
+    ###########################################################################
+    #
+    def test_missing_jobs(self):
+        """
+        Test that a known job that is missing from qstat counts as done
+        (with the exit code from its status marker), and that an unknown
+        one stays unknown
+        """
+        for (qstat_format, document) in [("text", QSTAT_F1), ("xml", QSTAT_X)]:
+            service = PBSService(_FakePlugin(), _FakeServiceObject(
+              "pbs://localhost?qstat_format=%s" % qstat_format))
+            self.assertEqual(service._qstat_format, qstat_format)
+            service._cw = _FakeWrapper(document, "13.server.cluster:end 1350554431 2\n")
+            service._accounting = None
+            # (as left by a submission)
+            for native_id in ["10.server.cluster", "11.server.cluster",
+                              "12[2].server.cluster", "13.server.cluster"]:
+                jobinfo = PBSJobInfo("", None)
+                jobinfo._jobid = native_id
+                jobinfo._job_state = "Q"
+                service._known_jobs_update(native_id, jobinfo)
+
+            jobids = [JobID(service._url, native_id) for native_id in \
+                      ["10.server.cluster", "11", "12[1].server.cluster",
+                       "12[2].server.cluster", "13.server.cluster",
+                       "14.server.cluster"]]
+            jobinfos = service.get_jobinfo_bulk(jobids)
+            self.assertEqual([(ji.jobid, ji.state, ji.exitcode) for ji in jobinfos],
+              [("10.server.cluster", saga.job.Job.Running, None),
+               ("11.server.cluster", saga.job.Job.Pending, None),
+               ("12[1].server.cluster", saga.job.Job.Done, "137"),
+               ("12[2].server.cluster", saga.job.Job.Pending, None),
+               ("13.server.cluster", saga.job.Job.Done, "2"),
+               ("14.server.cluster", saga.job.Job.Unknown, None)])
+            # everything in one round trip: the jobs, the array and the
+            # status markers
+            self.assertEqual(len(service._cw.commands), 1)
+            self.assertEqual([c.split()[:2] for c in service._cw.commands[0] \
+                              if c.startswith("qstat")],
+                             [["qstat", service._qstat_flags()[0]], ["qstat", "-t"]])
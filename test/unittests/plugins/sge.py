@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+import bliss.saga as saga
+from bliss.utils.jobid import JobID
+from bliss.utils.command_wrapper import CommandWrapperResult
+from bliss.plugins.sge.cmdlinewrapper import SGEService, SGEJobInfo, SGEQstatParser, \
+  sge_to_saga_jobstate, sge_task_ids, sge_task_ranges, parse_qacct, \
+  parse_sge_accounting
+
+# 'qstat -xml -u alice': job 10 runs, 11 is held until its dependencies
+# have finished, 12 is an array with one running and three waiting tasks,
+# 13 has failed to start
+QSTAT_XML = """<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout*/gridengine/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=1.11">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>10</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>prepare</JB_name>
+      <JB_owner>alice</JB_owner>
+      <state>r</state>
+      <JAT_start_time>2012-10-18T10:00:01</JAT_start_time>
+      <queue_name>all.q@node1.cluster</queue_name>
+      <slots>12</slots>
+    </job_list>
+    <job_list state="running">
+      <JB_job_number>12</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>bliss_job</JB_name>
+      <JB_owner>alice</JB_owner>
+      <state>r</state>
+      <JAT_start_time>2012-10-18T10:00:05</JAT_start_time>
+      <queue_name>all.q@node2.cluster</queue_name>
+      <slots>12</slots>
+      <tasks>3</tasks>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>11</JB_job_number>
+      <JAT_prio>0.00000</JAT_prio>
+      <JB_name>align</JB_name>
+      <JB_owner>alice</JB_owner>
+      <state>hqw</state>
+      <JB_submission_time>2012-10-18T10:00:00</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>12</slots>
+    </job_list>
+    <job_list state="pending">
+      <JB_job_number>12</JB_job_number>
+      <JAT_prio>0.00000</JAT_prio>
+      <JB_name>bliss_job</JB_name>
+      <JB_owner>alice</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2012-10-18T10:00:02</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>12</slots>
+      <tasks>4-8:2</tasks>
+    </job_list>
+    <job_list state="pending">
+      <JB_job_number>13</JB_job_number>
+      <JAT_prio>0.00000</JAT_prio>
+      <JB_name>broken &amp; &lt;odd&gt;</JB_name>
+      <JB_owner>alice</JB_owner>
+      <state>Eqw</state>
+      <JB_submission_time>2012-10-18T10:00:03</JB_submission_time>
+      <queue_name/>
+      <slots>1</slots>
+    </job_list>
+  </job_info>
+</job_info>
+"""
+
+# 'qstat -xml -j 11'
+QSTAT_XML_J = """<?xml version='1.0'?>
+<detailed_job_info  xmlns:xsd="http://gridengine.sunsource.net/source/browse/*checkout*/gridengine/source/dist/util/resources/schemas/qstat/detailed_job_info.xsd?revision=1.1">
+  <djob_info>
+    <element>
+      <JB_job_number>11</JB_job_number>
+      <JB_ar>0</JB_ar>
+      <JB_exec_file>job_scripts/11</JB_exec_file>
+      <JB_job_name>align</JB_job_name>
+      <JB_owner>alice</JB_owner>
+      <JB_env_list>
+        <element>
+          <VA_variable>__SGE_PREFIX__O_HOME</VA_variable>
+          <VA_value>/home/alice</VA_value>
+        </element>
+      </JB_env_list>
+      <JB_stdout_path_list>
+        <path_list>
+          <PN_path>/home/alice/align.out</PN_path>
+          <PN_host></PN_host>
+          <PN_file_host></PN_file_host>
+          <PN_file_staging>false</PN_file_staging>
+        </path_list>
+      </JB_stdout_path_list>
+      <JB_stderr_path_list>
+        <path_list>
+          <PN_path>/home/alice/align.err</PN_path>
+          <PN_host></PN_host>
+          <PN_file_host></PN_file_host>
+          <PN_file_staging>false</PN_file_staging>
+        </path_list>
+      </JB_stderr_path_list>
+      <JB_hard_queue_list>
+        <destin_ident_list>
+          <QR_name>all.q</QR_name>
+        </destin_ident_list>
+      </JB_hard_queue_list>
+      <JB_jid_predecessor_list>
+        <job_predecessors>
+          <JRE_job_number>10</JRE_job_number>
+        </job_predecessors>
+      </JB_jid_predecessor_list>
+    </element>
+  </djob_info>
+</detailed_job_info>
+"""
+
+# 'qacct -j': job 10 has finished, task 5 of array 12 was killed
+QACCT = """==============================================================
+qname        all.q               
+hostname     node1.cluster       
+group        users               
+owner        alice               
+project      NONE                
+department   defaultdepartment   
+jobname      prepare             
+jobnumber    10                  
+taskid       undefined
+account      sge                 
+priority     0                   
+qsub_time    Thu Oct 18 10:00:00 2012
+start_time   Thu Oct 18 10:00:01 2012
+end_time     Thu Oct 18 10:00:31 2012
+granted_pe   12way               
+slots        12                  
+failed       0    
+exit_status  0                   
+ru_wallclock 30           
+cpu          29.010       
+maxvmem      12.000M
+arid         undefined
+==============================================================
+qname        all.q               
+hostname     node2.cluster       
+group        users               
+owner        alice               
+jobname      bliss_job           
+jobnumber    12                  
+taskid       5                   
+failed       100 : assumedly after job
+exit_status  137                 
+ru_wallclock 5s
+maxvmem      1.500G
+==============================================================
+jobnumber    14                  
+taskid       undefined
+failed       0    
+"""
+
+###############################################################################
+#
+class _FakeStream(object):
+    """
+    Hands out a document in small chunks, like CommandWrapperStream
+    """
+    def __init__(self, document, chunk_size=7):
+        self.document = document
+        self.chunk_size = chunk_size
+        self.returncode = 0
+        self.stderr = ""
+
+    def chunks(self):
+        for i in range(0, len(self.document), self.chunk_size):
+            yield self.document[i:i+self.chunk_size]
+
+    def close(self):
+        pass
+
+class _FakeWrapper(object):
+    """
+    Answers qstat with QSTAT_XML, and the status marker and accounting
+    commands with 'markers'
+    """
+    def __init__(self, markers):
+        self.markers = markers
+        self.commands = list()
+
+    def run_stream(self, command):
+        self.commands.append(command)
+        return _FakeStream(QSTAT_XML)
+
+    def run_many(self, commands):
+        self.commands.extend(commands)
+        results = [CommandWrapperResult(command=command, stdout="", stderr="",
+                                        returncode=0) for command in commands]
+        results[0].stdout = self.markers
+        return results
+
+class _FakePlugin(object):
+    def __getattr__(self, name):
+        return lambda *args: None
+
+class _FakeServiceObject(object):
+    def __init__(self, url):
+        self._url = saga.Url(url)
+
+###############################################################################
+#
+class SGEQstatParserTests(unittest.TestCase):
+    """
+    Tests for the SGE qstat -xml parser, task ids and accounting
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        pass
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def parse(self, document, chunk_size):
+        parser = SGEQstatParser()
+        for chunk in _FakeStream(document, chunk_size).chunks():
+            parser.feed(chunk)
+        return parser.close()
+
+    ###########################################################################
+    #
+    def test_qstat_xml(self):
+        """
+        Test that 'qstat -xml' is parsed the same, no matter how it is
+        split into chunks
+        """
+        for chunk_size in [1, 7, 4096]:
+            records = self.parse(QSTAT_XML, chunk_size)
+            self.assertEqual([(r.jobid, r.name, r.owner, r.state, r.queue, r.tasks) \
+                              for r in records],
+              [("10", "prepare", "alice", "r", "all.q", None),
+               ("12", "bliss_job", "alice", "r", "all.q", "3"),
+               ("11", "align", "alice", "hqw", None, None),
+               ("12", "bliss_job", "alice", "qw", None, "4-8:2"),
+               ("13", "broken & <odd>", "alice", "Eqw", None, None)])
+
+    ###########################################################################
+    #
+    def test_qstat_xml_j(self):
+        """
+        Test that 'qstat -xml -j' yields the queue and paths, and that
+        nested elements aren't taken for jobs
+        """
+        records = self.parse(QSTAT_XML_J, 5)
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual((record.jobid, record.name, record.queue),
+                         ("11", "align", "all.q"))
+        self.assertEqual((record.output, record.error),
+                         ("/home/alice/align.out", "/home/alice/align.err"))
+
+    ###########################################################################
+    #
+    def test_states(self):
+        """
+        Test that held, re-run and error states map to SAGA states
+        """
+        for (state, expected) in [("qw", saga.job.Job.Pending),
+                                  ("hqw", saga.job.Job.Pending),
+                                  ("Rq", saga.job.Job.Pending),
+                                  ("r", saga.job.Job.Running),
+                                  ("hr", saga.job.Job.Running),
+                                  ("Rr", saga.job.Job.Running),
+                                  ("dr", saga.job.Job.Running),
+                                  ("t", saga.job.Job.Running),
+                                  ("Eqw", saga.job.Job.Failed),
+                                  ("c", saga.job.Job.Done),
+                                  ("X", saga.job.Job.Canceled),
+                                  ("F", saga.job.Job.Failed),
+                                  (None, saga.job.Job.Unknown)]:
+            self.assertEqual((state, sge_to_saga_jobstate(state)), (state, expected))
+
+    ###########################################################################
+    #
+    def test_task_ids(self):
+        """
+        Test the expansion and compression of array task ids
+        """
+        self.assertEqual(sge_task_ids("1-9:2,12"), [1, 3, 5, 7, 9, 12])
+        self.assertEqual(sge_task_ids("4-6"), [4, 5, 6])
+        self.assertEqual(sge_task_ids("3"), [3])
+        self.assertEqual(sge_task_ids(""), [])
+        self.assertEqual(sge_task_ids("x,2"), [2])
+        self.assertEqual(sge_task_ranges([7, 1, 2, 3, 9, 10]), ["1-3", "7", "9-10"])
+        self.assertEqual(sge_task_ranges([5]), ["5"])
+        self.assertEqual(sge_task_ranges([]), [])
+
+    ###########################################################################
+    #
+    def test_qacct(self):
+        """
+        Test that 'qacct -j' blocks are parsed, and incomplete ones skipped
+        """
+        records = parse_qacct(QACCT)
+        self.assertEqual(sorted(records.keys()), ["10", "12.5"])
+        self.assertEqual(records["10"], {'failed': 0, 'exit_status': 0,
+          'ru_wallclock': 30.0, 'maxvmem': 12.0 * 1024**2})
+        self.assertEqual(records["12.5"], {'failed': 100, 'exit_status': 137,
+          'ru_wallclock': 5.0, 'maxvmem': 1.5 * 1024**3})
+
+    ###########################################################################
+    #
+    def test_accounting_file(self):
+        """
+        Test that accounting file lines are parsed, and comments and
+        incomplete lines skipped
+        """
+        def line(job_number, task_number, failed, exit_status, maxvmem):
+            fields = ["all.q", "node1", "users", "alice", "bliss_job",
+                      job_number, "sge", "0", "1350554400", "1350554401",
+                      "1350554431", failed, exit_status, "30"] + ["0"] * 17 + \
+                     ["NONE", "defaultdepartment", "NONE", "1", task_number,
+                      "29.01", "1.5", "0.0", "-U alice", "0.0", "NONE", maxvmem,
+                      "0", "0"]
+            return ":".join(fields)
+        lines = ["# Version: 6.2u5",
+                 line("10", "0", "0", "0", "12582912.0")[20:],
+                 line("11", "0", "0", "2", "1024.0"),
+                 line("12", "5", "100", "137", "2048.0"),
+                 line("13", "0", "x", "0", "0.0"),
+                 line("14", "0", "0", "0", "0.0")[:60]]
+        records = parse_sge_accounting(lines)
+        self.assertEqual(sorted(records.keys()), ["11", "12.5"])
+        self.assertEqual(records["11"], {'failed': 0, 'exit_status': 2,
+          'ru_wallclock': 30.0, 'maxvmem': 1024.0})
+        self.assertEqual(records["12.5"]['failed'], 100)
+
+    ###########################################################################
+    #
+    def test_missing_jobs(self):
+        """
+        Test that a known job that is missing from qstat counts as done
+        (with the exit code from its status marker), and that an unknown
+        one stays unknown
+        """
+        service = SGEService(_FakePlugin(), _FakeServiceObject("sge://localhost"))
+        service._cw = _FakeWrapper("15:end 1350554431 2\n")
+        service._accounting = None
+        # (as left by a submission)
+        for native_id in ["10", "11", "12.4", "15"]:
+            jobinfo = SGEJobInfo(None, None)
+            jobinfo._jobid = native_id
+            jobinfo._job_state = "qw"
+            service._known_jobs_update(native_id, jobinfo)
+
+        jobids = [JobID(service._url, native_id) \
+                  for native_id in ["10", "11", "12.3", "12.4", "13", "15", "16"]]
+        jobinfos = service.get_jobinfo_bulk(jobids)
+        self.assertEqual([(ji.jobid, ji.state, ji.exitcode) for ji in jobinfos],
+          [("10", saga.job.Job.Running, None),
+           ("11", saga.job.Job.Pending, None),
+           ("12.3", saga.job.Job.Running, None),
+           ("12.4", saga.job.Job.Pending, None),
+           ("13", saga.job.Job.Failed, None),
+           ("15", saga.job.Job.Done, 2),
+           ("16", saga.job.Job.Unknown, None)])
+        self.assertEqual(jobinfos[0].queue, "all.q")
+        # one qstat for all jobs, and one round trip for the marker of
+        # the job that has left the queue
+        self.assertEqual(len([c for c in service._cw.commands if c.startswith("qstat")]), 1)
+        self.assertEqual(len(service._cw.commands), 2)
@@ -0,0 +1,8 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2011-2012, Ole Christian Weidner"
+__license__   = "MIT"
+
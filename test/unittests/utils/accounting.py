@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import getpass
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from bliss.utils.accounting import AccountingTail
+
+###############################################################################
+#
+class AccountingTailTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.accounting.AccountingTail
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "accounting")
+        self.user = getpass.getuser()
+        self.tail = AccountingTail(":", "$2 == u", fallback="echo qacct")
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def append(self, path, data):
+        f = open(path, "a")
+        f.write(data)
+        f.close()
+
+    def read(self, path_expr=None):
+        if path_expr is None:
+            path_expr = "'%s'" % self.path
+        shell = subprocess.Popen(["/bin/sh", "-c", self.tail.command(path_expr)],
+                                 stdout=subprocess.PIPE)
+        return self.tail.feed(shell.communicate()[0])
+
+    ###########################################################################
+    #
+    def test_partial_last_line(self):
+        """
+        Test that a partial last line is held back until it is complete
+        """
+        self.append(self.path, "1:%s:0\n2:nobody:0\n3:%s:1" % (self.user, self.user))
+        self.assertEqual(self.read(), (["1:%s:0" % self.user], None))
+        self.assertEqual(self.read(), ([], None))
+
+        self.append(self.path, "37\n4:%s:" % self.user)
+        self.assertEqual(self.read(), (["3:%s:137" % self.user], None))
+
+        self.append(self.path, "0\n")
+        self.assertEqual(self.read(), (["4:%s:0" % self.user], None))
+
+    ###########################################################################
+    #
+    def test_feed(self):
+        """
+        Test that feed() only moves the offset on when the read count
+        has arrived
+        """
+        output = "BLISS-ACCT-FILE 10 /var/acct\n" \
+                 "1:u:0\n" \
+                 "2:u:0\n"
+        # no READ line (e.g., the output was cut off): nothing is consumed
+        self.assertEqual(self.tail.feed(output), (["1:u:0", "2:u:0"], None))
+        self.assertEqual(self.tail._offset, None)
+
+        self.assertEqual(self.tail.feed(output + "BLISS-ACCT-READ 12\n"),
+                         (["1:u:0", "2:u:0"], None))
+        self.assertEqual((self.tail._path, self.tail._offset), ("/var/acct", 22))
+
+        self.assertEqual(self.tail.feed("BLISS-ACCT-FALLBACK\nqacct\noutput"),
+                         ([], "qacct\noutput"))
+        self.assertEqual(self.tail.feed(""), None)
+
+    ###########################################################################
+    #
+    def test_rotation(self):
+        """
+        Test that the rest of the previous file is read before the new one,
+        and that the fallback runs if no file is readable
+        """
+        old = os.path.join(self.dir, "old")
+        new = os.path.join(self.dir, "new")
+        self.append(old, "1:%s:0\n" % self.user)
+        self.assertEqual(self.read("'%s'" % old), (["1:%s:0" % self.user], None))
+
+        self.append(old, "2:%s:0\n" % self.user)
+        self.append(new, "3:%s:0\n" % self.user)
+        self.assertEqual(self.read("'%s'" % new),
+                         (["2:%s:0" % self.user, "3:%s:0" % self.user], None))
+        self.assertEqual(self.tail._path, new)
+
+        os.remove(old)
+        os.remove(new)
+        self.assertEqual(self.read("'%s'" % new), ([], "qacct\n"))
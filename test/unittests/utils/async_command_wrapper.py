@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import threading
+import unittest
+
+from bliss.utils.reactor import Reactor
+from bliss.utils.async_command_wrapper import AsyncCommandWrapper
+
+###############################################################################
+#
+class AsyncCommandWrapperTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.async_command_wrapper.AsyncCommandWrapper
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.reactor = Reactor()
+        self.cw = AsyncCommandWrapper.initAsLocalWrapper(self.reactor,
+                                                         channels=2)
+        self.cw.connect().result(10)
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        self.cw.disconnect()
+        self.reactor.run_once(0)
+
+    ###########################################################################
+    #
+    def test_run(self):
+        """
+        Test run() and run_many()
+        """
+        result = self.cw.run("echo", ["out;", "echo err >&2;", "false"]).result(10)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout.strip(), "out")
+        self.assertEqual(result.stderr.strip(), "err")
+
+        futures = self.cw.run_many(["echo %s" % i for i in range(0, 20)])
+        self.assertEqual([f.result(10).stdout.strip() for f in futures],
+                         [str(i) for i in range(0, 20)])
+
+    ###########################################################################
+    #
+    def test_threads(self):
+        """
+        Test that several threads can drive the reactor at the same time
+        """
+        errors = list()
+        def worker(n):
+            try:
+                for i in range(0, 50):
+                    result = self.cw.run("echo %s-%s" % (n, i)).result(30)
+                    if result.stdout.strip() != "%s-%s" % (n, i):
+                        errors.append("%s-%s: %r" % (n, i, result.stdout))
+            except Exception, ex:
+                errors.append("%s: %s" % (n, ex))
+        start = time.time()
+        threads = [threading.Thread(target=worker, args=(n,)) \
+                   for n in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # (no thread waits in select() for a future that another one
+        # has resolved)
+        self.assertTrue(time.time() - start < 20,
+          "Commands took %.1fs" % (time.time() - start))
+
+        # the same with the reactor running in the background
+        self.reactor.start()
+        try:
+            threads = [threading.Thread(target=worker, args=(n,)) \
+                       for n in range(0, 8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.reactor.stop()
+        self.assertEqual(errors, [])
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import pipes
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from bliss.utils.bulksubmit import submit_command, parse_results, \
+  stage_array, array_command, new_tag, BulkSubmitException
+
+###############################################################################
+#
+class BulkSubmitTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.bulksubmit
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.home = tempfile.mkdtemp()
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def run_sh(self, command, env={}):
+        environ = dict(os.environ)
+        environ['HOME'] = self.home
+        environ.update(env)
+        shell = subprocess.Popen(["/bin/sh", "-c", command], env=environ,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = shell.communicate()
+        return (shell.returncode, out)
+
+    ###########################################################################
+    #
+    def test_parse_results(self):
+        """
+        Test that the results are parsed in order, and that missing ones
+        raise BulkSubmitException
+        """
+        output = "noise\n" \
+                 "BLISS-SUBMIT-0000abcd 0 17.server \n" \
+                 "BLISS-SUBMIT-ffffffff 0 99.server\n" \
+                 "BLISS-SUBMIT-0000abcd 1 qsub: illegal option\n" \
+                 "BLISS-SUBMIT-0000abcd 0\n"
+        self.assertEqual(parse_results(output, "0000abcd", 3),
+                         [(0, "17.server"), (1, "qsub: illegal option"), (0, "")])
+        self.assertEqual(parse_results(output, "0000abcd", 2),
+                         [(0, "17.server"), (1, "qsub: illegal option")])
+        self.assertRaises(BulkSubmitException, parse_results, output, "0000abcd", 4)
+        self.assertRaises(BulkSubmitException, parse_results, output, "12345678", 1)
+
+    ###########################################################################
+    #
+    def test_submit_command(self):
+        """
+        Test that the scripts are uploaded intact and submitted in order
+        """
+        tag = new_tag()
+        scripts = ["#!/bin/sh\necho 'one'\n",
+                   "#!/bin/sh\necho \"$HOME\" BLISS-EOF-%s\n" % tag,
+                   "#!/bin/sh\necho 'one'\n"]
+        (rc, out) = self.run_sh(submit_command("cat", scripts, tag, ".bliss/spool"))
+        self.assertEqual(rc, 0)
+        self.assertEqual(parse_results(out, tag, 3),
+                         [(0, "#!/bin/sh echo 'one'"),
+                          (0, "#!/bin/sh echo \"$HOME\" BLISS-EOF-%s" % tag),
+                          (0, "#!/bin/sh echo 'one'")])
+        # the spool directory is gone again
+        self.assertEqual(os.listdir(os.path.join(self.home, ".bliss", "spool")), [])
+
+        (rc, out) = self.run_sh(submit_command("false", scripts[:1], tag, ".bliss/spool"))
+        self.assertEqual(parse_results(out, tag, 1), [(1, "")])
+
+    ###########################################################################
+    #
+    def test_array(self):
+        """
+        Test that array elements run their own command line, and that
+        the last one removes the array directory
+        """
+        command_lines = ["echo first", "echo 'it''s second'", "exit 3"]
+        (array_dir, commands) = stage_array(command_lines, ".bliss/arrays",
+                                            20, pipes.quote, max_age=30)
+        self.assertTrue(len(commands) > 3)
+        (rc, out) = self.run_sh("\n".join(commands))
+        self.assertEqual(rc, 0)
+
+        script = array_command(array_dir, "$ELEMENT", len(command_lines))
+        results = [self.run_sh(script, {'ELEMENT': str(element)}) \
+                   for element in [2, 3, 1]]
+        self.assertEqual(results, [(0, "its second\n"), (3, ""), (0, "first\n")])
+        self.assertEqual(os.listdir(os.path.join(self.home, ".bliss", "arrays")), [])
+
+        (array_dir, commands) = stage_array(command_lines, ".bliss/arrays",
+                                            1024, pipes.quote)
+        self.run_sh("\n".join(commands))
+        script = array_command(array_dir, "$ELEMENT - 1", len(command_lines),
+                               wrap=lambda command: "true && %s" % command)
+        self.assertEqual(self.run_sh(script, {'ELEMENT': "2"}), (0, "first\n"))
+        self.assertEqual(len(os.listdir(os.path.join(self.home, ".bliss", "arrays"))), 1)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+from bliss.utils.reactor import Reactor
+from bliss.utils.command_wrapper import CommandWrapper
+from bliss.utils.async_command_wrapper import AsyncCommandWrapper
+
+###############################################################################
+#
+class CommandWrapperTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.command_wrapper.CommandWrapper (local)
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.wrappers = [CommandWrapper.initAsLocalWrapper(None),
+                         CommandWrapper.initAsLocalWrapper(None, persistent=True)]
+        for cw in self.wrappers:
+            cw.connect()
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        for cw in self.wrappers:
+            cw.disconnect()
+
+    ###########################################################################
+    #
+    def test_output(self):
+        """
+        Test that all ways of running a command return the same output
+        """
+        commands = ["printf 'a\\n\\n'", "printf 'a'", "echo a; echo b >&2; false"]
+        expected = [("a\n", "", 0), ("a", "", 0), ("a", "b\n", 1)]
+
+        for cw in self.wrappers:
+            results = [cw.run(c) for c in commands] + cw.run_many(commands) \
+                    + [cw.run_stream(c).result() for c in commands]
+            self.assertEqual([(r.stdout, r.stderr, r.returncode) for r in results],
+                             expected * 3)
+
+        reactor = Reactor()
+        acw = AsyncCommandWrapper.initAsLocalWrapper(reactor)
+        acw.connect().result(10)
+        try:
+            results = [f.result(10) for f in acw.run_many(commands)]
+            self.assertEqual([(r.stdout, r.stderr, r.returncode) for r in results],
+                             expected)
+        finally:
+            acw.disconnect()
+            reactor.run_once(0)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+from bliss.utils.command_wrapper import CommandWrapper
+from bliss.utils.connectionpool import CommandWrapperPool, PooledCommandWrapper
+
+###############################################################################
+#
+class _FakeWrapper(object):
+    """
+    A CommandWrapper look-alike that runs commands by calling them
+    """
+    def __init__(self, key='fake'):
+        self.key = key
+        self.connected = False
+    def clone(self):
+        return _FakeWrapper(self.key)
+    def pool_key(self):
+        return self.key
+    def connect(self):
+        self.connected = True
+    def disconnect(self):
+        self.connected = False
+    def run(self, executable, arguments=[]):
+        return executable(*arguments)
+    def run_many(self, commands):
+        return [c() for c in commands]
+
+class _Result(object):
+    def __init__(self, returncode):
+        self.returncode = returncode
+
+###############################################################################
+#
+class CommandWrapperPoolTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.connectionpool.CommandWrapperPool
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.pool = CommandWrapperPool(max_per_host=2, min_idle=0,
+                                       idle_timeout=300, keepalive_interval=-1)
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        self.pool.shutdown()
+
+    ###########################################################################
+    #
+    def test_release_on_error(self):
+        """
+        Test that a lease is given back whatever a command raises
+        """
+        pcw = PooledCommandWrapper(_FakeWrapper(), self.pool)
+        pcw.connect()
+        def interrupt():
+            raise KeyboardInterrupt()
+        for i in range(0, 3):
+            self.assertRaises(KeyboardInterrupt, pcw.run, interrupt)
+            self.assertRaises(KeyboardInterrupt, pcw.run_many, [interrupt])
+        self.assertEqual(self.pool.stats()['busy'], 0)
+        self.assertEqual(self.pool.stats()['sessions'], {'fake': 0})
+
+        # all sessions are still available
+        cws = [self.pool.lease(_FakeWrapper(), timeout=1) for i in range(0, 2)]
+        for cw in cws:
+            self.pool.release(cw)
+
+    ###########################################################################
+    #
+    def test_maintain_limit(self):
+        """
+        Test that keep-alive checks don't push the pool beyond max_per_host
+        """
+        prototype = _FakeWrapper()
+        cws = [self.pool.lease(prototype) for i in range(0, 2)]
+        for cw in cws:
+            self.pool.release(cw)
+
+        # a lease while the sessions are being checked
+        leased = list()
+        def check(*args):
+            try:
+                leased.append(self.pool.lease(prototype, timeout=0.1))
+            except Exception:
+                pass # all sessions are taken
+        for cw in cws:
+            cw.run = lambda executable, arguments=[]: \
+              (check(), _Result(0))[1]
+        self.pool.maintain()
+        self.assertEqual(self.pool.stats()['sessions'], {'fake': 2})
+        for cw in leased:
+            self.pool.release(cw)
+
+    ###########################################################################
+    #
+    def test_pool_key(self):
+        """
+        Test that connections with different credentials aren't shared
+        """
+        a = CommandWrapper.initAsSSHWrapper(None, "host", username="user",
+                                            userkey="/keys/a")
+        b = CommandWrapper.initAsSSHWrapper(None, "host", username="user",
+                                            userkey="/keys/b")
+        self.assertNotEqual(a.pool_key(), b.pool_key())
+        self.assertEqual(a.pool_key(), a.clone().pool_key())
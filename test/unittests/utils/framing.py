@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+from bliss.utils import framing
+
+###############################################################################
+#
+class FrameReaderTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.framing.FrameReader and friends
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.tag = "0123abcd"
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def response(self, stdout, stderr, exitcode, newline="\n"):
+        # what the shell prints for a framed command
+        data = "%s-%s\n%s\n%s-%s\n%s\n%s-%s:%s\n" % (framing.BEGIN, self.tag,
+          stdout, framing.STDERR, self.tag, stderr, framing.END, self.tag, exitcode)
+        return data.replace("\n", newline)
+
+    def reader(self, data, size, initial=''):
+        # a reader that gets 'data' in chunks of 'size' bytes
+        self.unread = [data[i:i+size] for i in range(0, len(data), size)]
+        def read():
+            if not self.unread:
+                raise EOFError("no more data")
+            return self.unread.pop(0)
+        return framing.FrameReader(read, self.tag, initial)
+
+    ###########################################################################
+    #
+    def test_chunk_boundaries(self):
+        """
+        Test that the output doesn't depend on how it's split into chunks
+        """
+        stdout = "\n".join(["line %s" % i for i in range(0, 200)]) + "\n"
+        data = "garbage before the frame\n" + self.response(stdout, "err", 3) \
+             + "next command"
+        for size in [1, 2, 3, 7, 16, 17, 64, 4096]:
+            reader = self.reader(data, size)
+            self.assertEqual("".join(reader.chunks()), stdout)
+            self.assertEqual(reader.stderr, "err")
+            self.assertEqual(reader.exitcode, 3)
+            # (whatever has been read beyond the frame is left over)
+            self.assertEqual(reader.remainder + "".join(self.unread),
+                             "next command")
+            self.assertTrue(reader.done())
+
+    ###########################################################################
+    #
+    def test_crlf(self):
+        """
+        Test that CRLF line ends (from a terminal) are turned into LF, even
+        if '\\r' and '\\n' end up in different chunks
+        """
+        stdout = "a\nb\rc\nd\n"
+        data = self.response(stdout, "e", 0, newline="\r\n")
+        for size in [1, 2, 3, 5, 4096]:
+            reader = self.reader(data, size)
+            self.assertEqual("".join(reader.chunks()), "a\nb\rc\nd\n")
+            self.assertEqual(reader.stderr, "e")
+            self.assertEqual(reader.exitcode, 0)
+
+        # (a '\r' at the end of a chunk isn't swallowed)
+        reader = self.reader(self.response("x", "", 0) + "\r", 4096)
+        reader.drain()
+        self.assertEqual(reader.remainder, "\r")
+
+    ###########################################################################
+    #
+    def test_initial(self):
+        """
+        Test that data that was read before is taken into account
+        """
+        data = self.response("out", "", 0)
+        reader = self.reader(data[20:], 4, initial=data[:20])
+        self.assertEqual("".join(reader.chunks()), "out")
+
+        # output without a trailing newline
+        reader = self.reader(data, 5)
+        self.assertEqual(list(framing.iter_lines(reader.chunks())), ["out"])
+
+    ###########################################################################
+    #
+    def test_errors(self):
+        """
+        Test incomplete and invalid responses
+        """
+        data = self.response("out", "", 0)
+        reader = self.reader(data[:-10], 4)
+        self.assertRaises(EOFError, reader.drain)
+        self.assertFalse(reader.done())
+
+        reader = self.reader(data.replace(":0\n", ":x\n"), 4)
+        self.assertRaises(framing.FramingException, reader.drain)
+
+        self.assertRaises(framing.FramingException, framing.parse_frame,
+                          data[:-10], self.tag)
+
+    ###########################################################################
+    #
+    def test_parse_frames(self):
+        """
+        Test parse_frame() and parse_frames()
+        """
+        first = self.response("a\n", "", 0, newline="\r\n")
+        self.assertEqual(framing.parse_frame(first, self.tag), ("a\n", "", 0))
+
+        tags = ["1", "2"]
+        data = ""
+        for (tag, stdout, exitcode) in [("1", "x", 0), ("2", "y\ny", 1)]:
+            self.tag = tag
+            data += self.response(stdout, "", exitcode)
+        self.assertEqual(framing.parse_frames(data, tags),
+                         [("x", "", 0), ("y\ny", "", 1)])
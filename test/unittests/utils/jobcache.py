@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+import bliss.saga as saga
+from bliss.utils.jobcache import JobCache, JobCacheException, get_job_cache_size
+
+###############################################################################
+#
+class JobCacheTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.jobcache.JobCache
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.evicted = list()
+        self.cache = JobCache(3, is_final=lambda info: info['state'] == "Done",
+                              compact=lambda info: ("tombstone", info['id']),
+                              on_evict=self.evicted.append)
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def info(self, jobid, state):
+        return {'id': jobid, 'state': state, 'details': "x" * 100}
+
+    ###########################################################################
+    #
+    def test_tombstones(self):
+        """
+        Test that final jobs are compacted
+        """
+        self.cache.put("a", self.info("a", "Running"))
+        self.assertEqual(self.cache["a"]['state'], "Running")
+        self.assertEqual(self.cache.put("a", self.info("a", "Done")),
+                         ("tombstone", "a"))
+        self.assertEqual(self.cache.get("a"), ("tombstone", "a"))
+        self.assertEqual(self.cache.stats()['final'], 1)
+
+    ###########################################################################
+    #
+    def test_lru(self):
+        """
+        Test that the least recently used final jobs are evicted first
+        """
+        cache = JobCache(4, is_final=lambda info: info['state'] == "Done",
+                         on_evict=self.evicted.append)
+        for jobid in ["r1", "r2"]:
+            cache[jobid] = self.info(jobid, "Running")
+        for jobid in ["d1", "d2", "d3"]:
+            cache[jobid] = self.info(jobid, "Done")
+            cache.get("d1")  # keeps d1 in use
+        self.assertEqual(self.evicted, ["d2"])
+        self.assertEqual(len(cache), 4)
+
+        # running jobs are never evicted, even if the cache overflows
+        for jobid in ["r3", "r4", "r5"]:
+            cache[jobid] = self.info(jobid, "Running")
+        self.assertEqual(self.evicted, ["d2", "d3", "d1"])
+        self.assertEqual(len(cache), 5)
+        self.assertEqual(cache.stats()['evictions'], 3)
+
+        self.assertEqual(cache.pop("r1")['id'], "r1")
+        self.assertEqual(cache.pop("r1"), None)
+        self.assertRaises(KeyError, cache.__getitem__, "d1")
+
+    ###########################################################################
+    #
+    def test_size(self):
+        """
+        Test the job_cache_size URL parameter
+        """
+        self.assertEqual(get_job_cache_size(saga.Url("pbs://host"), 10), 10)
+        self.assertEqual(get_job_cache_size(saga.Url("pbs://host?job_cache_size=5")), 5)
+        self.assertRaises(JobCacheException, get_job_cache_size,
+                          saga.Url("pbs://host?job_cache_size=0"))
+        self.assertRaises(JobCacheException, JobCache, 0, lambda info: False)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import os
+import pipes
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from bliss.utils.jobstatus import wrap_command, succeeded_command, \
+  collect_command, parse_collected
+
+###############################################################################
+#
+class JobStatusTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.jobstatus
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.home = tempfile.mkdtemp()
+        self.status_dir = ".bliss/status"
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def run_sh(self, command, env={}):
+        environ = dict(os.environ)
+        environ['HOME'] = self.home
+        environ.update(env)
+        shell = subprocess.Popen(["/bin/sh", "-c", command], env=environ,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (out, err) = shell.communicate()
+        return (shell.returncode, out)
+
+    ###########################################################################
+    #
+    def test_parse_collected(self):
+        """
+        Test that 'end' lines are parsed, and everything else is ignored
+        """
+        output = "17.server:end 1350000000 0\n" \
+                 "18.server:end 1350000060 137 \n" \
+                 "19.server:start 1350000000\n" \
+                 "20.server:end 1350000000\n" \
+                 "grep: 21.server: No such file or directory\n" \
+                 "22[3].server:end 1350000120 1\r\n"
+        self.assertEqual(parse_collected(output),
+                         {"17.server": (1350000000, 0),
+                          "18.server": (1350000060, 137),
+                          "22[3].server": (1350000120, 1)})
+        self.assertEqual(parse_collected(""), {})
+
+    ###########################################################################
+    #
+    def test_collect(self):
+        """
+        Test the marker files of wrapped commands, from writing them to
+        collecting and removing them
+        """
+        for (native_id, command) in [("1.server", "true"),
+                                     ("2.server", "sh -c 'exit 3'"),
+                                     ("3[1].server", "true")]:
+            (rc, out) = self.run_sh(wrap_command(command, self.status_dir,
+                                                 "$JOBID"), {'JOBID': native_id})
+            self.assertEqual(rc, 0 if command == "true" else 3)
+
+        condition = succeeded_command(self.status_dir, ["1.server", "3[1].server"],
+                                      pipes.quote)
+        self.assertEqual(self.run_sh(condition)[0], 0)
+        condition = succeeded_command(self.status_dir, ["1.server", "2.server"],
+                                      pipes.quote)
+        self.assertEqual(self.run_sh(condition)[0], 1)
+
+        command = collect_command(self.status_dir,
+                                  ["1.server", "2.server", "3[1].server", "4.server"],
+                                  quote=pipes.quote, max_age=3)
+        (rc, out) = self.run_sh(command)
+        self.assertEqual(rc, 0)
+        collected = parse_collected(out)
+        self.assertEqual(sorted(collected.keys()),
+                         ["1.server", "2.server", "3[1].server"])
+        self.assertEqual(collected["2.server"][1], 3)
+
+        command = collect_command(self.status_dir, ["2.server"],
+                                  remove_ids=["1.server", "3[1].server"],
+                                  quote=pipes.quote)
+        (rc, out) = self.run_sh(command)
+        self.assertEqual(parse_collected(out).keys(), ["2.server"])
+        self.assertEqual(os.listdir(os.path.join(self.home, self.status_dir)),
+                         ["2.server"])
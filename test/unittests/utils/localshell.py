@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import unittest
+
+from bliss.utils.localshell import LocalShellConnection, LocalShellException
+
+###############################################################################
+#
+class LocalShellTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.localshell.LocalShellConnection
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.shell = LocalShellConnection()
+        self.shell.login()
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        self.shell.logout()
+
+    ###########################################################################
+    #
+    def test_execute(self):
+        """
+        Test execute() and execute_many()
+        """
+        result = self.shell.execute("echo out; echo err >&2; (exit 3)")
+        self.assertEqual(result['exitcode'], 3)
+        self.assertEqual(result['output'].strip(), "out")
+        self.assertEqual(result['stderr'].strip(), "err")
+
+        # the exit code of one command doesn't affect the next ones
+        results = self.shell.execute_many(["echo a", "false", "echo b"])
+        self.assertEqual([r['exitcode'] for r in results], [0, 1, 0])
+        self.assertEqual([r['output'].strip() for r in results], ["a", "", "b"])
+
+    ###########################################################################
+    #
+    def test_command_timeout(self):
+        """
+        Test that a hung command is killed after command_timeout
+        """
+        self.shell.command_timeout = 1
+        start = time.time()
+        try:
+            self.shell.execute("sleep 10")
+            self.fail("A command that times out should raise")
+        except LocalShellException:
+            pass
+        self.assertTrue(time.time() - start < 3,
+          "Timeout took %.1fs" % (time.time() - start))
+
+        # the next command gets a new shell
+        self.assertEqual(self.shell.execute("echo ok")['output'].strip(), "ok")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+import bliss.utils.nodeinventory as nodeinventory
+from bliss.utils.nodeinventory import NodeInventoryBuilder, memory_to_kb
+
+###############################################################################
+#
+class NodeInventoryTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.nodeinventory.NodeInventory, with and without
+    NumPy
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.numpy = nodeinventory.numpy
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        nodeinventory.numpy = self.numpy
+
+    def build(self):
+        builder = NodeInventoryBuilder()
+        builder.append("n1", np=8, used=0, state="free",
+                       physmem=memory_to_kb("64gb"), load=0.1,
+                       properties=["gpu"])
+        builder.append("n2", np=8, used=6, state="job-exclusive",
+                       physmem=memory_to_kb("32gb"), load=6.0)
+        builder.append("n3", np=16, used=0, state="down,offline",
+                       physmem=memory_to_kb("128gb"), load=0.0,
+                       properties=["gpu", "bigmem"])
+        builder.append("n4", np=4, used=1, state="free",
+                       physmem=memory_to_kb("16gb"), load=1.5)
+        return builder.build()
+
+    def check_select(self):
+        inv = self.build()
+        self.assertEqual(inv.names(inv.select()), ["n1", "n2", "n3", "n4"])
+        self.assertEqual(inv.names(inv.select(state="free")), ["n1", "n4"])
+        self.assertEqual(inv.names(inv.select(exclude_state="down")),
+                         ["n1", "n2", "n4"])
+        self.assertEqual(inv.names(inv.select(min_np=8)), ["n1", "n2", "n3"])
+        self.assertEqual(inv.names(inv.select(min_free=3)), ["n1", "n3", "n4"])
+        self.assertEqual(inv.names(inv.select(min_physmem=64*1024**2)),
+                         ["n1", "n3"])
+        self.assertEqual(inv.names(inv.select(max_load=1.5)),
+                         ["n1", "n3", "n4"])
+        self.assertEqual(inv.names(inv.select(properties=["gpu"])),
+                         ["n1", "n3"])
+        self.assertEqual(inv.names(inv.select(properties=["gpu", "bigmem"])),
+                         ["n3"])
+        self.assertEqual(inv.names(inv.select(properties=["infiniband"])), [])
+
+        mask = inv.select(exclude_state="down,offline", min_free=2)
+        self.assertEqual(inv.names(mask), ["n1", "n2", "n4"])
+        self.assertEqual(inv.count(mask), 3)
+        self.assertEqual(inv.cores(mask), 20)
+        self.assertEqual(inv.free_cores(mask), 13)
+        self.assertEqual(inv.nodes_per_property(mask), {"gpu": 1, "bigmem": 0})
+
+        self.assertEqual(inv.count(), 4)
+        self.assertEqual(inv.cores(), 36)
+        # n3 is down, so its cores don't count as free
+        self.assertEqual(inv.free_cores(), 13)
+        self.assertEqual(inv.nodes_per_property(), {"gpu": 2, "bigmem": 1})
+
+    ###########################################################################
+    #
+    def test_select_without_numpy(self):
+        """
+        Test select() and the aggregates on 'array' columns
+        """
+        nodeinventory.numpy = None
+        self.check_select()
+
+    ###########################################################################
+    #
+    def test_select_with_numpy(self):
+        """
+        Test select() and the aggregates on NumPy columns
+        """
+        if self.numpy is None:
+            self.skipTest("NumPy isn't installed")
+        self.check_select()
+
+    ###########################################################################
+    #
+    def test_memory_to_kb(self):
+        """
+        Test the conversion of PBS memory sizes
+        """
+        self.assertEqual(memory_to_kb("1024mb"), 1024.0**2)
+        self.assertEqual(memory_to_kb("2048"), 2.0)
+        self.assertEqual(memory_to_kb("1kw"), 8.0)
+        self.assertEqual(memory_to_kb("lots"), 0.0)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import time
+import threading
+import unittest
+
+from bliss.utils.command_wrapper import CommandWrapperResult
+from bliss.utils.querycache import QueryCache, QueryCacheException
+
+###############################################################################
+#
+class QueryCacheTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.querycache.QueryCache
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.calls = list()
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        pass
+
+    def query(self, result, delay=0):
+        def run():
+            self.calls.append(result)
+            time.sleep(delay)
+            return result
+        return run
+
+    ###########################################################################
+    #
+    def test_single_flight(self):
+        """
+        Test that concurrent queries for the same key run only once
+        """
+        cache = QueryCache(ttl=0)
+        results = list()
+        def worker():
+            results.append(cache.get("qstat", self.query("out", 0.5)))
+        threads = [threading.Thread(target=worker) for i in range(0, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["out"] * 5)
+        self.assertEqual(self.calls, ["out"])
+        stats = cache.stats()
+        self.assertEqual((stats['misses'], stats['coalesced']), (1, 4))
+
+        # errors are shared, too, but not cached
+        def fail():
+            self.calls.append("fail")
+            raise ValueError("qstat failed")
+        self.assertRaises(ValueError, cache.get, "fail", fail)
+        self.assertRaises(ValueError, cache.get, "fail", fail)
+        self.assertEqual(self.calls.count("fail"), 2)
+
+    ###########################################################################
+    #
+    def test_ttl(self):
+        """
+        Test that results expire after the TTL
+        """
+        cache = QueryCache(ttl=0.3)
+        self.assertEqual(cache.get("a", self.query(1)), 1)
+        self.assertEqual(cache.get("a", self.query(2)), 1)
+        time.sleep(0.4)
+        self.assertEqual(cache.get("a", self.query(3)), 3)
+        # (a longer ttl for this call)
+        time.sleep(0.4)
+        self.assertEqual(cache.get("a", self.query(4), ttl=10), 3)
+
+        cache.invalidate()
+        self.assertEqual(cache.get("a", self.query(5)), 5)
+        self.assertEqual(self.calls, [1, 3, 5])
+
+    ###########################################################################
+    #
+    def test_eviction(self):
+        """
+        Test that expired results are dropped when new ones are cached
+        """
+        cache = QueryCache(ttl=0.2)
+        for key in range(0, 10):
+            cache.get(key, self.query(key))
+        self.assertEqual(cache.stats()['cached'], 10)
+        time.sleep(0.3)
+        cache.get("new", self.query("new"))
+        self.assertEqual(cache.stats()['cached'], 1)
+
+    ###########################################################################
+    #
+    def test_returncode(self):
+        """
+        Test that results with a non-zero return code aren't cached
+        """
+        cache = QueryCache(ttl=10)
+        ok = CommandWrapperResult(command="qstat", stdout="", stderr="",
+                                  returncode=0)
+        failed = CommandWrapperResult(command="qstat", stdout="", stderr="",
+                                      returncode=153)
+        cache.get("ok", self.query(ok))
+        cache.get("ok", self.query(ok))
+        cache.get("failed", self.query(failed))
+        cache.get("failed", self.query(failed))
+        cache.get("many", self.query([ok, failed]))
+        cache.get("many", self.query([ok, failed]))
+        self.assertEqual(len(self.calls), 5)
+
+    ###########################################################################
+    #
+    def test_interrupted(self):
+        """
+        Test that callers waiting for a query that is interrupted (e.g.,
+        by KeyboardInterrupt) don't wait forever
+        """
+        cache = QueryCache(ttl=10)
+        started = threading.Event()
+        def interrupted():
+            started.set()
+            time.sleep(0.5)
+            raise KeyboardInterrupt()
+        errors = list()
+        def worker():
+            started.wait()
+            try:
+                cache.get("qstat", self.query("out"))
+            except QueryCacheException, ex:
+                errors.append(ex)
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+        self.assertRaises(KeyboardInterrupt, cache.get, "qstat", interrupted)
+        thread.join(5)
+        self.assertFalse(thread.isAlive())
+        self.assertEqual(len(errors), 1)
+        # the next caller runs the query again
+        self.assertEqual(cache.get("qstat", self.query("out")), "out")
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import unittest
+
+from bliss.utils.statepoller import JobStatePoller, JobStatePollerException
+
+###############################################################################
+#
+class JobStatePollerTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.statepoller.JobStatePoller
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.states = dict()
+        self.queries = list()
+        self.error = None
+        self.poller = JobStatePoller(self.refresh, final_states=["Done"],
+                                     queued_states=["Pending"])
+        self.poller.running_interval = 0.1
+        self.poller.queued_interval = 0.1
+        self.poller.max_staleness = 0.05
+        self.poller.sweep_timeout = 5
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        self.poller.stop()
+
+    def refresh(self, jobids):
+        self.queries.append(sorted(jobids))
+        if self.error is not None:
+            raise self.error
+        return dict([(j, self.states.get(j, "Unknown")) for j in jobids])
+
+    ###########################################################################
+    #
+    def test_bulk(self):
+        """
+        Test that stale jobs are refreshed with one query per sweep
+        """
+        for jobid in ["a", "b", "c"]:
+            self.states[jobid] = "Running"
+        self.assertEqual(self.poller.get_states(["a", "b", "c"]),
+                         ["Running"] * 3)
+        self.assertEqual(self.queries[0], ["a", "b", "c"])
+
+        # final jobs aren't polled anymore
+        self.states["a"] = "Done"
+        self.states["b"] = "Done"
+        self.states["c"] = "Done"
+        self.assertEqual(self.poller.wait(["a", "b", "c"], timeout=5),
+                         ["a", "b", "c"])
+        queries = len(self.queries)
+        self.assertEqual(self.poller.get_state("a"), "Done")
+        self.assertEqual(len(self.queries), queries)
+        self.assertEqual(self.poller.stats()['active'], 0)
+
+    ###########################################################################
+    #
+    def test_update(self):
+        """
+        Test that states that are known otherwise are taken as they are
+        """
+        self.poller.max_staleness = 10
+        self.poller.track("a", "Pending")
+        self.poller.update("b", "Done")
+        self.assertEqual(self.poller.get_states(["a", "b"]), ["Pending", "Done"])
+        self.assertEqual(self.queries, [])
+        self.poller.forget("a")
+        self.assertEqual(self.poller.stats()['tracked'], 1)
+
+    ###########################################################################
+    #
+    def test_error(self):
+        """
+        Test that a failed query is reported to the callers
+        """
+        self.error = ValueError("qstat failed")
+        self.assertRaises(JobStatePollerException, self.poller.get_state, "a")
+        self.error = None
+        self.states["a"] = "Running"
+        self.assertEqual(self.poller.get_state("a"), "Running")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+__author__    = "Ole Christian Weidner"
+__copyright__ = "Copyright 2012, Ole Christian Weidner"
+__license__   = "MIT"
+
+import threading
+import unittest
+
+from bliss.utils.submitpipeline import SubmissionPipeline
+
+###############################################################################
+#
+class SubmissionPipelineTests(unittest.TestCase):
+    """
+    Tests for bliss.utils.submitpipeline.SubmissionPipeline
+    """
+    def setUp(self):
+        # Fixture:
+        # called immediately before calling the test method
+        self.submitted = list()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def tearDown(self):
+        # Fixture:
+        # called immediately after the test method has been called
+        self.gate.set()
+
+    def submit(self, jobs):
+        # jobs are numbers; odd ones fail, and 'raise' fails the batch
+        self.gate.wait()
+        if 'raise' in jobs:
+            raise RuntimeError("batch failed")
+        results = list()
+        for job in jobs:
+            if job % 2:
+                results.append(ValueError("job %s failed" % job))
+            else:
+                results.append("info-%s" % job)
+        return results
+
+    ###########################################################################
+    #
+    def test_back_pressure(self):
+        """
+        Test that enqueue() blocks while max_in_flight jobs are queued
+        """
+        pipeline = SubmissionPipeline(self.submit, max_in_flight=2, batch_size=1)
+        self.gate.clear()
+        pipeline.enqueue(0, 0, self.submitted.append)
+        pipeline.enqueue(2, 2, self.submitted.append)
+
+        third = threading.Thread(target=pipeline.enqueue,
+                                 args=(4, 4, self.submitted.append))
+        third.start()
+        third.join(0.5)
+        self.assertTrue(third.isAlive())
+        self.assertTrue(pipeline.is_pending(0))
+        self.assertFalse(pipeline.is_pending(4))
+
+        self.gate.set()
+        third.join(5)
+        self.assertFalse(third.isAlive())
+        pipeline.flush()
+        self.assertEqual(self.submitted, ["info-0", "info-2", "info-4"])
+        stats = pipeline.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['in_flight'], 0)
+
+    ###########################################################################
+    #
+    def test_failures(self):
+        """
+        Test that settle() raises the exception of a failed submission
+        """
+        def on_submitted(jobinfo):
+            if jobinfo == "info-4":
+                raise KeyError("callback failed")
+            self.submitted.append(jobinfo)
+        pipeline = SubmissionPipeline(self.submit, batch_size=10)
+        self.gate.clear()
+        for job in range(0, 5):
+            pipeline.enqueue(job, job, on_submitted)
+        self.gate.set()
+
+        pipeline.settle(0)
+        self.assertRaises(ValueError, pipeline.settle, 1)
+        self.assertRaises(KeyError, pipeline.settle, 4)
+        # (still known on the next call)
+        self.assertRaises(ValueError, pipeline.settle, 1)
+        self.assertEqual(self.submitted, ["info-0", "info-2"])
+
+        # the exception of submit() fails the whole batch
+        pipeline.enqueue("a", 'raise', on_submitted)
+        self.assertRaises(RuntimeError, pipeline.settle, "a")
+
+        # a job that is enqueued again is no longer failed
+        pipeline.enqueue(1, 0, on_submitted)
+        pipeline.settle(1)
+        self.assertEqual(pipeline.stats()['failed'], 4)
+
+    ###########################################################################
+    #
+    def test_max_failed(self):
+        """
+        Test that only the last max_failed failures are kept
+        """
+        pipeline = SubmissionPipeline(self.submit, batch_size=1, max_failed=2)
+        for job in [1, 3, 5]:
+            pipeline.enqueue(job, job, self.submitted.append)
+        pipeline.flush()
+        pipeline.settle(1)
+        self.assertRaises(ValueError, pipeline.settle, 3)
+        self.assertRaises(ValueError, pipeline.settle, 5)
+        self.assertEqual(len(pipeline._failed), 2)